@@ -1,32 +1,36 @@
 import streamlit as st
 import google.generativeai as genai
-import pypdf
+import functools
+import logging
 import os
 import time
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from dotenv import load_dotenv
 from streamlit_local_storage import LocalStorage
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
-import faiss
-
-# --- Configuration ---
-load_dotenv()
-PDF_DIR = "data"
-FAISS_INDEX_PATH = "vectordb"
-GEMINI_EMBEDDING_MODEL = "models/embedding-001"
-GEMINI_GENERATIVE_MODEL = "gemini-1.5-flash"
-CHUNK_SIZE = 1500
-CHUNK_OVERLAP = 150
 
-# --- Language Configuration ---
-LANGUAGES = {
-    "en": "English",
-    "es": "Español",
-    "am": "አማርኛ", 
-    "ar": "العربية"  
-}
+from config import (
+    PDF_DIR,
+    FAISS_INDEX_PATH,
+    GEMINI_EMBEDDING_MODEL,
+    LANGUAGES,
+    STREAM_RESPONSES,
+    CONTEXT_CANDIDATES,
+    METRICS_PORT,
+    SERVICE_URL,
+)
+import index_registry
+import metrics
+import query_cache
+import rag
+import rebuild
+import service_client
+from ingest import open_vector_store
+from context_assembly import cite_sources
+from embedding_cache import CachedEmbeddings
+from index_versions import active_index_path
+from sharded_store import ROOT_COLLECTION, ShardedStore, filter_options, load_catalog
+from vector_store import store_exists
 
+# --- Language Configuration ---
 TEXTS = {
     "en": {
         "page_title": "Bioinformatics Chat",
@@ -40,13 +44,11 @@ TEXTS = {
         "history_cleared_success": "Chat history cleared.",
         "db_management_header": "Database Management",
         "recreate_db_button": "Re-create Knowledge Base",
-        "recreate_db_help": "Deletes the current FAISS index ({}) and re-processes PDFs from '{}'. This requires a restart.",
-        "deleting_db_spinner": "Attempting to delete existing FAISS index and clear cache...",
-        "deleted_db_success": "Deleted FAISS index files in: {}",
-        "delete_db_error": "Error deleting FAISS index files in {}: {}. Manual deletion might be required.",
-        "db_not_found_info": "FAISS index not found, nothing to delete.",
-        "cleared_cache_success": "Cleared Streamlit cache. Please refresh the page or restart the app to rebuild the knowledge base.",
-        "delete_db_warning": "Could not delete FAISS index. Cache not cleared. Please restart the app manually.",
+        "recreate_db_help": "Builds a new knowledge base from the PDFs in '{}' in the background; questions are answered from the current one until it is ready.",
+        "rebuild_progress": "Rebuilding: {} of {} PDFs, {} chunks, {} embedded",
+        "rebuild_done": "Knowledge base rebuilt.",
+        "rebuild_failed": "Rebuilding the knowledge base failed: {}",
+        "rebuild_start_error": "Could not start the rebuild: {}",
         "api_key_needed_info": "Please enter your Google AI API Key in the sidebar to begin.",
         "invalid_api_key_error": "Invalid API Key or configuration error. Please check the key in the sidebar. Error: {}",
         "init_spinner": "Initializing knowledge base... This may take a few minutes the first time.",
@@ -58,7 +60,9 @@ TEXTS = {
         "response_error": "Sorry, I encountered an error while generating the response.",
         "language_header": "Language / Idioma / ቋንቋ / اللغة",
         "sources": "Sources",
-        "settings_button": "⚙️ Settings"
+        "settings_button": "⚙️ Settings",
+        "cache_stats": "Cache hit rate: queries {:.0%}, answers {:.0%}",
+        "search_filter_label": "Search only in"
     },
     "es": {
         "page_title": "Chat de Bioinformática",
@@ -72,13 +76,11 @@ TEXTS = {
         "history_cleared_success": "Historial de chat limpiado.",
         "db_management_header": "Gestión de Base de Datos",
         "recreate_db_button": "Recrear Base de Conocimiento",
-        "recreate_db_help": "Elimina el índice FAISS actual ({}) y reprocesa los PDFs de '{}'. Requiere reiniciar.",
-        "deleting_db_spinner": "Intentando eliminar el índice FAISS existente y limpiar caché...",
-        "deleted_db_success": "Archivos de índice FAISS eliminados en: {}",
-        "delete_db_error": "Error al eliminar archivos de índice FAISS en {}: {}. Puede requerir eliminación manual.",
-        "db_not_found_info": "Índice FAISS no encontrado, nada que eliminar.",
-        "cleared_cache_success": "Caché de Streamlit limpiada. Por favor, actualiza la página o reinicia la app para reconstruir la base de conocimiento.",
-        "delete_db_warning": "No se pudo eliminar el índice FAISS. Caché no limpiada. Por favor, reinicia la app manualmente.",
+        "recreate_db_help": "Construye en segundo plano una nueva base de conocimiento a partir de los PDFs de '{}'; las preguntas se responden con la actual hasta que esté lista.",
+        "rebuild_progress": "Reconstruyendo: {} de {} PDFs, {} fragmentos, {} incrustados",
+        "rebuild_done": "Base de conocimiento reconstruida.",
+        "rebuild_failed": "La reconstrucción de la base de conocimiento falló: {}",
+        "rebuild_start_error": "No se pudo iniciar la reconstrucción: {}",
         "api_key_needed_info": "Por favor, introduce tu Clave API de Google AI en la barra lateral para comenzar.",
         "invalid_api_key_error": "Clave API inválida o error de configuración. Por favor, revisa la clave en la barra lateral. Error: {}",
         "init_spinner": "Inicializando base de conocimiento... Esto puede tardar unos minutos la primera vez.",
@@ -90,7 +92,9 @@ TEXTS = {
         "response_error": "Lo siento, encontré un error al generar la respuesta.",
         "language_header": "Idioma / Language / ቋንቋ / اللغة",
         "sources": "Fuentes",
-        "settings_button": "⚙️ Configuración"
+        "settings_button": "⚙️ Configuración",
+        "cache_stats": "Tasa de aciertos de caché: consultas {:.0%}, respuestas {:.0%}",
+        "search_filter_label": "Buscar solo en"
     },
     "am": {
         "page_title": "ባዮኢንፎርማቲክስ ውይይት",
@@ -104,13 +108,11 @@ TEXTS = {
         "history_cleared_success": "የውይይት ታሪክ ጸድቷል።",
         "db_management_header": "የውሂብ ጎታ አስተዳደር",
         "recreate_db_button": "የእውቀት መሰረትን እንደገና ፍጠር",
-        "recreate_db_help": "የአሁኑን የFAISS መረጃ ጠቋሚ ({}) ይሰርዛል እና ፒዲኤፎችን ከ '{}' እንደገና ያስኬዳል። እንደገና ማስጀመር ያስፈልገዋል።",
-        "deleting_db_spinner": "ያለውን የFAISS መረጃ ጠቋሚ ለመሰረዝ እና መሸጎጫ ለማጽዳት በመሞከር ላይ...",
-        "deleted_db_success": "የFAISS መረጃ ጠቋሚ ፋይሎች ተሰርዘዋል በ: {}",
-        "delete_db_error": "የFAISS መረጃ ጠቋሚ ፋይሎችን በ {} ለመሰረዝ ስህተት፡ {}. በእጅ መሰረዝ ሊያስፈልግ ይችላል።",
-        "db_not_found_info": "የFAISS መረጃ ጠቋሚ አልተገኘም፣ የሚሰረዝ ምንም ነገር የለም።",
-        "cleared_cache_success": "የStreamlit መሸጎጫ ጸድቷል። እባክዎ የእውቀት መሰረቱን እንደገና ለመገንባት ገጹን ያድሱ ወይም መተግበሪያውን እንደገና ያስጀምሩ።",
-        "delete_db_warning": "የFAISS መረጃ ጠቋሚን መሰረዝ አልተቻለም። መሸጎጫ አልጸዳም። እባክዎ መተግበሪያውን በእጅ እንደገና ያስጀምሩ።",
+        "recreate_db_help": "ከ '{}' ፒዲኤፎች አዲስ የእውቀት መሰረት በጀርባ ይገነባል፤ እስኪዘጋጅ ድረስ ጥያቄዎች ከአሁኑ ይመለሳሉ።",
+        "rebuild_progress": "እንደገና በመገንባት ላይ፡ {} ከ {} ፒዲኤፎች፣ {} ክፍሎች፣ {} ተካትተዋል",
+        "rebuild_done": "የእውቀት መሰረቱ እንደገና ተገንብቷል።",
+        "rebuild_failed": "የእውቀት መሰረቱን እንደገና መገንባት አልተሳካም፡ {}",
+        "rebuild_start_error": "እንደገና መገንባቱን መጀመር አልተቻለም፡ {}",
         "api_key_needed_info": "ለመጀመር እባክዎ የGoogle AI ኤፒአይ ቁልፍዎን በጎን አሞሌው ውስጥ ያስገቡ።",
         "invalid_api_key_error": "ልክ ያልሆነ የኤፒአይ ቁልፍ ወይም የማዋቀር ስህተት። እባክዎ በጎን አሞሌው ውስጥ ያለውን ቁልፍ ያረጋግጡ። ስህተት፡ {}",
         "init_spinner": "የእውቀት መሰረትን በማስጀመር ላይ... ይህ ለመጀመሪያ ጊዜ ጥቂት ደቂቃዎችን ሊወስድ ይችላል።",
@@ -122,7 +124,9 @@ TEXTS = {
         "response_error": "ይቅርታ፣ ምላሹን በማመንጨት ላይ ሳለ ስህተት አጋጥሞኛል።",
         "language_header": "ቋንቋ / Language / Idioma / اللغة",
         "sources": "ምንጮች",
-        "settings_button": "⚙️ ማዋቀር"
+        "settings_button": "⚙️ ማዋቀር",
+        "cache_stats": "የመሸጎጫ ምጣኔ፡ ጥያቄዎች {:.0%}፣ መልሶች {:.0%}",
+        "search_filter_label": "በእነዚህ ውስጥ ብቻ ፈልግ"
     },
     "ar": {
         "page_title": "دردشة المعلوماتية الحيوية",
@@ -136,13 +140,11 @@ TEXTS = {
         "history_cleared_success": "تم مسح سجل الدردشة.",
         "db_management_header": "إدارة قاعدة البيانات",
         "recreate_db_button": "إعادة إنشاء قاعدة المعرفة",
-        "recreate_db_help": "يحذف فهرس FAISS الحالي ({}) ويعيد معالجة ملفات PDF من '{}'. يتطلب إعادة التشغيل.",
-        "deleting_db_spinner": "جاري محاولة حذف فهرس FAISS الحالي ومسح ذاكرة التخزين المؤقت...",
-        "deleted_db_success": "تم حذف ملفات فهرس FAISS في: {}",
-        "delete_db_error": "خطأ في حذف ملفات فهرس FAISS في {}: {}. قد يتطلب الحذف اليدوي.",
-        "db_not_found_info": "لم يتم العثور على فهرس FAISS، لا يوجد شيء لحذفه.",
-        "cleared_cache_success": "تم مسح ذاكرة التخزين المؤقت لـ Streamlit. يرجى تحديث الصفحة أو إعادة تشغيل التطبيق لإعادة بناء قاعدة المعرفة.",
-        "delete_db_warning": "تعذر حذف فهرس FAISS. لم يتم مسح ذاكرة التخزين المؤقت. يرجى إعادة تشغيل التطبيق يدويًا.",
+        "recreate_db_help": "ينشئ قاعدة معرفة جديدة من ملفات PDF في '{}' في الخلفية؛ تتم الإجابة عن الأسئلة من القاعدة الحالية حتى تصبح جاهزة.",
+        "rebuild_progress": "جارٍ إعادة البناء: {} من {} ملفات PDF، {} مقاطع، {} مضمنة",
+        "rebuild_done": "تمت إعادة بناء قاعدة المعرفة.",
+        "rebuild_failed": "فشلت إعادة بناء قاعدة المعرفة: {}",
+        "rebuild_start_error": "تعذر بدء إعادة البناء: {}",
         "api_key_needed_info": "الرجاء إدخال مفتاح Google AI API الخاص بك في الشريط الجانبي للبدء.",
         "invalid_api_key_error": "مفتاح API غير صالح أو خطأ في التكوين. يرجى التحقق من المفتاح في الشريط الجانبي. الخطأ: {}",
         "init_spinner": "جاري تهيئة قاعدة المعرفة... قد يستغرق هذا بضع دقائق في المرة الأولى.",
@@ -154,175 +156,186 @@ TEXTS = {
         "response_error": "عذرًا، واجهت خطأ أثناء إنشاء الرد.",
         "language_header": "اللغة / Language / Idioma / ቋንቋ",
         "sources": "المصادر",
-        "settings_button": "⚙️ الإعدادات"
+        "settings_button": "⚙️ الإعدادات",
+        "cache_stats": "معدل إصابة ذاكرة التخزين المؤقت: الاستعلامات {:.0%}، الإجابات {:.0%}",
+        "search_filter_label": "البحث فقط في"
     }
 }
 
 # --- Helper Functions ---
 
-@st.cache_data
-def load_and_process_pdfs():
-    """Loads PDFs from global PDF_DIR, extracts text, and splits into chunks."""
-    pdf_directory = PDF_DIR
-    all_texts = []
-    if not os.path.exists(pdf_directory):
-        st.error(f"PDF directory '{pdf_directory}' not found. Please create it and add your PDFs.")
-        return None, None
-
-    pdf_files = [f for f in os.listdir(pdf_directory) if f.lower().endswith(".pdf")]
-    if not pdf_files:
-        st.warning(f"No PDF files found in '{pdf_directory}'.")
-        return None, None
-
-    total_files = len(pdf_files)
-
-    for i, filename in enumerate(pdf_files):
-        filepath = os.path.join(pdf_directory, filename)
-        try:
-            reader = pypdf.PdfReader(filepath)
-            file_text = ""
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    file_text += page_text + "\n"
-            if file_text:
-                all_texts.append({"filename": filename, "content": file_text})
-            else:
-                st.warning(f"Could not extract text from '{filename}'. Skipping.")
-        except Exception as e:
-            st.error(f"Error reading '{filename}': {e}")
-
-    if not all_texts:
-        st.error("No text could be extracted from any PDF files.")
-        return None, None
-
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
+@st.cache_resource
+def get_embeddings(api_key):
+    """Returns the cached Gemini embeddings client for an API key."""
+    return CachedEmbeddings(
+        GoogleGenerativeAIEmbeddings(model=GEMINI_EMBEDDING_MODEL, google_api_key=api_key),
+        GEMINI_EMBEDDING_MODEL,
     )
 
-    all_chunks = []
-    metadatas = []
-    chunk_id_counter = 0
-
-    for doc in all_texts:
-        chunks = text_splitter.split_text(doc["content"])
-        for chunk_idx, chunk in enumerate(chunks):
-            all_chunks.append(chunk)
-            metadatas.append({"source": doc["filename"], "chunk": chunk_idx})
-            chunk_id_counter += 1
-
-    return all_chunks, metadatas
-
-@st.cache_resource(ttl=3600)
-def setup_faiss_vector_store(chunks, metadatas, api_key):
-    """Creates or loads a FAISS vector store with Gemini embeddings."""
-    if not chunks or not metadatas:
-        st.error("No text chunks available to create vector store.")
+@st.cache_resource
+def validate_api_key(api_key):
+    """Probes the API once per key and process; a failed probe raises and is not cached."""
+    genai.configure(api_key=api_key)
+    with metrics.span("api_key_check"):
+        next(iter(genai.list_models()), None)
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """Serves /metrics once per process when ANYBIO_METRICS_PORT is set."""
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+
+def open_faiss_vector_store(api_key):
+    """Opens the persisted FAISS vector store memory-mapped, syncing it with PDF_DIR first if the PDFs changed."""
+    index_path = active_index_path(FAISS_INDEX_PATH)
+    index_saved = store_exists(index_path) or load_catalog(index_path) is not None
+    if not index_saved and not os.path.exists(PDF_DIR):
+        st.error(f"PDF directory '{PDF_DIR}' not found. Please create it and add your PDFs.")
         return None
 
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(model=GEMINI_EMBEDDING_MODEL, google_api_key=api_key)
-
-        if os.path.exists(FAISS_INDEX_PATH):
-            try:
-                vector_store = FAISS.load_local(
-                    FAISS_INDEX_PATH,
-                    embeddings,
-                    allow_dangerous_deserialization=True
-                )
-                return vector_store
-            except Exception as load_e:
-                st.warning(f"Failed to load existing FAISS index ({load_e}). Rebuilding...")
-
-        vector_store = FAISS.from_texts(chunks, embedding=embeddings, metadatas=metadatas)
-        vector_store.save_local(FAISS_INDEX_PATH)
-        
+        with metrics.trace("startup"):
+            vector_store = open_vector_store(lambda: get_embeddings(api_key), PDF_DIR, FAISS_INDEX_PATH)
+        if vector_store is None:
+            st.error("No text chunks available to create vector store.")
         return vector_store
 
     except Exception as e:
         st.error(f"Failed to setup FAISS vector store: {e}")
         return None
 
-def get_relevant_context(query, vector_store, api_key, n_results=5):
-    """Retrieves relevant context from FAISS vector store."""
+def setup_faiss_vector_store(api_key):
+    """Returns the process-wide vector store, leased for this session.
+
+    All sessions share one store per saved index version whatever their API
+    key; it is reopened only when a new version has been saved (see index_registry).
+    """
+    lease = st.session_state.get("index_lease")
+    if lease is not None and lease.is_current():
+        return lease.store
+    open_store = functools.partial(open_faiss_vector_store, api_key)
+    if lease is not None:
+        lease = lease.renew(open_store)
+        # The version this session left may have been the last one in use.
+        rebuild.cleanup(FAISS_INDEX_PATH)
+    else:
+        lease = index_registry.acquire(FAISS_INDEX_PATH, open_store)
+    st.session_state.index_lease = lease
+    return lease.store if lease is not None else None
+
+def start_rebuild(api_key):
+    """Starts rebuilding the knowledge base in the background, here or in the service."""
+    if SERVICE_URL:
+        progress = service_client.start_rebuild()
+    else:
+        progress = rebuild.start(functools.partial(get_embeddings, api_key), PDF_DIR, FAISS_INDEX_PATH).progress()
+    # The outcome is reported to this session only.
+    st.session_state.rebuild_version = progress["version"]
+    st.session_state.pop("rebuild_reported", None)
+
+def rebuild_progress():
+    """Returns the progress of a running rebuild, run here or by the service, or of
+    the finished one this session started; None otherwise."""
+    if SERVICE_URL:
+        try:
+            progress = service_client.rebuild_progress()
+        except service_client.ServiceError:
+            return None
+    else:
+        job = rebuild.current_job()
+        progress = job.progress() if job is not None else {"state": "idle"}
+    if progress["state"] == "running" or (
+        progress["state"] != "idle" and progress["version"] == st.session_state.get("rebuild_version")
+    ):
+        return progress
+    return None
+
+@st.fragment(run_every=2)
+def show_rebuild_progress():
+    """Polls the rebuild's progress; sessions switch to the new index on their next interaction."""
+    progress = rebuild_progress()
+    if progress is None:
+        return
+    if progress["state"] == "running":
+        total = progress["files_total"]
+        st.progress(
+            min(progress["files"] / total, 1.0) if total else 0.0,
+            text=current_texts["rebuild_progress"].format(
+                progress["files"], total, progress["chunks"], progress["vectors"]
+            ),
+        )
+    else:
+        if progress["state"] == "failed":
+            st.error(current_texts["rebuild_failed"].format(progress["error"]))
+        else:
+            st.success(current_texts["rebuild_done"])
+        # Shown until the session's next interaction.
+        st.session_state.rebuild_reported = True
+
+@st.cache_data(ttl=60)
+def fetch_service_shards():
+    return service_client.shards()
+
+def search_filter_options(vector_store):
+    """Returns ("collections" or "sources", names) for the sidebar search filter, or (None, []) when the index is not sharded."""
+    if SERVICE_URL:
+        try:
+            shards = fetch_service_shards()
+        except service_client.ServiceError:
+            return None, []
+        return shards["filter_by"], shards["options"]
+    if isinstance(vector_store, ShardedStore):
+        return filter_options(vector_store.catalog)
+    return None, []
+
+def get_relevant_context(query, vector_store, api_key, n_results=CONTEXT_CANDIDATES, search_filter=None):
+    """Retrieves relevant context from FAISS vector store, or from the service in thin-client mode."""
+    if SERVICE_URL:
+        try:
+            return service_client.retrieve(query, n_results, search_filter)
+        except Exception as e:
+            st.error(f"Error retrieving context from the knowledge-base service: {e}")
+            return [], []
     if not vector_store:
         st.error("Vector store not initialized.")
         return [], []
     try:
-        results_with_scores = vector_store.similarity_search_with_score(query, k=n_results)
-        context_docs = [doc.page_content for doc, score in results_with_scores]
-        context_metadatas = [doc.metadata for doc, score in results_with_scores]
-        return context_docs, context_metadatas
+        return rag.get_relevant_context(query, vector_store, get_embeddings(api_key), n_results, search_filter)
     except Exception as e:
         st.error(f"Error retrieving context from FAISS: {e}")
         return [], []
 
-def generate_response(query, context_docs, context_metadatas, api_key, language="en"):
+def generate_response(query, context_docs, context_metadatas, api_key, language="en", index_version=None):
     """Generates response using Gemini based on query, context, and language."""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(GEMINI_GENERATIVE_MODEL)
-
-        context_string = ""
-        sources = set()
-        for doc, meta in zip(context_docs, context_metadatas):
-            source_file = meta.get('source', 'Unknown source')
-            context_string += f"Source: {source_file}\nContent:\n{doc}\n\n---\n\n"
-            sources.add(source_file)
-
-        language_name = LANGUAGES.get(language, "English") 
-        prompt = f"""You are a helpful assistant knowledgeable in bioinformatician assisting a biomedical research in a practical analysis of genomic data, answering questions based on the provided text snippets
-
-        In your  response you will be giving a practical assistance. To enable the researcher to make full use of your knowledge you will give a quick introduction on how these particular analysis will be structured. 
-        The response will be a combination of responding with the theory and how to perform bioinformatic analysis on real data.
-
-        Sections will be labelled according to its intended purpose and are described below:
-
-        General text:
-
-            Text which does not have any special formatting and looks (plain) like this will guide you through the practicals, providing background and explaining what anlyses we are performing, and why.
-            Checkpoints
-            Text which appears in boxes of this colour aims to inform you of a significant checkpoint in your analysis. When you see this, it is good to take a moment to think about what you have acomplished so far and what you have yet to do.
-        
-        Code:
-
-            Text which appears in boxes of this colour will tell that you are looking at a terminal command.
-            You can copy and paste from here straight to the terminal but before you do take a moment to understand what the command is actually doing.
-            Several command lines may be present, with each new line representing a single command. 
-
-        Screen output:
-
-            Text appearing in these boxes represents output you might expect to see in the terminal in response to a command.
-            Check to see if you get a similar output!
-
-        Questions:
-            Text in these boxes will usually ask an open ended question.
-
-        Answer:
-            You can answer the above questions in the text boxes provided.
-
-
-**Please provide the answer in {language_name}.**
-
-
-Context from documents:
-{context_string}
-
-Question:
-{query}
-
-Answer ({language_name}):
-"""
+        if SERVICE_URL:
+            return service_client.generate(query, context_docs, context_metadatas, language)
+        return rag.generate_response(query, context_docs, context_metadatas, api_key, language,
+                                     index_version=index_version)
+    except Exception as e:
+        st.error(f"{TEXTS[language]['response_error']}: {e}")
+        return TEXTS[language]['response_error']
 
-        response = model.generate_content(prompt)
-        response_text = response.text
-        return response_text
+def stream_response(message_placeholder, query, context_docs, context_metadatas, api_key, language="en",
+                    index_version=None):
+    """Renders the Gemini response into message_placeholder as it streams in.
 
+    Returns the full response and its generation timings.
+    """
+    try:
+        if SERVICE_URL:
+            stream = rag.ResponseStream(service_client.stream(query, context_docs, context_metadatas, language))
+        else:
+            stream = rag.stream_response(query, context_docs, context_metadatas, api_key, language,
+                                         index_version=index_version)
+        for _ in stream:
+            message_placeholder.markdown(stream.text + "▌")
+        message_placeholder.markdown(stream.text)
+        return stream.text, stream.timings()
     except Exception as e:
         st.error(f"{TEXTS[language]['response_error']}: {e}")
-        return TEXTS[language]['response_error']
+        message_placeholder.markdown(TEXTS[language]['response_error'])
+        return TEXTS[language]['response_error'], None
     
 
 # --- Streamlit App ---
@@ -397,72 +410,73 @@ with st.sidebar:
     
     # Database Management Section
     st.subheader(current_texts["db_management_header"])
-    if st.button(current_texts["recreate_db_button"], help=current_texts["recreate_db_help"].format(FAISS_INDEX_PATH, PDF_DIR)):
-        with st.spinner(current_texts["deleting_db_spinner"]):
-            delete_success = False
-            if os.path.exists(FAISS_INDEX_PATH):
-                try:
-                    index_file = os.path.join(FAISS_INDEX_PATH, "index.faiss")
-                    pkl_file = os.path.join(FAISS_INDEX_PATH, "index.pkl")
-                    if os.path.exists(index_file):
-                        os.remove(index_file)
-                    if os.path.exists(pkl_file):
-                        os.remove(pkl_file)
-                    try:
-                        os.rmdir(FAISS_INDEX_PATH)
-                    except OSError:
-                         pass
-                    st.success(current_texts["deleted_db_success"].format(FAISS_INDEX_PATH))
-                    delete_success = True
-                except Exception as e:
-                    st.error(current_texts["delete_db_error"].format(FAISS_INDEX_PATH, e))
-            else:
-                st.info(current_texts["db_not_found_info"])
-                delete_success = True
-
-            if delete_success:
-                st.cache_data.clear()
-                st.cache_resource.clear()
-                st.success(current_texts["cleared_cache_success"])
-            else:
-                 st.warning(current_texts["delete_db_warning"])
+    cache_stats = query_cache.stats()
+    st.caption(current_texts["cache_stats"].format(
+        cache_stats["query_vectors"]["hit_rate"], cache_stats["answers"]["hit_rate"]
+    ))
+    if st.button(current_texts["recreate_db_button"], help=current_texts["recreate_db_help"].format(PDF_DIR)):
+        try:
+            start_rebuild(api_key)
+        except Exception as e:
+            st.error(current_texts["rebuild_start_error"].format(e))
+    elif st.session_state.pop("rebuild_reported", False):
+        del st.session_state.rebuild_version
+    if rebuild_progress() is not None:
+        show_rebuild_progress()
 
 
 # --- API Key Handling & Initialization ---
+# In thin-client mode (ANYBIO_SERVICE_URL) the service holds the index and its
+# own API key, so neither is needed here.
 
-if not api_key:
+if not api_key and not SERVICE_URL:
     st.info(current_texts["api_key_needed_info"])
     st.info("Click the ⚙️ Settings button in the sidebar to enter your API key.")
     st.stop()
 
 try:
-    genai.configure(api_key=api_key)
-    list(genai.list_models())
+    if not SERVICE_URL:
+        genai.configure(api_key=api_key)
+        validate_api_key(api_key)
 except Exception as e:
     st.error(current_texts["invalid_api_key_error"].format(e))
     st.stop()
 
 # --- Initialization ---
 init_start_time = time.time()
+start_metrics_endpoint()
 
 initialization_successful = False
 faiss_vector_store = None
 
 
 with st.spinner(current_texts["init_spinner"]):
-    chunks, metadatas = load_and_process_pdfs()
-    if chunks and metadatas:
-        faiss_vector_store = setup_faiss_vector_store(chunks, metadatas, api_key)
-        if faiss_vector_store:
-            initialization_successful = True
+    faiss_vector_store = None if SERVICE_URL else setup_faiss_vector_store(api_key)
+    if faiss_vector_store or SERVICE_URL:
+        initialization_successful = True
     else:
         st.error(current_texts["pdf_load_error"])
 
 
 # Use translated error message
-if not initialization_successful or not faiss_vector_store:
+if not initialization_successful:
     st.error(current_texts["init_fail_error"])
     st.stop()
+logging.getLogger(__name__).info("Knowledge base ready in %.2fs", time.time() - init_start_time)
+
+# A sharded index can be searched in some collections or sources only.
+search_filter = None
+filter_by, filter_choices = search_filter_options(faiss_vector_store)
+if filter_choices:
+    with st.sidebar:
+        selected_shards = st.multiselect(
+            current_texts["search_filter_label"],
+            options=filter_choices,
+            format_func=lambda name: PDF_DIR if name == ROOT_COLLECTION else name,
+            key="search_filter",
+        )
+    if selected_shards:
+        search_filter = {filter_by: selected_shards}
 
 # --- Chat Interface ---
 if "messages" not in st.session_state:
@@ -471,6 +485,8 @@ if "messages" not in st.session_state:
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if message.get("sources"):
+            st.caption(f"{current_texts['sources']}: {'; '.join(message['sources'])}")
 
 # Use translated placeholder
 if prompt := st.chat_input(current_texts["chat_input_placeholder"]):
@@ -478,18 +494,40 @@ if prompt := st.chat_input(current_texts["chat_input_placeholder"]):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    with st.chat_message("assistant"):
+    with st.chat_message("assistant"), metrics.trace("chat", language=st.session_state.language) as turn:
         message_placeholder = st.empty()
+        timings = None
         with st.spinner(current_texts["thinking_spinner"]):
             current_lang = st.session_state.language
-            context_docs, context_metadatas = get_relevant_context(prompt, faiss_vector_store, api_key)
+            # The version the context comes from, for the answer cache.
+            index_version = getattr(faiss_vector_store, "version", None)
+            context_docs, context_metadatas = get_relevant_context(
+                prompt, faiss_vector_store, api_key, search_filter=search_filter
+            )
 
             if not context_docs:
                 # Use translated response
                 full_response = current_texts["no_context_response"]
-            else:
+                message_placeholder.markdown(full_response)
+            elif not STREAM_RESPONSES:
                 # Pass language to generate_response
-                full_response = generate_response(prompt, context_docs, context_metadatas, api_key, current_lang)
-
-            message_placeholder.markdown(full_response)
-    st.session_state.messages.append({"role": "assistant", "content": full_response})
\ No newline at end of file
+                full_response = generate_response(
+                    prompt, context_docs, context_metadatas, api_key, current_lang, index_version
+                )
+                message_placeholder.markdown(full_response)
+
+        if context_docs and STREAM_RESPONSES:
+            full_response, timings = stream_response(
+                message_placeholder, prompt, context_docs, context_metadatas, api_key, current_lang, index_version
+            )
+        sources = cite_sources(context_metadatas) if context_docs else []
+        if sources:
+            st.caption(f"{current_texts['sources']}: {'; '.join(sources)}")
+    assistant_message = {"role": "assistant", "content": full_response}
+    if sources:
+        assistant_message["sources"] = sources
+    if timings:
+        assistant_message["timings"] = timings
+    if turn:
+        assistant_message["stages"] = turn["stages"]
+    st.session_state.messages.append(assistant_message)
\ No newline at end of file
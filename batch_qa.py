@@ -0,0 +1,221 @@
+"""Answers a file of questions from the command line.
+
+Usage (from the repository root):
+
+    python -m batch_qa questions.jsonl -o answers.jsonl
+    python -m batch_qa questions.csv -o answers.jsonl --language es
+
+Questions are read from JSON lines ({"question", "language"?, "id"?}) or a CSV
+file with the same columns; "id" defaults to the line (or row) number and
+"language" to --language. Retrieval runs for all of them up front: the query
+vectors are embedded in bulk (retrying transient API errors with backoff, like
+ingestion) and searched with one batched FAISS call (see
+rag.retrieve_batch). Answers are then generated on ANYBIO_GENERATION_CONCURRENCY
+threads, starting no more than ANYBIO_GENERATION_REQUESTS_PER_MINUTE requests
+a minute, and each is appended to the output as a JSON line with its sources,
+chunk scores and timings as soon as it is ready.
+
+Runs are resumable: questions whose id already has an answer in the output
+file are skipped, so an interrupted or rate-limited run continues where it
+stopped, and failed questions are retried. When an id appears more than once,
+its last line is the current one. A JSON summary is printed at the end.
+--fake answers with the stand-in models from fakes.py for offline testing.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import rag
+from config import (
+    PDF_DIR,
+    FAISS_INDEX_PATH,
+    GEMINI_EMBEDDING_MODEL,
+    LANGUAGES,
+    CONTEXT_CANDIDATES,
+    GENERATION_CONCURRENCY,
+    GENERATION_REQUESTS_PER_MINUTE,
+)
+from context_assembly import cite_sources
+from embedding_cache import CachedEmbeddings
+from embedding_pipeline import TokenBucket
+from ingest import open_vector_store
+
+logger = logging.getLogger(__name__)
+
+
+def read_questions(path, language="en"):
+    """Returns [{"id", "question", "language"}] from a JSONL or CSV file."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = [(i, row) for i, row in enumerate(csv.DictReader(f), start=1)]
+        else:
+            rows = [(i, json.loads(line)) for i, line in enumerate(f, start=1) if line.strip()]
+    questions = []
+    for number, row in rows:
+        question = (row.get("question") or "").strip()
+        if not question:
+            raise ValueError(f"{path}:{number}: 'question' is required.")
+        item_language = row.get("language") or language
+        if item_language not in LANGUAGES:
+            raise ValueError(f"{path}:{number}: unknown language '{item_language}'.")
+        questions.append({"id": str(row.get("id") or number), "question": question, "language": item_language})
+    return questions
+
+
+def answered_ids(path):
+    """Returns the ids whose last line in an earlier run's output holds an answer."""
+    answered = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run.
+                    continue
+                answered[record["id"]] = record.get("error") is None
+    return {item_id for item_id, ok in answered.items() if ok}
+
+
+def _terminate_last_line(path):
+    """Ends a line cut short by an interrupted run, so the next record starts on its own line."""
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def _answer(item, results, embedding_skipped, model, api_key, rate_limiter, index_version):
+    """Generates one answer; returns its output record."""
+    docs = [doc.page_content for doc, _ in results]
+    metadatas = [doc.metadata for doc, _ in results]
+    record = {
+        "id": item["id"],
+        "question": item["question"],
+        "language": item["language"],
+        "answer": None,
+        "sources": cite_sources(metadatas),
+        "chunks": [dict(metadata, score=score) for metadata, (_, score) in zip(metadatas, results)],
+        "embedding_skipped": embedding_skipped,
+        "timings": {},
+        "error": None,
+    }
+    if not docs:
+        # Recorded without an answer, like the app's "no relevant information" reply.
+        return record
+    start = time.perf_counter()
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    generation_start = time.perf_counter()
+    try:
+        record["answer"] = rag.generate_response(
+            item["question"], docs, metadatas, api_key, item["language"], model, index_version
+        )
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["timings"] = {
+        "rate_limit_wait_s": round(generation_start - start, 4),
+        "generation_s": round(time.perf_counter() - generation_start, 4),
+    }
+    return record
+
+
+def run_batch(questions, vector_store, embeddings, output_path, api_key=None, model=None,
+              n_results=CONTEXT_CANDIDATES, concurrency=GENERATION_CONCURRENCY,
+              requests_per_minute=GENERATION_REQUESTS_PER_MINUTE):
+    """Answers the questions not yet answered in output_path, appending a line per answer.
+
+    Returns a summary of the run.
+    """
+    start = time.perf_counter()
+    done = answered_ids(output_path)
+    pending = [item for item in questions if item["id"] not in done]
+
+    retrieval_start = time.perf_counter()
+    retrieved = rag.retrieve_batch([item["question"] for item in pending], vector_store, embeddings, n_results)
+    retrieval_time = time.perf_counter() - retrieval_start
+
+    rate_limiter = TokenBucket(requests_per_minute / 60.0) if requests_per_minute > 0 else None
+    errors = 0
+    no_context = 0
+    generation_times = []
+    _terminate_last_line(output_path)
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(_answer, item, results, skipped, model, api_key, rate_limiter, vector_store.version)
+            for item, (results, skipped) in zip(pending, retrieved)
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            errors += record["error"] is not None
+            no_context += not record["chunks"]
+            if "generation_s" in record["timings"]:
+                generation_times.append(record["timings"]["generation_s"])
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            # Flushed per answer, so an interrupted run loses nothing it finished.
+            out.flush()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "questions": len(questions),
+        "skipped": len(questions) - len(pending),
+        "answered": len(pending) - errors - no_context,
+        "no_context": no_context,
+        "errors": errors,
+        "retrieval_s": round(retrieval_time, 3),
+        "elapsed_s": round(elapsed, 3),
+        "questions_per_s": round(len(pending) / elapsed, 2) if elapsed else None,
+        "generation_p50_s": round(float(np.percentile(generation_times, 50)), 3) if generation_times else None,
+        "generation_p99_s": round(float(np.percentile(generation_times, 99)), 3) if generation_times else None,
+    }
+    logger.info("Batch run: %s", summary)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="JSONL or CSV file of questions")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file the answers are appended to")
+    parser.add_argument("--language", default="en", choices=list(LANGUAGES),
+                        help="answer language for questions that do not set one")
+    parser.add_argument("--n-results", type=int, default=CONTEXT_CANDIDATES, help="chunks retrieved per question")
+    parser.add_argument("--pdf-dir", default=PDF_DIR)
+    parser.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    parser.add_argument("--fake", action="store_true", help="use the stand-in models from fakes.py")
+    parser.add_argument("--first-token-latency", type=float, default=0.0,
+                        help="seconds the stand-in model takes per answer")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    questions = read_questions(args.questions, args.language)
+    api_key = None
+    model = None
+    if args.fake:
+        from fakes import BagOfWordsEmbeddings, FakeGenerativeModel
+
+        embeddings = BagOfWordsEmbeddings()
+        model = FakeGenerativeModel(first_token_delay=args.first_token_latency)
+    else:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        api_key = os.getenv("GOOGLE_API_KEY")
+        embeddings = CachedEmbeddings(
+            GoogleGenerativeAIEmbeddings(model=GEMINI_EMBEDDING_MODEL, google_api_key=api_key),
+            GEMINI_EMBEDDING_MODEL,
+        )
+    vector_store = open_vector_store(lambda: embeddings, args.pdf_dir, args.index_path)
+    if vector_store is None:
+        parser.error(f"No index could be built from the PDFs in '{args.pdf_dir}'.")
+    print(json.dumps(run_batch(questions, vector_store, embeddings, args.output, api_key, model, args.n_results), indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Recall/latency benchmark for the vector index types on synthetic vectors.
+
+Usage (from the repository root):
+
+    python -m benchmarks.ann --vectors 200000 --dimension 768
+
+Each index type is built the way the knowledge base builds it and compared with
+exact (flat) search: recall@k against the flat results, p50/p99 single-query
+search latency, build time and serialized size. Results are printed as JSON.
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from vector_store import INDEX_TYPES, configure_search, make_index
+
+
+def synthetic_vectors(count, dimension, clusters, rng):
+    """Unit vectors drawn around random centres, loosely mimicking text embeddings."""
+    centres = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, count)
+    vectors = centres[labels] + 0.5 * rng.standard_normal((count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def search_latencies(index, queries, k):
+    """Runs one search per query, as get_relevant_context does; returns (ids, seconds per query)."""
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids[i] = index.search(query[None, :], k)
+        latencies[i] = time.perf_counter() - start
+    return ids, latencies
+
+
+def recall_at_k(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def run(index_type, vectors, queries, truth, k, ef_search, nprobe):
+    start = time.perf_counter()
+    index = make_index(index_type, vectors.shape[1], len(vectors))
+    if not index.is_trained:
+        index.train(vectors)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    build_seconds = time.perf_counter() - start
+    configure_search(index, ef_search=ef_search, nprobe=nprobe)
+
+    found, latencies = search_latencies(index, queries, k)
+    return {
+        "index_type": index_type,
+        "ef_search": ef_search if index_type == "hnsw" else None,
+        "nprobe": nprobe if index_type.startswith("ivf") else None,
+        f"recall@{k}": round(recall_at_k(found, truth), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        "build_s": round(build_seconds, 2),
+        "size_mb": round(faiss.serialize_index(index).nbytes / 2**20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--threads", type=int, default=1,
+                        help="FAISS OpenMP threads (1 matches a single query per request)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+    vectors = synthetic_vectors(args.vectors, args.dimension, args.clusters, rng)
+    queries = synthetic_vectors(args.queries, args.dimension, args.clusters, rng)
+
+    exact = faiss.IndexFlatL2(args.dimension)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    results = []
+    for index_type in args.types:
+        if index_type == "hnsw":
+            settings = [(ef, None) for ef in args.ef_search]
+        elif index_type.startswith("ivf"):
+            settings = [(None, nprobe) for nprobe in args.nprobe]
+        else:
+            settings = [(None, None)]
+        for ef_search, nprobe in settings:
+            result = run(index_type, vectors, queries, truth, args.k, ef_search or 0, nprobe or 0)
+            results.append(result)
+            print(json.dumps(result), flush=True)
+
+    print(json.dumps({"vectors": args.vectors, "dimension": args.dimension, "k": args.k, "results": results}, indent=1))
+
+
+if __name__ == "__main__":
+    main()
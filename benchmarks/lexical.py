@@ -0,0 +1,150 @@
+"""Retrieval quality and latency benchmark for vector, lexical and hybrid search.
+
+Usage (from the repository root):
+
+    python -m benchmarks.lexical --chunks 20000 --embed-latency 0.15
+
+Builds a knowledge base from synthetic chunks of filler words sprinkled with
+identifiers (Ensembl ids, rs numbers, gene symbols, command-line flags), then
+runs two query sets through rag.retrieve in each mode:
+
+    identifier   one identifier taken from a chunk; every chunk containing it counts as a hit
+    natural      a handful of words sampled from one chunk; only that chunk counts
+
+Queries are embedded by fakes.BagOfWordsEmbeddings after embed_latency seconds,
+standing in for the remote embedding call. Reports hit@k, MRR, p50/p99 latency
+and the fraction of queries that skipped the embedding call, as JSON.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+import query_cache
+from fakes import BagOfWordsEmbeddings
+from rag import retrieve
+from vector_store import FaissStore
+
+MODES = ("vector", "lexical", "hybrid")
+
+
+def synthetic_words(count, rng):
+    syllables = ["ba", "ce", "di", "fo", "gu", "ka", "le", "mi", "no", "pu", "ra", "se", "ti", "vo", "zu"]
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(syllables, size=rng.integers(2, 5))))
+    return sorted(words)
+
+
+def synthetic_identifiers(count, rng):
+    makers = [
+        lambda: f"ENSG{rng.integers(10**10):011d}",
+        lambda: f"rs{rng.integers(10**8)}",
+        lambda: "".join(rng.choice(list("ABCDEFGHKLMNPRSTW"), size=rng.integers(2, 5))) + str(rng.integers(1, 30)),
+        lambda: "--" + "-".join(rng.choice(["min", "max", "mapq", "threads", "out", "sort", "qual", "len"], size=2)),
+    ]
+    identifiers = set()
+    attempt = 0
+    while len(identifiers) < count:
+        # Flags run out of combinations first; the other makers fill the rest.
+        identifiers.add(makers[attempt % len(makers)]())
+        attempt += 1
+    return sorted(identifiers)
+
+
+def synthetic_corpus(chunks, words_per_chunk, identifiers_per_chunk, rng):
+    """Returns (texts, identifiers per chunk). Words follow a Zipf-like distribution."""
+    words = synthetic_words(5_000, rng)
+    weights = 1.0 / np.arange(1, len(words) + 1)
+    weights /= weights.sum()
+    identifiers = synthetic_identifiers(max(1, chunks * identifiers_per_chunk // 3), rng)
+    texts, chunk_identifiers = [], []
+    for _ in range(chunks):
+        body = list(rng.choice(words, size=words_per_chunk, p=weights))
+        ids = list(rng.choice(identifiers, size=identifiers_per_chunk, replace=False))
+        for identifier in ids:
+            body.insert(int(rng.integers(len(body) + 1)), identifier)
+        texts.append(" ".join(body))
+        chunk_identifiers.append(ids)
+    return texts, chunk_identifiers
+
+
+def query_sets(texts, chunk_identifiers, count, rng):
+    """Returns {set name: [(query, set of relevant chunk ids)]}."""
+    containing = {}
+    for chunk_id, ids in enumerate(chunk_identifiers):
+        for identifier in ids:
+            containing.setdefault(identifier, set()).add(chunk_id)
+    identifier_queries, natural_queries = [], []
+    for chunk_id in rng.integers(len(texts), size=count):
+        identifier = str(rng.choice(chunk_identifiers[chunk_id]))
+        identifier_queries.append((identifier, containing[identifier]))
+        words = [word for word in texts[chunk_id].split() if word not in chunk_identifiers[chunk_id]]
+        natural_queries.append((" ".join(rng.choice(words, size=8, replace=False)), {int(chunk_id)}))
+    return {"identifier": identifier_queries, "natural": natural_queries}
+
+
+def run(mode, queries, vector_store, embeddings, k):
+    hits, reciprocal_ranks, latencies, skipped = [], [], [], 0
+    for query, relevant in queries:
+        # Every query pays for its embedding, as a first-time question would.
+        query_cache.query_vectors.clear()
+        start = time.perf_counter()
+        results, skipped_embedding = retrieve(query, vector_store, embeddings, n_results=k, mode=mode)
+        latencies.append(time.perf_counter() - start)
+        skipped += skipped_embedding
+        ranks = [rank for rank, (doc, _) in enumerate(results, start=1) if doc.metadata["id"] in relevant]
+        hits.append(bool(ranks))
+        reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+    return {
+        f"hit@{k}": round(float(np.mean(hits)), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        "embedding_skipped": round(skipped / len(queries), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=10_000)
+    parser.add_argument("--words-per-chunk", type=int, default=200)
+    parser.add_argument("--identifiers-per-chunk", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--embed-latency", type=float, default=0.15,
+                        help="seconds per simulated query-embedding call")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    texts, chunk_identifiers = synthetic_corpus(args.chunks, args.words_per_chunk, args.identifiers_per_chunk, rng)
+    embeddings = BagOfWordsEmbeddings(dimension=args.dimension)
+
+    with tempfile.TemporaryDirectory() as index_path:
+        start = time.perf_counter()
+        builder = FaissStore(index_type="flat", expected_size=len(texts))
+        builder.add_embeddings(zip(texts, embeddings.embed_documents(texts)),
+                               [{"source": "synthetic.pdf", "chunk": i} for i in range(len(texts))])
+        builder.save(index_path)
+        build_seconds = time.perf_counter() - start
+
+        vector_store = FaissStore.load(index_path)
+        embeddings.latency = args.embed_latency
+        results = []
+        for set_name, queries in query_sets(texts, chunk_identifiers, args.queries, rng).items():
+            for mode in args.modes:
+                result = {"queries": set_name, "mode": mode, **run(mode, queries, vector_store, embeddings, args.k)}
+                results.append(result)
+                print(json.dumps(result), flush=True)
+
+    print(json.dumps({"chunks": args.chunks, "k": args.k, "embed_latency_s": args.embed_latency,
+                      "build_s": round(build_seconds, 2), "results": results}, indent=1))
+
+
+if __name__ == "__main__":
+    main()
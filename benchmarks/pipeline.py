@@ -0,0 +1,179 @@
+"""Offline end-to-end benchmark of the knowledge-base pipeline.
+
+Usage (from the repository root):
+
+    python -m benchmarks.pipeline --pdfs 50 --pages 20 --embed-latency 0.2
+
+Generates a synthetic PDF corpus, then runs the real pipeline against the
+stand-ins in fakes.py, so no Google API is called:
+
+    extract      ingest.load_and_process_pdfs over the whole corpus
+    build        ingest.open_vector_store on an empty index directory (extract, embed, index, save)
+    startup      ingest.open_vector_store again, with the index current
+    queries      rag.get_relevant_context and rag.generate_response, caches cleared per query
+
+Reports pages/s, chunks/s, build and startup time, query p50/p99, peak RSS
+and on-disk index size as one JSON object, tagged with the git commit, so
+runs can be compared between commits, along with the total time spent in each
+instrumented stage (see metrics.py). Index type and other settings come from
+the usual ANYBIO_* environment variables.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import metrics
+import query_cache
+import rag
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from fakes import BagOfWordsEmbeddings, FakeGenerativeModel, write_synthetic_pdf
+from ingest import load_and_process_pdfs, open_vector_store
+
+_WORDS = (
+    "alignment assembly barcode coverage deduplication expression fastq genome haplotype index "
+    "junction kmer library mapping normalization ontology pathway quality reads sample "
+    "transcript umi variant workflow"
+).split()
+
+
+def synthetic_page(rng, chars):
+    words = []
+    length = 0
+    while length < chars:
+        if rng.random() < 0.03:
+            word = f"ENSG{rng.integers(10**10):011d}"
+        else:
+            word = _WORDS[int(rng.integers(len(_WORDS)))]
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def write_corpus(pdf_directory, pdfs, pages, chars_per_page, rng):
+    """Writes pdfs PDFs of pages pages each; returns one sample page text per PDF for queries."""
+    samples = []
+    for i in range(pdfs):
+        page_texts = [synthetic_page(rng, chars_per_page) for _ in range(pages)]
+        write_synthetic_pdf(os.path.join(pdf_directory, f"synthetic_{i:05d}.pdf"), page_texts)
+        samples.append(page_texts[0])
+    return samples
+
+
+def directory_size(path):
+    """Total size of the files under path, including shard and version subdirectories."""
+    return sum(
+        os.path.getsize(os.path.join(directory, filename))
+        for directory, _, filenames in os.walk(path)
+        for filename in filenames
+    )
+
+
+def peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(who).ru_maxrss * scale / 2**20, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10, help="pages per PDF")
+    parser.add_argument("--chars-per-page", type=int, default=2500)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds per embedding call")
+    parser.add_argument("--first-token-latency", type=float, default=0.0, help="seconds before the first answer chunk")
+    parser.add_argument("--no-metrics", action="store_true", help="disable instrumentation, to measure its overhead")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    metrics.set_enabled(not args.no_metrics)
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf_directory = os.path.join(workdir, "data")
+        index_path = os.path.join(workdir, "vectordb")
+        os.makedirs(pdf_directory)
+        samples = write_corpus(pdf_directory, args.pdfs, args.pages, args.chars_per_page, rng)
+
+        start = time.perf_counter()
+        chunks, _, _, _ = load_and_process_pdfs(pdf_directory)
+        extract_seconds = time.perf_counter() - start
+
+        embeddings = CachedEmbeddings(
+            BagOfWordsEmbeddings(dimension=args.dimension, latency=args.embed_latency),
+            "benchmark",
+            cache=EmbeddingCache(os.path.join(workdir, "embeddings.sqlite3")),
+        )
+        start = time.perf_counter()
+        open_vector_store(lambda: embeddings, pdf_directory, index_path)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vector_store = open_vector_store(lambda: embeddings, pdf_directory, index_path)
+        startup_seconds = time.perf_counter() - start
+
+        model = FakeGenerativeModel(first_token_delay=args.first_token_latency)
+        retrieval, end_to_end = [], []
+        for i in range(args.queries):
+            words = samples[i % len(samples)].split()
+            offset = int(rng.integers(max(1, len(words) - 8)))
+            query = " ".join(words[offset:offset + 8])
+            query_cache.query_vectors.clear()
+            query_cache.answers.clear()
+            start = time.perf_counter()
+            docs, metas = rag.get_relevant_context(query, vector_store, embeddings)
+            retrieved = time.perf_counter()
+            rag.generate_response(query, docs, metas, api_key=None, model=model)
+            done = time.perf_counter()
+            retrieval.append(retrieved - start)
+            end_to_end.append(done - start)
+
+        pages = args.pdfs * args.pages
+        report = {
+            "commit": git_commit(),
+            "pdfs": args.pdfs,
+            "pages": pages,
+            "chunks": len(chunks),
+            "extract_s": round(extract_seconds, 3),
+            "pages_per_s": round(pages / extract_seconds, 1),
+            "chunks_per_s": round(len(chunks) / extract_seconds, 1),
+            "build_s": round(build_seconds, 3),
+            "startup_s": round(startup_seconds, 4),
+            "index_type": vector_store.index_type,
+            "index_mb": round(directory_size(index_path) / 2**20, 2),
+            "retrieval_p50_ms": percentile_ms(retrieval, 50),
+            "retrieval_p99_ms": percentile_ms(retrieval, 99),
+            "query_p50_ms": percentile_ms(end_to_end, 50),
+            "query_p99_ms": percentile_ms(end_to_end, 99),
+            "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+            "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+            "stage_seconds": {
+                series["labels"]["stage"]: round(series["sum"], 4)
+                for series in metrics.snapshot()["histograms"]
+                if series["name"] == "stage_duration_seconds"
+            },
+        }
+    print(json.dumps(report, indent=1))
+
+
+if __name__ == "__main__":
+    main()
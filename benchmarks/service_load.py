@@ -0,0 +1,114 @@
+"""Load test of the HTTP service with stand-in models.
+
+Usage (from the repository root):
+
+    python -m benchmarks.service_load --concurrency 32 --requests 500 --embed-latency 0.2
+
+Builds an index from a synthetic PDF corpus, starts service.py in-process on a
+free port with fakes.BagOfWordsEmbeddings and fakes.FakeGenerativeModel, and
+sends --requests POST /query calls from --concurrency concurrent clients. Each
+query is distinct, so every one needs an embedding. Reports throughput,
+p50/p99 latency and how many embedding requests the batcher made, as JSON.
+--no-batching sends one embedding request per query for comparison.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+from benchmarks.pipeline import write_corpus
+from config import SERVICE_WORKERS
+from fakes import BagOfWordsEmbeddings, FakeGenerativeModel
+from service import KnowledgeBaseService, create_app
+
+
+async def run_load(base_url, queries, concurrency):
+    latencies = []
+    pending = iter(queries)
+
+    async def client(session):
+        for query in pending:
+            start = time.perf_counter()
+            async with session.post(f"{base_url}/query", json={"query": query}) as response:
+                response.raise_for_status()
+                await response.json()
+            latencies.append(time.perf_counter() - start)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+async def main_async(args):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=SERVICE_WORKERS))
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf_directory = os.path.join(workdir, "data")
+        os.makedirs(pdf_directory)
+        samples = write_corpus(pdf_directory, args.pdfs, args.pages, 2500, rng)
+
+        embeddings = BagOfWordsEmbeddings(dimension=args.dimension)
+        service = KnowledgeBaseService(
+            embeddings,
+            model=FakeGenerativeModel(first_token_delay=args.first_token_latency),
+            pdf_directory=pdf_directory,
+            index_path=os.path.join(workdir, "vectordb"),
+        )
+        if args.no_batching:
+            service.embeddings.max_batch = 1
+        runner = web.AppRunner(create_app(service))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        embeddings.latency = args.embed_latency
+        calls_before = embeddings.calls
+        queries = []
+        for i in range(args.requests):
+            words = samples[i % len(samples)].split()
+            offset = int(rng.integers(max(1, len(words) - 6)))
+            queries.append(f"{' '.join(words[offset:offset + 6])} {i}")
+        latencies, elapsed = await run_load(f"http://127.0.0.1:{port}", queries, args.concurrency)
+        await runner.cleanup()
+
+    embedding_requests = embeddings.calls - calls_before
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "batching": not args.no_batching,
+        "throughput_rps": round(args.requests / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+        "embedding_requests": embedding_requests,
+        "queries_per_embedding_request": round(args.requests / max(embedding_requests, 1), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--embed-latency", type=float, default=0.1, help="seconds per embedding request")
+    parser.add_argument("--first-token-latency", type=float, default=0.05,
+                        help="seconds before the stand-in model answers")
+    parser.add_argument("--no-batching", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args)), indent=1))
+
+
+if __name__ == "__main__":
+    main()
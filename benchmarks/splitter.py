@@ -0,0 +1,117 @@
+"""Compares the span splitter with LangChain's RecursiveCharacterTextSplitter.
+
+Usage (from the repository root):
+
+    python -m benchmarks.splitter --documents 200 --pages 20
+
+Generates line-wrapped page texts like those pypdf extracts, then splits every
+document both ways with the configured CHUNK_SIZE and CHUNK_OVERLAP:
+
+    recursive    pages joined with newlines, RecursiveCharacterTextSplitter.split_text
+    spans        span_splitter.split_pages into a ChunkList, as ingestion does
+
+Reports split time and throughput, the tracemalloc peak while splitting and
+holding the chunks, chunk count and size, and the size of chunks_text.bin once
+the chunks are saved to a ChunkStore, as JSON.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.pipeline import synthetic_page
+from config import CHUNK_OVERLAP, CHUNK_SIZE
+from span_splitter import ChunkList, split_pages
+from vector_store import TEXT_FILENAME, ChunkStore
+
+
+def wrapped_page(rng, chars, line_width=90):
+    """A page of text broken into lines of about line_width characters, with the odd blank line."""
+    lines = []
+    line = []
+    length = 0
+    for word in synthetic_page(rng, chars).split():
+        if length + len(word) > line_width:
+            lines.append(" ".join(line))
+            if rng.random() < 0.05:
+                lines.append("")
+            line, length = [], 0
+        line.append(word)
+        length += len(word) + 1
+    lines.append(" ".join(line))
+    return "\n".join(lines)
+
+
+def split_recursive(documents, chunk_size, chunk_overlap):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+    for page_texts in documents:
+        chunks.extend(splitter.split_text("\n".join(page_texts)))
+    return chunks
+
+
+def split_spans(documents, chunk_size, chunk_overlap):
+    chunks = ChunkList()
+    for page_texts in documents:
+        chunks.append(split_pages(page_texts, chunk_size, chunk_overlap))
+    return chunks
+
+
+def measure(split, documents, pages, args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = split(documents, args.chunk_size, args.chunk_overlap)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lengths = [len(chunk) for chunk in chunks]
+    with tempfile.TemporaryDirectory() as index_path:
+        store = ChunkStore(index_path, writable=True)
+        store.add(chunks, [{"chunk": i} for i in range(len(chunks))])
+        store.save(index_path)
+        text_bytes = os.path.getsize(os.path.join(index_path, TEXT_FILENAME))
+        del store
+    return {
+        "split_s": round(elapsed, 3),
+        "pages_per_s": round(pages / elapsed, 1),
+        "peak_mb": round(peak / 2**20, 2),
+        "chunks": len(chunks),
+        "mean_chars": round(float(np.mean(lengths)), 1),
+        "max_chars": max(lengths),
+        "chunks_text_mb": round(text_bytes / 2**20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=20, help="pages per document")
+    parser.add_argument("--chars-per-page", type=int, default=3000)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    documents = [[wrapped_page(rng, args.chars_per_page) for _ in range(args.pages)] for _ in range(args.documents)]
+    pages = args.documents * args.pages
+    result = {
+        "documents": args.documents,
+        "pages": pages,
+        "text_mb": round(sum(len(text) for page_texts in documents for text in page_texts) / 2**20, 2),
+        "chunk_size": args.chunk_size,
+        "chunk_overlap": args.chunk_overlap,
+        "recursive": measure(split_recursive, documents, pages, args),
+        "spans": measure(split_spans, documents, pages, args),
+    }
+    print(json.dumps(result, indent=1))
+
+
+if __name__ == "__main__":
+    main()
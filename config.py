@@ -0,0 +1,111 @@
+import os
+from dotenv import load_dotenv
+
+# --- Configuration ---
+load_dotenv()
+PDF_DIR = "data"
+FAISS_INDEX_PATH = "vectordb"
+MANIFEST_FILENAME = "manifest.json"
+SHARD_CATALOG_FILENAME = "shards.json"
+INDEX_POINTER_FILENAME = "current.json"
+GEMINI_EMBEDDING_MODEL = "models/embedding-001"
+GEMINI_GENERATIVE_MODEL = "gemini-1.5-flash"
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 150
+
+# --- Language Configuration ---
+LANGUAGES = {
+    "en": "English",
+    "es": "Español",
+    "am": "አማርኛ",
+    "ar": "العربية"
+}
+
+# --- Ingestion ---
+INGEST_WORKERS = int(os.getenv("ANYBIO_INGEST_WORKERS", os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.getenv("ANYBIO_PDF_PAGES_PER_TASK", "50"))
+PDF_TIMEOUT = float(os.getenv("ANYBIO_PDF_TIMEOUT", "120"))
+
+# --- Embedding cache ---
+EMBEDDING_CACHE_PATH = os.getenv("ANYBIO_EMBEDDING_CACHE", os.path.join(".cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("ANYBIO_EMBEDDING_CACHE_MAX_BYTES", str(1 << 30)))
+
+# --- Embedding pipeline ---
+EMBED_BATCH_SIZE = int(os.getenv("ANYBIO_EMBED_BATCH_SIZE", "100"))
+EMBED_MAX_IN_FLIGHT = int(os.getenv("ANYBIO_EMBED_MAX_IN_FLIGHT", "4"))
+EMBED_REQUESTS_PER_MINUTE = float(os.getenv("ANYBIO_EMBED_REQUESTS_PER_MINUTE", "0"))
+EMBED_MAX_RETRIES = int(os.getenv("ANYBIO_EMBED_MAX_RETRIES", "5"))
+
+# Concurrent query embeddings are batched into one request: a batch waits up
+# to QUERY_BATCH_WAIT_MS for more queries, up to QUERY_BATCH_SIZE of them.
+QUERY_BATCH_SIZE = int(os.getenv("ANYBIO_QUERY_BATCH_SIZE", "32"))
+QUERY_BATCH_WAIT_MS = float(os.getenv("ANYBIO_QUERY_BATCH_WAIT_MS", "5"))
+
+# --- Vector index ---
+INDEX_TYPE = os.getenv("ANYBIO_INDEX_TYPE", "auto")
+HNSW_M = int(os.getenv("ANYBIO_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("ANYBIO_HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("ANYBIO_HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("ANYBIO_IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("ANYBIO_IVF_NPROBE", "16"))
+STALE_REBUILD_FRACTION = 0.2
+
+# --- Sharding ---
+# "none" keeps one index over the PDFs directly in PDF_DIR. "collection" keeps
+# one index per collection (PDF_DIR itself and each of its subdirectories) and
+# "source" one per PDF, so searches can be restricted to some of them.
+SHARD_BY = os.getenv("ANYBIO_SHARD_BY", "none")
+# Threads searching shards in parallel, shared by every query in the process.
+SHARD_SEARCH_WORKERS = int(os.getenv("ANYBIO_SHARD_SEARCH_WORKERS", "8"))
+
+# --- Retrieval ---
+# "hybrid" fuses BM25 and vector results; "vector" and "lexical" use one of them.
+RETRIEVAL_MODE = os.getenv("ANYBIO_RETRIEVAL_MODE", "hybrid")
+# Results taken from each retriever before fusion.
+HYBRID_CANDIDATES = int(os.getenv("ANYBIO_HYBRID_CANDIDATES", "20"))
+RRF_K = 60
+# Queries whose content tokens are at least this fraction identifiers (gene
+# symbols, accessions, flags) are answered from the lexical index alone,
+# without embedding the query. Above 1 disables the fast path.
+LEXICAL_FAST_PATH_FRACTION = float(os.getenv("ANYBIO_LEXICAL_FAST_PATH_FRACTION", "0.5"))
+
+# --- Context assembly ---
+# Chunks retrieved per question; the token budget decides how many reach the prompt.
+CONTEXT_CANDIDATES = int(os.getenv("ANYBIO_CONTEXT_CANDIDATES", "8"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("ANYBIO_CONTEXT_TOKEN_BUDGET", "3000"))
+# Relevance versus diversity when ordering passages (1 ignores diversity).
+MMR_LAMBDA = float(os.getenv("ANYBIO_MMR_LAMBDA", "0.7"))
+
+# --- Query and answer caches ---
+QUERY_CACHE_SIZE = int(os.getenv("ANYBIO_QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_TTL = float(os.getenv("ANYBIO_QUERY_CACHE_TTL", "86400"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANYBIO_ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANYBIO_ANSWER_CACHE_TTL", "3600"))
+
+# --- Generation ---
+STREAM_RESPONSES = os.getenv("ANYBIO_STREAM_RESPONSES", "1") != "0"
+# Gemini calls in flight at once per process; further requests wait their turn.
+GENERATION_CONCURRENCY = int(os.getenv("ANYBIO_GENERATION_CONCURRENCY", "4"))
+# Generation requests per minute the batch CLI (batch_qa.py) stays under; 0 disables the limit.
+GENERATION_REQUESTS_PER_MINUTE = float(os.getenv("ANYBIO_GENERATION_REQUESTS_PER_MINUTE", "0"))
+
+# --- Startup ---
+# When disabled, an existing index is served without looking at PDF_DIR at all;
+# run `python -m ingest` to sync it with the PDFs.
+STARTUP_CORPUS_CHECK = os.getenv("ANYBIO_STARTUP_CORPUS_CHECK", "1") != "0"
+
+# --- Metrics ---
+METRICS_ENABLED = os.getenv("ANYBIO_METRICS", "1") != "0"
+# Port for the /metrics (Prometheus) and /metrics.json endpoint; 0 disables it.
+METRICS_PORT = int(os.getenv("ANYBIO_METRICS_PORT", "0"))
+# JSON-lines file receiving one record per chat turn and startup; empty disables it.
+REQUEST_LOG_PATH = os.getenv("ANYBIO_REQUEST_LOG", "")
+
+# --- Service ---
+SERVICE_HOST = os.getenv("ANYBIO_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("ANYBIO_SERVICE_PORT", "8600"))
+# Threads running retrieval and generation for the service's requests.
+SERVICE_WORKERS = int(os.getenv("ANYBIO_SERVICE_WORKERS", "32"))
+# When set (e.g. http://127.0.0.1:8600), the Streamlit app is a thin client of
+# the service instead of loading the index itself.
+SERVICE_URL = os.getenv("ANYBIO_SERVICE_URL", "")
@@ -0,0 +1,156 @@
+"""Turns retrieved chunks into the prompt's context section within a token budget."""
+import logging
+
+from config import CHUNK_OVERLAP, CONTEXT_TOKEN_BUDGET, MMR_LAMBDA
+from lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Gemini averages about four characters per token on English text; close
+# enough for budgeting without a remote count_tokens call.
+CHARS_PER_TOKEN = 4
+# Shorter suffix/prefix matches between neighbouring chunks are treated as coincidence.
+MIN_OVERLAP = 16
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _page_label(first, last):
+    return f"p. {first}" if first == last else f"pp. {first}\u2013{last}"
+
+
+def citation(source, pages=None):
+    """Labels a source with the pages a passage spans, e.g. "paper.pdf, pp. 3–4".
+
+    pages is [first, last] or None for chunks indexed without page numbers.
+    """
+    return f"{source}, {_page_label(*pages)}" if pages else source
+
+
+def cite_sources(context_metadatas):
+    """Returns one citation per source, in order of first appearance, listing
+    the merged page ranges of its chunks, e.g. "paper.pdf, pp. 3–5, p. 9"."""
+    pages_by_source = {}
+    for meta in context_metadatas:
+        ranges = pages_by_source.setdefault(meta.get("source", "Unknown source"), [])
+        if meta.get("pages"):
+            ranges.append(tuple(meta["pages"]))
+    citations = []
+    for source, ranges in pages_by_source.items():
+        merged = []
+        for first, last in sorted(ranges):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        citations.append(", ".join([source] + [_page_label(first, last) for first, last in merged]))
+    return citations
+
+
+def format_passage(source, text, pages=None):
+    return f"Source: {citation(source, pages)}\nContent:\n{text}\n\n---\n\n"
+
+
+def _join_overlapping(left, right, max_overlap=CHUNK_OVERLAP):
+    """Concatenates neighbouring chunks, dropping the text the splitter repeated
+    from the end of left at the start of right."""
+    for size in range(min(len(left), len(right), max_overlap), MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return left + "\n" + right
+
+
+def merge_adjacent(context_docs, context_metadatas):
+    """Merges chunks that are consecutive in the same source into passages.
+
+    Returns passages as dicts with the merged text, source, pages ([first,
+    last], or None without page numbers), chunk ids and rank (the best
+    retrieval rank among the merged chunks), best first.
+    """
+    chunks = sorted(
+        (meta.get("source", "Unknown source"), meta.get("chunk", -1), rank, doc, meta.get("id"), meta.get("pages"))
+        for rank, (doc, meta) in enumerate(zip(context_docs, context_metadatas))
+    )
+    passages = []
+    previous = None
+    for source, chunk, rank, doc, chunk_id, pages in chunks:
+        if previous is not None and previous[0] == source and chunk >= 0 and chunk - previous[1] == 1:
+            passage = passages[-1]
+            passage["text"] = _join_overlapping(passage["text"], doc)
+            passage["ids"].append(chunk_id)
+            passage["rank"] = min(passage["rank"], rank)
+            if passage["pages"] and pages:
+                passage["pages"] = [min(passage["pages"][0], pages[0]), max(passage["pages"][1], pages[1])]
+        else:
+            passages.append({"source": source, "pages": pages, "text": doc, "ids": [chunk_id], "rank": rank})
+        previous = (source, chunk)
+    return sorted(passages, key=lambda passage: passage["rank"])
+
+
+def _similarity(left, right):
+    """Jaccard similarity of two token sets."""
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def mmr_order(passages, mmr_lambda=MMR_LAMBDA):
+    """Reorders passages by maximal marginal relevance: each next passage
+    maximises mmr_lambda * relevance - (1 - mmr_lambda) * its highest similarity
+    to those already chosen. Relevance falls linearly with retrieval rank."""
+    if len(passages) < 2:
+        return list(passages)
+    worst = max(passage["rank"] for passage in passages) + 1
+    remaining = [(passage, 1.0 - passage["rank"] / worst, set(tokenize(passage["text"]))) for passage in passages]
+    chosen = []
+    while remaining:
+        best = max(
+            range(len(remaining)),
+            key=lambda i: mmr_lambda * remaining[i][1] - (1 - mmr_lambda) * max(
+                (_similarity(remaining[i][2], tokens) for _, _, tokens in chosen), default=0.0
+            ),
+        )
+        chosen.append(remaining.pop(best))
+    return [passage for passage, _, _ in chosen]
+
+
+def assemble_context(context_docs, context_metadatas, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Builds the context section of the prompt.
+
+    Neighbouring chunks are merged without their repeated overlap, passages
+    are ordered by MMR, and they are added in that order while they fit in
+    token_budget (the first is truncated if it alone does not). Returns
+    (context string, report), where the report compares the estimated tokens
+    with those of the chunks pasted verbatim.
+    """
+    passages = mmr_order(merge_adjacent(context_docs, context_metadatas))
+    parts = []
+    used = 0
+    included = 0
+    for passage in passages:
+        part = format_passage(passage["source"], passage["text"], passage["pages"])
+        tokens = estimate_tokens(part)
+        if used + tokens > token_budget:
+            if parts:
+                continue
+            part = format_passage(passage["source"], passage["text"][:token_budget * CHARS_PER_TOKEN], passage["pages"])
+            tokens = estimate_tokens(part)
+        parts.append(part)
+        used += tokens
+        included += len(passage["ids"])
+
+    verbatim = sum(
+        estimate_tokens(format_passage(meta.get("source", "Unknown source"), doc, meta.get("pages")))
+        for doc, meta in zip(context_docs, context_metadatas)
+    )
+    report = {
+        "chunks": len(context_docs),
+        "chunks_included": included,
+        "passages": len(parts),
+        "context_tokens": used,
+        "tokens_saved": verbatim - used,
+    }
+    logger.info("Context assembly: %s", report)
+    return "".join(parts), report
@@ -0,0 +1,206 @@
+import hashlib
+import inspect
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import metrics
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# SQLite caps the number of bound parameters per statement.
+_SQL_BATCH = 500
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def embed_query_batch(embeddings, texts):
+    """Embeds several queries, in one request where the model allows it.
+
+    Google's embeddings accept a task type on batch calls; other models may
+    provide embed_queries, and are otherwise called once per query.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if "task_type" in inspect.signature(embeddings.embed_documents).parameters:
+        return embeddings.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class EmbeddingCache:
+    """On-disk store of float32 vectors keyed by (model, text hash).
+
+    Entries are evicted least-recently-used first once the stored vectors exceed
+    max_bytes. Safe to share between threads; WAL mode lets several processes
+    read and write the same file.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, hashes):
+        """Returns {hash: vector} for the hashes present in the cache."""
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), _SQL_BATCH):
+                batch = hashes[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, key) for key in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(hashes)) - len(found)
+        metrics.inc("cache_requests_total", len(found), cache="embeddings", result="hit")
+        metrics.inc("cache_requests_total", len(set(hashes)) - len(found), cache="embeddings", result="miss")
+        return found
+
+    def put_many(self, model, items):
+        """Stores (hash, vector) pairs, evicting old entries if over budget."""
+        now = time.time()
+        blobs = {key: np.asarray(vector, dtype=np.float32).tobytes() for key, vector in items}
+        with self._lock:
+            # Replaced rows no longer count towards the budget.
+            replaced = 0
+            keys = list(blobs)
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+                    f" WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, key, blob, now) for key, blob in blobs.items()],
+            )
+            self._size += sum(len(blob) for blob in blobs.values()) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Trim to 90% of the budget so eviction does not run on every insert.
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while self._size > target:
+            rows = self._conn.execute(
+                "SELECT model, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT ?",
+                (_SQL_BATCH,),
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            victims = []
+            for model, key, size in rows:
+                if self._size <= target:
+                    break
+                victims.append((model, key))
+                self._size -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", victims)
+            evicted += len(victims)
+        logger.info("Evicted %d cached embeddings from '%s'", evicted, self.path)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes": self._size,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Returns the process-wide embedding cache."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings object, serving repeated texts from an EmbeddingCache.
+
+    Documents and queries are cached separately because providers embed them
+    with different task types.
+    """
+
+    def __init__(self, embeddings, model, cache=None):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache if cache is not None else get_embedding_cache()
+
+    def _embed(self, namespace, texts, embed_fn):
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.cache.get_many(namespace, list(dict.fromkeys(hashes)))
+
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            new_vectors = embed_fn(list(missing.values()))
+            self.cache.put_many(namespace, zip(missing.keys(), new_vectors))
+            vectors.update(zip(missing.keys(), new_vectors))
+            logger.info("Embedding cache for %s: %s", namespace, self.cache.stats())
+
+        return [np.asarray(vectors[key], dtype=np.float32).tolist() for key in hashes]
+
+    def embed_documents(self, texts):
+        return self._embed(self.model, texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed(f"{self.model}#query", [text], lambda batch: [self.embeddings.embed_query(batch[0])])[0]
+
+    def embed_queries(self, texts):
+        return self._embed(f"{self.model}#query", texts, lambda batch: embed_query_batch(self.embeddings, batch))
@@ -0,0 +1,169 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from langchain_core.embeddings import Embeddings
+
+import metrics
+from config import (
+    EMBED_BATCH_SIZE,
+    EMBED_MAX_IN_FLIGHT,
+    EMBED_REQUESTS_PER_MINUTE,
+    EMBED_MAX_RETRIES,
+    QUERY_BATCH_SIZE,
+    QUERY_BATCH_WAIT_MS,
+)
+from embedding_cache import embed_query_batch
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingPipelineError(Exception):
+    """Raised when a batch still fails after all retries."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+
+def embed_with_retry(embed, texts, rate_limiter=None, max_retries=EMBED_MAX_RETRIES, base_delay=1.0, max_delay=60.0):
+    """Returns embed(texts), retrying failed requests with exponential backoff.
+
+    Each attempt waits for a token from rate_limiter, if given. Raises
+    EmbeddingPipelineError once max_retries retries have failed too.
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return embed(texts)
+        except Exception as e:
+            metrics.inc("errors_total", stage="embedding_request")
+            if attempt == max_retries:
+                raise EmbeddingPipelineError(f"Embedding batch failed after {attempt + 1} attempts: {e}") from e
+            # Full jitter keeps concurrent retries from hitting the API in lockstep.
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logger.warning("Embedding batch failed (%s); retrying in %.1fs", e, delay)
+            metrics.inc("embedding_retries_total")
+            time.sleep(delay)
+
+
+def embed_in_batches(embeddings, texts, on_batch, batch_size=EMBED_BATCH_SIZE,
+                     max_in_flight=EMBED_MAX_IN_FLIGHT, requests_per_minute=EMBED_REQUESTS_PER_MINUTE,
+                     max_retries=EMBED_MAX_RETRIES, base_delay=1.0, max_delay=60.0):
+    """Embeds texts in batches on a bounded thread pool.
+
+    At most max_in_flight batches are outstanding at once, requests are paced by
+    a token bucket when requests_per_minute is set, and each batch is retried
+    with exponential backoff. on_batch(start, vectors) is called from the calling
+    thread as each batch completes (in completion order), so results can be
+    persisted incrementally. Raises EmbeddingPipelineError once in-flight batches
+    have drained if any batch exhausts its retries; batches already handed to
+    on_batch stay done.
+    """
+    rate_limiter = TokenBucket(requests_per_minute / 60.0) if requests_per_minute > 0 else None
+    starts = iter(range(0, len(texts), batch_size))
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        pending = {}
+
+        def submit_next():
+            start = next(starts, None)
+            if start is None:
+                return
+            batch = texts[start:start + batch_size]
+            future = pool.submit(embed_with_retry, embeddings.embed_documents, batch, rate_limiter,
+                                 max_retries, base_delay, max_delay)
+            pending[future] = start
+
+        for _ in range(max(1, max_in_flight)):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start = pending.pop(future)
+                try:
+                    vectors = future.result()
+                except EmbeddingPipelineError as e:
+                    error = error or e
+                    continue
+                on_batch(start, vectors)
+                if error is None:
+                    submit_next()
+
+    if error is not None:
+        raise error
+
+
+class QueryBatcher(Embeddings):
+    """Coalesces embed_query calls from concurrent threads into batched requests.
+
+    The first caller of a batch waits up to max_wait_ms for others to join (or
+    until max_batch queries are waiting), then embeds the whole batch with one
+    request and hands every caller its vector. Documents pass straight through.
+    """
+
+    def __init__(self, embeddings, max_batch=QUERY_BATCH_SIZE, max_wait_ms=QUERY_BATCH_WAIT_MS):
+        self.embeddings = embeddings
+        # Query caches key on the model; batching does not change the vectors.
+        self.model = getattr(embeddings, "model", None)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        future = Future()
+        with self._lock:
+            leader = self._batch is None
+            if leader:
+                self._batch = {"items": [], "full": threading.Event()}
+            batch = self._batch
+            batch["items"].append((text, future))
+            if len(batch["items"]) >= self.max_batch:
+                self._batch = None
+                batch["full"].set()
+        if leader:
+            batch["full"].wait(self.max_wait)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            self._run(batch["items"])
+        return future.result()
+
+    def _run(self, items):
+        metrics.observe("query_batch_size", len(items), buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+        try:
+            vectors = embed_query_batch(self.embeddings, [text for text, _ in items])
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(items, vectors):
+            future.set_result(vector)
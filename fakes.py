@@ -0,0 +1,161 @@
+"""Deterministic local stand-ins for the Google models, for offline checks and benchmarks."""
+import hashlib
+import random
+import re
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class SimulatedAPIError(Exception):
+    """Transient failure injected by the stand-in models."""
+
+
+class HashEmbeddings(Embeddings):
+    """Embeds text as a unit vector seeded from its SHA-256, so equal texts get equal vectors.
+
+    latency seconds are slept per call and failure_rate of calls raise
+    SimulatedAPIError, to exercise batching, concurrency and retries.
+    """
+
+    def __init__(self, dimension=768, latency=0.0, failure_rate=0.0, seed=0):
+        self.dimension = dimension
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self.texts_embedded = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, count):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+            else:
+                self.texts_embedded += count
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise SimulatedAPIError("simulated transient embedding failure")
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        self._call(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self._call(1)
+        return self._vector(text)
+
+    def embed_queries(self, texts):
+        self._call(len(texts))
+        return [self._vector(text) for text in texts]
+
+
+class BagOfWordsEmbeddings(HashEmbeddings):
+    """Embeds text as a normalised sum of per-word HashEmbeddings vectors, so
+    texts sharing words are close, loosely like a semantic embedding model.
+
+    Digits and inner punctuation are dropped from each word first: like real
+    embedding models, it can tell that a token is an Ensembl id or an rs
+    number, but not which one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._word_vectors = {}
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"[^\W\d_]+", text.lower()):
+            word_vector = self._word_vectors.get(word)
+            if word_vector is None:
+                word_vector = self._word_vectors[word] = np.asarray(super()._vector(word), dtype=np.float32)
+            vector += word_vector
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Stands in for genai.GenerativeModel, answering with canned text.
+
+    first_token_delay seconds pass before the first chunk and chunk_delay
+    between chunks; with stream=True the answer is yielded in chunk_size
+    character pieces, like Gemini's streaming responses.
+    """
+
+    def __init__(self, answer="This is a simulated answer.", first_token_delay=0.0, chunk_delay=0.0,
+                 chunk_size=40):
+        self.answer = answer
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.calls = 0
+
+    def _chunks(self):
+        time.sleep(self.first_token_delay)
+        for start in range(0, len(self.answer), self.chunk_size):
+            if start:
+                time.sleep(self.chunk_delay)
+            yield FakeResponse(self.answer[start:start + self.chunk_size])
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        if stream:
+            return self._chunks()
+        return FakeResponse("".join(chunk.text for chunk in self._chunks()))
+
+
+def write_synthetic_pdf(filepath, page_texts, line_width=90):
+    """Writes a minimal text-only PDF with one page per string in page_texts.
+
+    Text is set in Helvetica, line_width characters per line, and can be
+    extracted again with pypdf; used to generate benchmark corpora without
+    bundling PDFs.
+    """
+    page_count = len(page_texts)
+    font_id = 3 + 2 * page_count
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(page_count))
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>",
+    ]
+    for i, text in enumerate(page_texts):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R"
+            f" /Resources << /Font << /F1 {font_id} 0 R >> >> >>"
+        )
+        lines = []
+        for row, start in enumerate(range(0, len(text), line_width)):
+            line = text[start:start + line_width].replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            lines.append(f"BT /F1 8 Tf 20 {770 - 10 * row} Td ({line}) Tj ET")
+        stream = "\n".join(lines)
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("ascii")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii")
+    with open(filepath, "wb") as f:
+        f.write(out)
@@ -0,0 +1,160 @@
+"""One shared vector store per index directory and on-disk version.
+
+Every session of the process searches the same store object, keyed by the
+index path, the version directory current in it (see index_versions) and the
+version its last save recorded (the shard catalog's for a sharded index),
+never by who opened it: API keys are only used by the
+embedding and generation calls made with it. Sessions hold leases on it:
+
+    lease = index_registry.acquire(FAISS_INDEX_PATH, open_store)
+    lease.store.similarity_search_by_vector_with_score(...)
+    if not lease.is_current():       # a cheap read of current.json and store.json / shards.json
+        lease = lease.renew(open_store)
+
+A version stays loaded while leases on it exist; the newest one stays loaded
+after the last lease is released, so the next session does not reopen it, and
+older ones are dropped (and their memory maps closed) as soon as they have no
+leases left. Nothing expires on a timer: a new version is loaded when
+`python -m ingest`, the service's /ingest, the app or a background rebuild
+saves one.
+"""
+import logging
+import os
+import threading
+import weakref
+
+import metrics
+from config import SHARD_BY
+from index_versions import active_index_path
+from sharded_store import load_catalog
+from vector_store import read_store_info
+
+logger = logging.getLogger(__name__)
+
+
+def index_version(index_path, shard_by=SHARD_BY):
+    """Returns the version of the index saved in index_path, or None if there is none."""
+    if shard_by != "none":
+        catalog = load_catalog(index_path)
+        return catalog["version"] if catalog is not None else None
+    return read_store_info(index_path)["version"]
+
+
+def _current_key(index_path):
+    path = active_index_path(index_path)
+    return index_path, path, index_version(path)
+
+
+class IndexLease:
+    """A session's reference to a shared store; released when dropped or garbage collected."""
+
+    def __init__(self, registry, key, store):
+        self.key = key
+        self.store = store
+        self._registry = registry
+        self._finalizer = weakref.finalize(self, registry._release, key)
+
+    @property
+    def version(self):
+        return self.key[2]
+
+    def is_current(self):
+        """Returns whether the store is still the version saved on disk."""
+        return _current_key(self.key[0]) == self.key
+
+    def renew(self, open_store):
+        """Leases the current version and releases this one."""
+        lease = self._registry.acquire(self.key[0], open_store)
+        self.release()
+        return lease
+
+    def release(self):
+        self._finalizer()
+
+
+class IndexRegistry:
+    """Thread-safe, reference-counted stores keyed by (index path, version directory, version)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (index path, version directory, version) -> [store, lease count]
+        self._entries = {}
+        self._latest = {}
+        # index path -> lock held while a version of it is opened
+        self._open_locks = {}
+
+    def acquire(self, index_path, open_store):
+        """Returns a lease on the store for the version saved in index_path.
+
+        open_store() opens it (syncing it with the PDFs first if needed) when
+        this process has not loaded that version yet. It runs under a lock of
+        its own per index path, so concurrent sessions wait for one load
+        instead of each loading a copy, while leases on loaded versions and on
+        other indexes are served meanwhile. Returns None if open_store() does.
+        """
+        index_path = os.path.abspath(index_path)
+        lease = self._lease_loaded(index_path)
+        if lease is not None:
+            return lease
+        with self._lock:
+            open_lock = self._open_locks.setdefault(index_path, threading.Lock())
+        with open_lock:
+            # Another session may have loaded it while we waited.
+            lease = self._lease_loaded(index_path)
+            if lease is not None:
+                return lease
+            with metrics.span("index_open"):
+                store = open_store()
+            if store is None:
+                return None
+            # Opening may have synced the index to a newer version.
+            key = (index_path, active_index_path(index_path), store.version)
+            with self._lock:
+                if key not in self._entries:
+                    logger.info("Loaded index %s version %s", key[1], store.version)
+                    metrics.inc("index_loads")
+                    self._entries[key] = [store, 0]
+                return self._lease(key)
+
+    def _lease_loaded(self, index_path):
+        key = _current_key(index_path)
+        with self._lock:
+            return self._lease(key) if key in self._entries else None
+
+    def _lease(self, key):
+        # Called with the registry lock held.
+        entry = self._entries[key]
+        entry[1] += 1
+        index_path = key[0]
+        previous = self._latest.get(index_path)
+        self._latest[index_path] = key
+        if previous not in (None, key) and previous in self._entries and not self._entries[previous][1]:
+            del self._entries[previous]
+        return IndexLease(self, key, entry[0])
+
+    def _release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if not entry[1] and self._latest.get(key[0]) != key:
+                del self._entries[key]
+                logger.info("Unloaded index %s version %s", key[1], key[2])
+
+    def in_use(self, index_path):
+        """Returns the version directories of index_path that are loaded."""
+        index_path = os.path.abspath(index_path)
+        with self._lock:
+            return {key[1] for key in self._entries if key[0] == index_path}
+
+    def stats(self):
+        """Returns {"versions": loaded store versions, "leases": leases held}."""
+        with self._lock:
+            return {"versions": len(self._entries), "leases": sum(refs for _, refs in self._entries.values())}
+
+
+_registry = IndexRegistry()
+acquire = _registry.acquire
+in_use = _registry.in_use
+stats = _registry.stats
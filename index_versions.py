@@ -0,0 +1,227 @@
+"""Versioned index directories behind an atomically replaced pointer.
+
+Layout under the index directory once a background rebuild (see rebuild.py)
+has run:
+
+    current.json          {"version": name}: the version readers open
+    versions/<name>/      one complete index (single or sharded) per version
+
+Before the first rebuild there is no pointer and the index lives directly in
+the index directory, as the "." version. Readers and incremental syncs go
+through active_index_path(), so they always use the version the pointer names;
+a rebuild writes a new version beside it and only replaces current.json once
+the new index is complete, so queries never see a partial one.
+
+A process reading a version holds a shared lock on a lease file in its
+directory (see lease_current()) for as long as the store it opened is alive,
+so versions, and old shard directories, are only deleted once no process
+reads them: other app sessions' processes, the API service and batch runs
+included.
+"""
+import contextlib
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+import weakref
+
+try:
+    import fcntl
+except ImportError:
+    # Without advisory locks (Windows), only this process's own stores count as readers.
+    fcntl = None
+
+from config import INDEX_POINTER_FILENAME, MANIFEST_FILENAME, SHARD_CATALOG_FILENAME
+from lexical_index import LEXICAL_FILES
+from sharded_store import SHARDS_DIRNAME
+from vector_store import STORE_FILES
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_DIRNAME = "versions"
+ROOT_VERSION = "."
+# A version being written; never read, and removed if a build did not finish.
+BUILDING_SUFFIX = ".building"
+LEASE_PREFIX = "readers"
+# Held exclusively by whoever writes to the index (see writer_lock()).
+WRITER_LOCK_FILENAME = "writer.lock"
+
+
+def current_version(index_path):
+    """Returns the name of the version the pointer names, or "." without one."""
+    try:
+        with open(os.path.join(index_path, INDEX_POINTER_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        return ROOT_VERSION
+
+
+def version_path(index_path, version):
+    if version == ROOT_VERSION:
+        return index_path
+    return os.path.join(index_path, VERSIONS_DIRNAME, version)
+
+
+def active_index_path(index_path):
+    """Returns the directory of the index version readers should open."""
+    return version_path(index_path, current_version(index_path))
+
+
+def new_version_name():
+    """A sortable, unique name for a new version directory."""
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def set_current_version(index_path, version):
+    """Atomically points readers at version."""
+    pointer_file = os.path.join(index_path, INDEX_POINTER_FILENAME)
+    tmp_file = pointer_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump({"version": version}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, pointer_file)
+
+
+@contextlib.contextmanager
+def writer_lock(index_path, blocking=True):
+    """Holds the exclusive lock that serialises writes to index_path across processes.
+
+    Yields whether it was acquired, which is always the case when blocking.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    with open(os.path.join(index_path, WRITER_LOCK_FILENAME), "a+b") as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+
+
+def lease_file(path, version=None):
+    """The lease file of the index in path, or of one version of its shard catalog."""
+    return os.path.join(path, f"{LEASE_PREFIX}.{version}.lock" if version else f"{LEASE_PREFIX}.lock")
+
+
+class ReaderLease:
+    """A shared lock on a lease file, telling other processes that the index is being read.
+
+    Held until release(), or until the store it was bound to is garbage collected.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_SH)
+
+    def bind(self, store):
+        weakref.finalize(store, self._file.close)
+        return store
+
+    def release(self):
+        self._file.close()
+
+
+def lease_current(index_path, read_version=None):
+    """Returns (directory of the current version, ReaderLease on it).
+
+    With read_version(path), the lease covers the version it returns of the
+    index saved in path (a sharded index's catalog version) rather than the
+    whole directory. The pointer is re-read once the lease is held, so the
+    returned version cannot have been deleted. The lease is None when the
+    current version has no directory yet.
+    """
+    while True:
+        path = active_index_path(index_path)
+        version = read_version(path) if read_version is not None else None
+        try:
+            lease = ReaderLease(lease_file(path, version))
+        except FileNotFoundError:
+            if active_index_path(index_path) == path:
+                return path, None
+            continue
+        if active_index_path(index_path) == path and (read_version is None or read_version(path) == version):
+            return path, lease
+        lease.release()
+
+
+@contextlib.contextmanager
+def unread(path, current=None):
+    """Yields whether no process holds a lease in path, other than on the current catalog version.
+
+    While it is true, new readers of those leases wait until the block ends,
+    and their lease files are deleted with it.
+    """
+    if fcntl is None:
+        yield True
+        return
+    locked = []
+    try:
+        for filepath in glob.glob(os.path.join(path, f"{LEASE_PREFIX}*.lock")):
+            if current is not None and filepath == lease_file(path, current):
+                continue
+            f = open(filepath, "a+b")
+            locked.append((filepath, f))
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+        for filepath, _ in locked:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(filepath)
+    finally:
+        for _, f in locked:
+            f.close()
+
+
+def _remove_root_version(index_path):
+    """Deletes an index stored directly in index_path; returns whether there was one."""
+    removed = False
+    for filename in (*STORE_FILES, *LEXICAL_FILES, MANIFEST_FILENAME, SHARD_CATALOG_FILENAME):
+        filepath = os.path.join(index_path, filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+            removed = True
+    shards_dir = os.path.join(index_path, SHARDS_DIRNAME)
+    if os.path.isdir(shards_dir):
+        shutil.rmtree(shards_dir, ignore_errors=True)
+        removed = True
+    return removed
+
+
+def remove_unused_versions(index_path, in_use=()):
+    """Deletes every version but the current one, those whose paths are in
+    in_use and those another process holds a lease on.
+
+    Unfinished builds are deleted too unless their builder holds a lease on
+    them. Returns the names of the removed versions.
+    """
+    current = current_version(index_path)
+    in_use = {os.path.abspath(path) for path in in_use}
+    versions_dir = os.path.join(index_path, VERSIONS_DIRNAME)
+    names = sorted(os.listdir(versions_dir)) if os.path.isdir(versions_dir) else []
+    removed = []
+    for name in [ROOT_VERSION, *names]:
+        path = version_path(index_path, name)
+        if name == current or os.path.abspath(path) in in_use:
+            continue
+        with unread(path) as unused:
+            if not unused:
+                continue
+            if name == ROOT_VERSION:
+                if not _remove_root_version(index_path):
+                    continue
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+        removed.append(name)
+    if removed:
+        logger.info("Removed unused index versions: %s", ", ".join(removed))
+    return removed
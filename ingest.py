@@ -0,0 +1,870 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import threading
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pypdf
+
+from config import (
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    MANIFEST_FILENAME,
+    INGEST_WORKERS,
+    PDF_PAGES_PER_TASK,
+    PDF_TIMEOUT,
+    INDEX_TYPE,
+    STALE_REBUILD_FRACTION,
+    STARTUP_CORPUS_CHECK,
+    SHARD_BY,
+)
+import index_registry
+import metrics
+from embedding_pipeline import embed_in_batches
+from index_versions import (
+    BUILDING_SUFFIX,
+    active_index_path,
+    lease_current,
+    lease_file,
+    new_version_name,
+    remove_unused_versions,
+    set_current_version,
+    unread,
+    version_path,
+    writer_lock,
+)
+from sharded_store import (
+    ROOT_COLLECTION,
+    SHARD_MODES,
+    SHARDS_DIRNAME,
+    ShardedStore,
+    load_catalog,
+    qualified_source,
+    save_catalog,
+    shard_dirname,
+    shard_path,
+)
+from span_splitter import ChunkList, split_pages
+from vector_store import FaissStore, read_store_info, resolve_index_type, store_exists
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+# Times a broken extraction pool is replaced in one extraction before the PDFs
+# still pending are left for the next sync.
+POOL_RESTARTS = 2
+
+
+class ExtractionTimeout(Exception):
+    """Raised when extracting a PDF takes longer than the configured timeout."""
+
+
+def hash_file(filepath, block_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def empty_manifest():
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def load_manifest(index_path):
+    """Loads the ingestion manifest stored next to the index, or an empty one."""
+    manifest_file = os.path.join(index_path, MANIFEST_FILENAME)
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty_manifest()
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.info("Ignoring manifest with unsupported version %s", manifest.get("version"))
+        return empty_manifest()
+    return manifest
+
+
+def save_manifest(index_path, manifest):
+    """Atomically writes the ingestion manifest next to the index."""
+    os.makedirs(index_path, exist_ok=True)
+    manifest_file = os.path.join(index_path, MANIFEST_FILENAME)
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def _pdf_names(directory):
+    return sorted(name for name in os.listdir(directory) if name.lower().endswith(".pdf"))
+
+
+def scan_pdf_dir(pdf_directory, known_files=None, filenames=None):
+    """Returns {filename: {"sha256", "size", "mtime"}} for every PDF in the
+    directory, or only for those in filenames.
+
+    Files whose size and mtime match the manifest entry reuse the recorded hash,
+    so an unchanged corpus is scanned without reading any PDF contents.
+    """
+    known_files = known_files or {}
+    current = {}
+    names = _pdf_names(pdf_directory)
+    if filenames is not None:
+        wanted = set(filenames)
+        names = [name for name in names if name in wanted]
+    for filename in names:
+        filepath = os.path.join(pdf_directory, filename)
+        stat = os.stat(filepath)
+        known = known_files.get(filename)
+        if known and known.get("size") == stat.st_size and known.get("mtime") == stat.st_mtime_ns:
+            sha256 = known["sha256"]
+        else:
+            sha256 = hash_file(filepath)
+        current[filename] = {"sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    return current
+
+
+def _fingerprint(file_stats):
+    digest = hashlib.sha256()
+    for name, size, mtime in sorted(file_stats):
+        digest.update(f"{name}\0{size}\0{mtime}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def corpus_fingerprint(pdf_directory):
+    """Hashes the names, sizes and mtimes of the PDFs in pdf_directory without reading them."""
+    with os.scandir(pdf_directory) as entries:
+        return _fingerprint(
+            (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+            for entry in entries if entry.name.lower().endswith(".pdf")
+        )
+
+
+def scan_collections(pdf_directory):
+    """Returns {collection: [PDF filenames]}: "." for the PDFs directly in
+    pdf_directory, and the name of each subdirectory holding PDFs."""
+    collections = {}
+    root_pdfs = _pdf_names(pdf_directory)
+    if root_pdfs:
+        collections[ROOT_COLLECTION] = root_pdfs
+    with os.scandir(pdf_directory) as entries:
+        for entry in entries:
+            if entry.is_dir() and not entry.name.startswith("."):
+                pdfs = _pdf_names(entry.path)
+                if pdfs:
+                    collections[entry.name] = pdfs
+    return collections
+
+
+def collections_fingerprint(pdf_directory):
+    """Like corpus_fingerprint, over the PDFs of every collection."""
+    stats = []
+    for collection, filenames in scan_collections(pdf_directory).items():
+        directory = os.path.join(pdf_directory, collection)
+        for filename in filenames:
+            stat = os.stat(os.path.join(directory, filename))
+            stats.append((qualified_source(collection, filename), stat.st_size, stat.st_mtime_ns))
+    return _fingerprint(stats)
+
+
+def index_is_current(pdf_directory, index_path):
+    """Returns whether the persisted index was built from exactly the PDFs now in pdf_directory.
+
+    Compares the corpus fingerprint recorded by the last complete sync, so the
+    check costs one directory listing whatever the corpus size.
+    """
+    if not store_exists(index_path) or not os.path.isdir(pdf_directory):
+        return False
+    fingerprint = load_manifest(index_path).get("fingerprint")
+    return fingerprint is not None and fingerprint == corpus_fingerprint(pdf_directory)
+
+
+def _record_fingerprint(manifest, current_files):
+    """Refreshes sizes and mtimes of unchanged files and the corpus fingerprint.
+
+    The fingerprint is only set when every current file is in the manifest.
+    Returns whether the manifest changed.
+    """
+    before = json.dumps(manifest, sort_keys=True)
+    known_files = manifest["files"]
+    for name, info in current_files.items():
+        known = known_files.get(name)
+        if known and known["sha256"] == info["sha256"]:
+            known.update(size=info["size"], mtime=info["mtime"])
+    if set(known_files) == set(current_files):
+        manifest["fingerprint"] = _fingerprint(
+            (name, info["size"], info["mtime"]) for name, info in current_files.items()
+        )
+    else:
+        manifest.pop("fingerprint", None)
+    return json.dumps(manifest, sort_keys=True) != before
+
+
+def plan_ingestion(current_files, known_files):
+    """Compares the directory scan with the manifest.
+
+    Returns (to_add, to_remove): new or changed files that must be extracted and
+    embedded, and removed or changed files whose vectors must be deleted.
+    """
+    to_add = [
+        name for name, info in current_files.items()
+        if name not in known_files or known_files[name]["sha256"] != info["sha256"]
+    ]
+    to_remove = [
+        name for name, info in known_files.items()
+        if name not in current_files or current_files[name]["sha256"] != info["sha256"]
+    ]
+    return to_add, to_remove
+
+
+@contextlib.contextmanager
+def _time_limit(seconds):
+    """Raises ExtractionTimeout if the block runs longer than seconds.
+
+    Relies on SIGALRM, so it is only enforced in the main thread of a process
+    (always the case in pool workers) on platforms that support it.
+    """
+    if not seconds or not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _raise_timeout(signum, frame):
+        raise ExtractionTimeout(f"timed out after {seconds:g}s")
+
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def extract_pages(filepath, start=0, end=None, timeout=None):
+    """Extracts the text of pages [start, end) of a PDF.
+
+    Returns (page_count, page_texts); pages without text yield empty strings.
+    """
+    with _time_limit(timeout):
+        reader = pypdf.PdfReader(filepath)
+        page_count = len(reader.pages)
+        end = page_count if end is None else min(end, page_count)
+        page_texts = [reader.pages[i].extract_text() or "" for i in range(start, end)]
+    return page_count, page_texts
+
+
+def is_transient(error):
+    """Whether an extraction error may not recur: a timeout, which load can
+    cause, or a worker that died (crashed or ran out of memory) mid-task."""
+    return isinstance(error, (ExtractionTimeout, BrokenProcessPool))
+
+
+class ExtractionPool:
+    """A process pool for PDF extraction that can be replaced once broken.
+
+    A worker that dies breaks a ProcessPoolExecutor for good, failing every task
+    in it; restart() starts a fresh one for the PDFs still to extract.
+    """
+
+    def __init__(self, workers=INGEST_WORKERS):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def restart(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def extract_pdfs(pdf_directory, filenames, workers=INGEST_WORKERS,
+                 pages_per_task=PDF_PAGES_PER_TASK, timeout=PDF_TIMEOUT, pool=None):
+    """Extracts page texts from PDFs in a process pool.
+
+    Each file starts as one task covering its first pages_per_task pages; larger
+    files are then fanned out into further page-range tasks. Every task is bounded
+    by timeout seconds, so a malformed PDF fails on its own instead of stalling the
+    build. Yields (filename, page_texts, None) as soon as all of a file's pages
+    are in, in completion order, and (filename, None, error) for files that fail.
+    When a worker dies, the pool is restarted (up to POOL_RESTARTS times) for
+    the files it had not finished.
+
+    pool is an existing ExtractionPool to use, so callers extracting many
+    small batches (one per shard) start the workers once.
+    """
+    if pool is not None:
+        yield from _extract_in_pool(pool, pdf_directory, filenames, pages_per_task, timeout)
+        return
+    if workers <= 1:
+        for filename in filenames:
+            try:
+                _, page_texts = extract_pages(os.path.join(pdf_directory, filename), timeout=timeout)
+            except Exception as e:
+                logger.error("Error reading '%s': %s", filename, e)
+                yield filename, None, e
+                continue
+            yield filename, page_texts, None
+        return
+
+    with ExtractionPool(workers) as pool:
+        yield from _extract_in_pool(pool, pdf_directory, filenames, pages_per_task, timeout)
+
+
+def _extract_in_pool(pool, pdf_directory, filenames, pages_per_task, timeout):
+    remaining = list(filenames)
+    for attempt in range(POOL_RESTARTS + 1):
+        if attempt:
+            logger.warning("A PDF extraction worker died; restarting the pool for %d file(s)", len(remaining))
+            pool.restart()
+        remaining = yield from _extract_files(pool, pdf_directory, remaining, pages_per_task, timeout)
+        if not remaining:
+            return
+    for filename in remaining:
+        logger.error("Error reading '%s': the extraction pool kept breaking", filename)
+        yield filename, None, BrokenProcessPool("an extraction worker died")
+
+
+def _extract_files(pool, pdf_directory, filenames, pages_per_task, timeout):
+    """Yields like extract_pdfs; returns the files a broken pool left unfinished."""
+    pending = {}
+    interrupted = []
+
+    def submit(filename, start):
+        try:
+            future = pool.submit(extract_pages, os.path.join(pdf_directory, filename), start,
+                                 start + pages_per_task, timeout)
+        except BrokenProcessPool:
+            return False
+        pending[future] = (filename, start)
+        return True
+
+    parts = {}
+    expected = {}
+    failed = set()
+
+    def interrupt(filename):
+        failed.add(filename)
+        parts.pop(filename, None)
+        interrupted.append(filename)
+
+    for filename in filenames:
+        if not submit(filename, 0):
+            interrupt(filename)
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            filename, start = pending.pop(future)
+            if filename in failed:
+                continue
+            try:
+                page_count, page_texts = future.result()
+            except BrokenProcessPool:
+                interrupt(filename)
+                continue
+            except Exception as e:
+                logger.error("Error reading '%s' (pages from %d): %s", filename, start, e)
+                failed.add(filename)
+                parts.pop(filename, None)
+                yield filename, None, e
+                continue
+
+            if start == 0:
+                range_starts = range(pages_per_task, page_count, pages_per_task)
+                expected[filename] = 1 + len(range_starts)
+                if not all(submit(filename, range_start) for range_start in range_starts):
+                    interrupt(filename)
+                    continue
+
+            file_parts = parts.setdefault(filename, {})
+            file_parts[start] = page_texts
+            if len(file_parts) == expected[filename]:
+                del parts[filename]
+                yield filename, [text for key in sorted(file_parts) for text in file_parts[key]], None
+    return interrupted
+
+
+def load_and_process_pdfs(pdf_directory, filenames=None, pool=None, on_progress=None):
+    """Loads PDFs from pdf_directory, extracts text, and splits into chunks.
+
+    Returns (chunks, metadatas, extracted, retry) where extracted lists the files
+    that were read successfully, including those without any extractable text,
+    and retry those that failed for a reason that may pass (see is_transient).
+    Files missing from both could not be parsed. chunks is a
+    span_splitter.ChunkList holding each file's text once; metadatas record the
+    source, chunk number and first and last page of every chunk. on_progress,
+    if given, is called with files= and chunks= counts as each file is split.
+    """
+    if filenames is None:
+        filenames = [f for f in os.listdir(pdf_directory) if f.lower().endswith(".pdf")]
+
+    all_chunks = ChunkList()
+    metadatas = []
+    extracted = []
+    retry = []
+    # Files are split as they come out of the pool, overlapping with extraction.
+    for filename, page_texts, error in extract_pdfs(pdf_directory, filenames, pool=pool):
+        if error is not None:
+            if is_transient(error):
+                retry.append(filename)
+            continue
+        extracted.append(filename)
+        document = split_pages(page_texts, CHUNK_SIZE, CHUNK_OVERLAP)
+        if on_progress is not None:
+            on_progress(files=1, chunks=len(document.spans))
+        if not document.spans:
+            logger.warning("Could not extract text from '%s'. Skipping.", filename)
+            continue
+        all_chunks.append(document)
+        for chunk_idx, (start, end) in enumerate(document.spans):
+            metadatas.append({"source": filename, "chunk": chunk_idx, "pages": list(document.page_range(start, end))})
+
+    return all_chunks, metadatas, extracted, retry
+
+
+def _open_for_update(index_path, manifest):
+    """Opens the persisted store for writing, or starts an empty one.
+
+    Returns (vector_store, manifest); the manifest is reset whenever the store
+    cannot be opened, since its chunk ids would then point nowhere.
+    """
+    if not manifest["files"] or not store_exists(index_path):
+        return FaissStore(), empty_manifest()
+    try:
+        vector_store = FaissStore.load(index_path, writable=True)
+    except Exception as e:
+        logger.warning("Failed to load existing FAISS index (%s). Rebuilding...", e)
+        return FaissStore(), empty_manifest()
+
+    # Vectors no manifest entry owns were left behind by an interrupted run.
+    tracked = {cid for info in manifest["files"].values() for cid in info["chunk_ids"]}
+    orphans = [cid for cid in vector_store.ids() if cid not in tracked]
+    if orphans:
+        vector_store.delete(orphans)
+    return vector_store, manifest
+
+
+def _live_chunk_count(manifest):
+    return sum(len(info["chunk_ids"]) for info in manifest["files"].values())
+
+
+def _needs_rebuild(store_info, live_chunks):
+    """Returns whether the index should be rebuilt, either because the configured
+    (or auto-chosen) index type changed or because too many of its vectors are stale."""
+    desired = resolve_index_type(INDEX_TYPE, live_chunks, current=store_info["index_type"])
+    too_stale = store_info["stale_vectors"] > STALE_REBUILD_FRACTION * max(store_info["vectors"], 1)
+    return desired != store_info["index_type"] or too_stale
+
+
+def _rebuild_store(vector_store, manifest, embeddings):
+    """Re-indexes every live chunk into a fresh index of the desired type.
+
+    Texts come from the chunk store, so no PDF is re-read, and vectors come
+    back through the embedding cache. Text shared by overlapping chunks stays
+    shared, and that of deleted chunks is dropped. Chunk ids in the manifest
+    are remapped only once the new store is complete.
+    """
+    old_ids = [cid for info in manifest["files"].values() for cid in info["chunk_ids"]]
+    index_type = resolve_index_type(INDEX_TYPE, len(old_ids), current=vector_store.index_type)
+    logger.info("Rebuilding %d chunks into a '%s' index", len(old_ids), index_type)
+    texts = vector_store.chunks.get_texts(old_ids)
+    metadatas = [vector_store.chunks.get(cid)[1] for cid in old_ids]
+
+    new_store = FaissStore(index_type=index_type, expected_size=len(old_ids))
+    new_ids = {}
+
+    def add_batch(start, vectors):
+        end = start + len(vectors)
+        ids = new_store.add_embeddings(zip(texts[start:end], vectors), metadatas[start:end])
+        new_ids.update(zip(old_ids[start:end], ids))
+
+    embed_in_batches(embeddings, texts, add_batch)
+    for info in manifest["files"].values():
+        info["chunk_ids"] = [new_ids[cid] for cid in info["chunk_ids"]]
+    return new_store
+
+
+def sync_vector_store(embeddings, pdf_directory, index_path, filenames=None, pool=None, on_progress=None,
+                      rebuild_path=None):
+    """Brings the persisted vector store in line with the PDFs in pdf_directory
+    (or only those in filenames).
+
+    Only new or changed PDFs are extracted and embedded; vectors of removed or
+    changed PDFs are deleted from the index in place. The store and its manifest
+    are saved to index_path when anything changed, and the store is not opened
+    at all when nothing did. on_progress, if given, is called with files=,
+    chunks= and vectors= counts as PDFs are split and chunks indexed.
+
+    An index that needs rebuilding (see _needs_rebuild) gets fresh chunk ids,
+    so it is written with its manifest to the new directory rebuild_path,
+    leaving index_path intact for its readers, and summary["rebuilt"] is set
+    for the caller to swap it in. Without rebuild_path it is rebuilt in place,
+    which is only safe for a directory nothing reads yet.
+
+    Returns a summary dict of the files and chunks added and removed.
+    """
+    if not os.path.isdir(pdf_directory):
+        raise FileNotFoundError(f"PDF directory '{pdf_directory}' not found.")
+
+    manifest = load_manifest(index_path)
+    current_files = scan_pdf_dir(pdf_directory, manifest["files"], filenames)
+    to_add, to_remove = plan_ingestion(current_files, manifest["files"])
+    if not to_add and not to_remove and (
+        not store_exists(index_path)
+        or not _needs_rebuild(read_store_info(index_path), _live_chunk_count(manifest))
+    ):
+        if _record_fingerprint(manifest, current_files) and store_exists(index_path):
+            save_manifest(index_path, manifest)
+        return {"added": 0, "removed": 0, "chunks_added": 0, "chunks_removed": 0, "retry": 0, "rebuilt": False}
+
+    vector_store, manifest = _open_for_update(index_path, manifest)
+    known_files = manifest["files"]
+    to_add, to_remove = plan_ingestion(current_files, known_files)
+
+    stale_ids = [cid for name in to_remove for cid in known_files[name]["chunk_ids"]]
+    vector_store.delete(stale_ids)
+    for name in to_remove:
+        del known_files[name]
+
+    with metrics.span("pdf_extract"):
+        chunks, metadatas, extracted, retry = load_and_process_pdfs(pdf_directory, to_add, pool, on_progress)
+    if vector_store.index is None:
+        live_chunks = _live_chunk_count(manifest) + len(chunks)
+        vector_store.index_type = resolve_index_type(INDEX_TYPE, live_chunks)
+        vector_store.expected_size = live_chunks
+    file_chunk_ids = defaultdict(list)
+    remaining = Counter(meta["source"] for meta in metadatas)
+    for name in extracted:
+        if name not in remaining:
+            known_files[name] = dict(current_files[name], chunk_ids=[])
+    failed = set(to_add).difference(extracted, retry)
+    for name in failed:
+        # Not retried until the file changes, so a malformed PDF is not parsed
+        # again on every start.
+        logger.warning("Skipping '%s' until it changes: its text could not be extracted.", name)
+        known_files[name] = dict(current_files[name], chunk_ids=[], failed=True)
+    for name in retry:
+        # Left out of the manifest, so the next sync tries it again.
+        logger.warning("Extracting '%s' timed out or its worker died; it will be retried on the next sync.", name)
+    if (failed or retry) and on_progress is not None:
+        on_progress(files=len(failed) + len(retry))
+
+    chunks_added = 0
+
+    def add_batch(start, vectors):
+        nonlocal chunks_added
+        end = start + len(vectors)
+        batch_metadatas = metadatas[start:end]
+        ids = vector_store.add_embeddings(zip(chunks[start:end], vectors), batch_metadatas)
+        chunks_added += len(ids)
+        if on_progress is not None:
+            on_progress(vectors=len(ids))
+        # A file enters the manifest only once all of its chunks are in the index.
+        for chunk_id, meta in zip(ids, batch_metadatas):
+            name = meta["source"]
+            file_chunk_ids[name].append(chunk_id)
+            remaining[name] -= 1
+            if not remaining[name]:
+                known_files[name] = dict(current_files[name], chunk_ids=sorted(file_chunk_ids[name]))
+
+    try:
+        with metrics.span("embed_and_index"):
+            embed_in_batches(embeddings, chunks, add_batch)
+    finally:
+        # Saved even when a batch fails, so the next run resumes with only the
+        # files that did not finish. Store first: a manifest must never list
+        # chunks the saved store lacks.
+        with metrics.span("index_save"):
+            vector_store.save(index_path)
+            _record_fingerprint(manifest, current_files)
+            save_manifest(index_path, manifest)
+
+    store_info = {
+        "index_type": vector_store.index_type,
+        "vectors": vector_store.ntotal,
+        "stale_vectors": vector_store.stale_vectors,
+    }
+    rebuilt = vector_store.index is not None and _needs_rebuild(store_info, _live_chunk_count(manifest))
+    if rebuilt:
+        target = rebuild_path or index_path
+        with metrics.span("index_rebuild"):
+            _rebuild_store(vector_store, manifest, embeddings).save(target)
+            save_manifest(target, manifest)
+
+    summary = {
+        "added": len(to_add),
+        "removed": len(to_remove),
+        "chunks_added": chunks_added,
+        "chunks_removed": len(stale_ids),
+        "retry": len(retry),
+        "rebuilt": rebuilt,
+    }
+    metrics.inc("chunks_indexed_total", chunks_added)
+    logger.info("Knowledge base sync: %s", summary)
+    return summary
+
+
+def shard_layout(pdf_directory, shard_by):
+    """Returns {shard key: (collection, filenames)} for the PDFs in pdf_directory."""
+    if shard_by not in SHARD_MODES:
+        raise ValueError(f"Unknown shard mode '{shard_by}'. Expected one of: none, {', '.join(SHARD_MODES)}.")
+    layout = {}
+    for collection, filenames in scan_collections(pdf_directory).items():
+        if shard_by == "collection":
+            layout[collection] = (collection, filenames)
+        else:
+            for filename in filenames:
+                layout[qualified_source(collection, filename)] = (collection, [filename])
+    return layout
+
+
+def _catalog_entry(key, collection, path):
+    manifest = load_manifest(path)
+    return {
+        "dir": os.path.basename(path),
+        "collection": collection,
+        "sources": sorted(
+            qualified_source(collection, name) for name, info in manifest["files"].items() if info["chunk_ids"]
+        ),
+        "chunks": _live_chunk_count(manifest),
+        "version": read_store_info(path)["version"],
+    }
+
+
+def sync_sharded_store(embeddings, pdf_directory, index_path, shard_by=SHARD_BY, shards=None, rebuild=False,
+                       on_progress=None, live=True):
+    """Brings a sharded index (see sharded_store) in line with the collections in pdf_directory.
+
+    Every shard is synced incrementally, like a single index. With shards, only
+    those shard keys are synced and every other shard is left untouched; with
+    rebuild, the selected shards are indexed from scratch, their vectors mostly
+    coming back from the embedding cache. A full sync deletes shards whose PDFs
+    are gone.
+
+    A rebuilt shard is written to a new directory, which the catalog then
+    points at in place of the old one, unless live is False (an index nothing
+    reads yet).
+
+    Returns the summed summary of the synced shards and their number.
+    """
+    if not os.path.isdir(pdf_directory):
+        raise FileNotFoundError(f"PDF directory '{pdf_directory}' not found.")
+    fingerprint = collections_fingerprint(pdf_directory)
+    layout = shard_layout(pdf_directory, shard_by)
+    catalog = load_catalog(index_path)
+    if catalog is None or catalog["shard_by"] != shard_by:
+        catalog = {"shard_by": shard_by, "shards": {}}
+    unknown = set(shards or ()).difference(layout)
+    if unknown:
+        raise ValueError(f"Unknown shard(s): {', '.join(sorted(unknown))}.")
+    targets = list(layout) if shards is None else list(shards)
+
+    summary = {"added": 0, "removed": 0, "chunks_added": 0, "chunks_removed": 0, "retry": 0, "rebuilt": 0,
+               "shards": len(targets)}
+    complete = False
+    # One extraction pool for every shard, instead of one per shard.
+    pool = ExtractionPool(INGEST_WORKERS) if INGEST_WORKERS > 1 else None
+    try:
+        for key in targets:
+            collection, filenames = layout[key]
+            entry = catalog["shards"].get(key)
+            path = os.path.join(index_path, SHARDS_DIRNAME, entry["dir"]) if entry else shard_path(index_path, key)
+            # Readers of the current catalog may still open the shard's old directory.
+            new_path = f"{shard_path(index_path, key)}.{uuid.uuid4().hex[:8]}" if live else None
+            if rebuild and os.path.isdir(path):
+                if new_path is None:
+                    shutil.rmtree(path)
+                else:
+                    path = new_path
+            rebuild_path = new_path if path != new_path else None
+            shard_summary = sync_vector_store(
+                embeddings, os.path.join(pdf_directory, collection), path, filenames, pool, on_progress, rebuild_path
+            )
+            if shard_summary["rebuilt"] and rebuild_path is not None:
+                path = rebuild_path
+            for name, value in shard_summary.items():
+                summary[name] += value
+            if store_exists(path):
+                catalog["shards"][key] = _catalog_entry(key, collection, path)
+            else:
+                catalog["shards"].pop(key, None)
+        if shards is None:
+            for key in set(catalog["shards"]).difference(layout):
+                del catalog["shards"][key]
+        complete = True
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        # A single-shard sync leaves the rest of the corpus as it was, so the
+        # recorded fingerprint stays valid; a failed one may not have, and one
+        # with PDFs to retry must not hide them from the next startup check.
+        if shards is None and complete and not summary["retry"]:
+            catalog["fingerprint"] = fingerprint
+        elif not complete or summary["retry"]:
+            catalog.pop("fingerprint", None)
+        save_catalog(index_path, catalog)
+
+    _remove_unused_shards(index_path, catalog, layout)
+    logger.info("Sharded knowledge base sync: %s", summary)
+    return summary
+
+
+def _remove_unused_shards(index_path, catalog, layout):
+    """Deletes shard directories the catalog no longer names, once no reader of an older catalog is left."""
+    shards_dir = os.path.join(index_path, SHARDS_DIRNAME)
+    # Shards without a store keep their directory, whose manifest records the PDFs that failed.
+    keep = {entry["dir"] for entry in catalog["shards"].values()}
+    keep.update(shard_dirname(key) for key in layout if key not in catalog["shards"])
+    unused = [name for name in os.listdir(shards_dir) if name not in keep] if os.path.isdir(shards_dir) else []
+    if not unused:
+        return
+    with unread(index_path, catalog["version"]) as unread_by_others:
+        if not unread_by_others:
+            # Deleted by a later sync, once those readers are gone.
+            logger.info("Keeping %d old shard directories of %s while they are being read", len(unused), index_path)
+            return
+        for name in unused:
+            shutil.rmtree(os.path.join(shards_dir, name), ignore_errors=True)
+
+
+def sync_index(embeddings, pdf_directory, index_path, shard_by=SHARD_BY, shards=None, rebuild=False,
+               on_progress=None, live=True):
+    """Syncs the single index, or the sharded one when shard_by is "collection" or "source".
+
+    index_path is resolved to its current version (see index_versions). A
+    single index that has to be rebuilt becomes a new version, made current
+    once it is complete; pass live=False for an index nothing reads yet (a
+    background rebuild's), which is then rebuilt in place, and versions it
+    replaces are deleted once unused. The sync holds index_path's writer lock
+    (see index_versions.writer_lock) throughout.
+    """
+    # Writers in other processes (the app's startup sync, python -m ingest, the
+    # service's /ingest) would otherwise append to the same chunk files.
+    with writer_lock(index_path):
+        path = active_index_path(index_path)
+        if shard_by != "none":
+            return sync_sharded_store(embeddings, pdf_directory, path, shard_by, shards, rebuild, on_progress, live)
+        if shards or rebuild:
+            raise ValueError("Selecting or rebuilding shards needs ANYBIO_SHARD_BY=collection or source.")
+        if not live:
+            return sync_vector_store(embeddings, pdf_directory, path, on_progress=on_progress)
+        version = new_version_name()
+        # Only created if the index is rebuilt. Cleanup waits for the writer
+        # lock, so it cannot remove the unfinished version.
+        building = version_path(index_path, version + BUILDING_SUFFIX)
+        summary = sync_vector_store(embeddings, pdf_directory, path, on_progress=on_progress, rebuild_path=building)
+        if summary["rebuilt"]:
+            os.replace(building, version_path(index_path, version))
+            set_current_version(index_path, version)
+            logger.info("Rebuilt index %s as version %s", index_path, version)
+            remove_unused_versions(index_path, index_registry.in_use(index_path))
+        return summary
+
+
+def _catalog_version(index_path):
+    return (load_catalog(index_path) or {}).get("version")
+
+
+def _open_sharded_store(make_embeddings, pdf_directory, root, check_corpus, shard_by):
+    index_path = active_index_path(root)
+    with metrics.span("corpus_check"):
+        catalog = load_catalog(index_path)
+        current = catalog is not None and catalog["shard_by"] == shard_by and (
+            not check_corpus or not os.path.isdir(pdf_directory)
+            or catalog.get("fingerprint") == collections_fingerprint(pdf_directory)
+        )
+    if not current:
+        with metrics.span("sync"):
+            sync_index(make_embeddings(), pdf_directory, root, shard_by)
+    # Shards open lazily, so the lease on the catalog version is held for the store's lifetime.
+    while True:
+        index_path, lease = lease_current(root, _catalog_version)
+        catalog = load_catalog(index_path)
+        if lease is None or not catalog or not catalog["shards"]:
+            if lease is not None:
+                lease.release()
+            return None
+        if lease_file(index_path, catalog["version"]) == lease.path:
+            break
+        # Re-synced between taking the lease and reading the catalog.
+        lease.release()
+    with metrics.span("index_load"):
+        return lease.bind(ShardedStore(index_path, catalog))
+
+
+def open_vector_store(make_embeddings, pdf_directory, index_path, check_corpus=STARTUP_CORPUS_CHECK,
+                      shard_by=SHARD_BY):
+    """Returns the persisted store opened read-only, syncing it first unless it is current.
+
+    An existing index is served as is when check_corpus is off, when
+    pdf_directory is missing, or when its fingerprint matches; only otherwise
+    is make_embeddings() called and the corpus synced. Returns None if the
+    corpus has no text to index. With shard_by "collection" or "source", the
+    result is a ShardedStore. index_path is resolved to its current version
+    (see index_versions).
+    """
+    root = index_path
+    index_path = active_index_path(index_path)
+    if shard_by != "none":
+        return _open_sharded_store(make_embeddings, pdf_directory, root, check_corpus, shard_by)
+    with metrics.span("corpus_check"):
+        current = store_exists(index_path) and (
+            not check_corpus or not os.path.isdir(pdf_directory) or index_is_current(pdf_directory, index_path)
+        )
+    if not current:
+        with metrics.span("sync"):
+            sync_index(make_embeddings(), pdf_directory, root, shard_by)
+    index_path, lease = lease_current(root)
+    if lease is None or not store_exists(index_path):
+        if lease is not None:
+            lease.release()
+        return None
+    try:
+        with metrics.span("index_load"):
+            store = FaissStore.load(index_path)
+    except BaseException:
+        lease.release()
+        raise
+    return lease.bind(store)
+
+
+if __name__ == "__main__":
+    # Syncs the knowledge base outside the app, e.g. when the app runs with
+    # ANYBIO_STARTUP_CORPUS_CHECK=0, or re-indexes single shards.
+    import argparse
+
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    from config import PDF_DIR, FAISS_INDEX_PATH, GEMINI_EMBEDDING_MODEL
+    from embedding_cache import CachedEmbeddings
+
+    parser = argparse.ArgumentParser(description="Syncs the knowledge base with the PDF directory.")
+    parser.add_argument("--shard", action="append", dest="shards",
+                        help="only sync this shard (a collection, or a PDF path when sharding by source); repeatable")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="discard the selected shards (all, without --shard) and index them from scratch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    embeddings = CachedEmbeddings(
+        GoogleGenerativeAIEmbeddings(model=GEMINI_EMBEDDING_MODEL, google_api_key=os.getenv("GOOGLE_API_KEY")),
+        GEMINI_EMBEDDING_MODEL,
+    )
+    print(json.dumps(sync_index(embeddings, PDF_DIR, FAISS_INDEX_PATH, shards=args.shards, rebuild=args.rebuild)))
@@ -0,0 +1,210 @@
+"""BM25 inverted index over chunk texts, persisted next to the FAISS index.
+
+Files in an index directory:
+
+    lexical_vocab.json     terms, in term-id order
+    lexical_postings.npy   int64 array of shape (3, n): term id, chunk id and term
+                           frequency of every posting, sorted by term then chunk
+    lexical_docs.npy       int64 array of shape (2, n): chunk id and token count of
+                           every indexed chunk, sorted by chunk id
+
+Readers memory-map the arrays; a query only touches the postings of its own
+terms, found by binary search on the term row.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+VOCAB_FILENAME = "lexical_vocab.json"
+POSTINGS_FILENAME = "lexical_postings.npy"
+DOCS_FILENAME = "lexical_docs.npy"
+LEXICAL_FILES = (VOCAB_FILENAME, POSTINGS_FILENAME, DOCS_FILENAME)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Command-line flags, then words that may contain inner punctuation
+# (NM_000546.6, chr17:7668402, hg38.fa), then single characters.
+_TOKEN_RE = re.compile(r"--?[^\W\d_][\w-]*|\w[\w.:-]*\w|\w")
+_PART_RE = re.compile(r"[._:-]+")
+_IDENTIFIER_PUNCT_RE = re.compile(r"\w[._:]\w")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it its of on or "
+    "that the this to was what when where which who why will with you your".split()
+)
+
+
+def tokenize(text, parts=True):
+    """Lower-cased tokens of text, without stopwords. Compound tokens are kept
+    whole and, with parts, also split, so "NM_000546.6" matches both itself and
+    "NM_000546"."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if parts and not token.startswith("-") and _PART_RE.search(token):
+            tokens.extend(part for part in _PART_RE.split(token) if len(part) > 1 and part not in _STOPWORDS)
+    return tokens
+
+
+def is_identifier(token):
+    """Whether a token looks like an exact identifier rather than a word: a
+    command-line flag, or letters mixed with digits or inner punctuation
+    (TP53, ENSG00000141510, rs334, NM_000546.6)."""
+    if token.startswith("-"):
+        return True
+    has_alpha = any(c.isalpha() for c in token)
+    has_digit = any(c.isdigit() for c in token)
+    # Hyphens alone do not count: "paired-end" is a word.
+    return has_digit and (has_alpha or len(token) > 4) or has_alpha and bool(_IDENTIFIER_PUNCT_RE.search(token))
+
+
+def _empty_postings():
+    return np.zeros((3, 0), dtype=np.int64)
+
+
+def _empty_docs():
+    return np.zeros((2, 0), dtype=np.int64)
+
+
+class LexicalIndex:
+    """BM25 search over chunks addressed by the same ids as the vector index.
+
+    Additions and deletions are buffered and merged into the sorted arrays on
+    the next search or save.
+    """
+
+    def __init__(self, vocab=None, postings=None, docs=None):
+        self._terms = list(vocab or [])
+        self._vocab = {term: term_id for term_id, term in enumerate(self._terms)}
+        self._postings = postings if postings is not None else _empty_postings()
+        self._docs = docs if docs is not None else _empty_docs()
+        self._added = []
+        self._deleted = set()
+        self._refresh_stats()
+
+    @classmethod
+    def load(cls, index_path, writable=False):
+        """Opens a persisted index, or returns None if index_path has none."""
+        if not all(os.path.exists(os.path.join(index_path, name)) for name in LEXICAL_FILES):
+            return None
+        with open(os.path.join(index_path, VOCAB_FILENAME), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        mmap_mode = None if writable else "r"
+        postings = np.load(os.path.join(index_path, POSTINGS_FILENAME), mmap_mode=mmap_mode)
+        docs = np.load(os.path.join(index_path, DOCS_FILENAME), mmap_mode=mmap_mode)
+        return cls(vocab, postings, docs)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Indexes every live chunk of a ChunkStore."""
+        index = cls()
+        for chunk_id in range(len(chunks)):
+            chunk = chunks.get(chunk_id)
+            if chunk is not None:
+                index.add([chunk_id], [chunk[0]])
+        return index
+
+    def __len__(self):
+        self._merge()
+        return self._docs.shape[1]
+
+    def _refresh_stats(self):
+        self._doc_count = self._docs.shape[1]
+        self._avg_length = float(self._docs[1].sum()) / self._doc_count if self._doc_count else 0.0
+
+    def contains(self, term):
+        return term in self._vocab
+
+    def add(self, ids, texts):
+        for chunk_id, text in zip(ids, texts):
+            self._added.append((chunk_id, Counter(tokenize(text))))
+
+    def delete(self, ids):
+        self._deleted.update(ids)
+
+    def _merge(self):
+        if not self._added and not self._deleted:
+            return
+        postings, docs = self._postings, self._docs
+        if self._deleted:
+            deleted = np.fromiter(self._deleted, dtype=np.int64)
+            postings = postings[:, ~np.isin(postings[1], deleted)]
+            docs = docs[:, ~np.isin(docs[0], deleted)]
+        added = [(chunk_id, counts) for chunk_id, counts in self._added if chunk_id not in self._deleted]
+        if added:
+            rows = []
+            for chunk_id, counts in added:
+                for term, tf in counts.items():
+                    term_id = self._vocab.get(term)
+                    if term_id is None:
+                        term_id = self._vocab[term] = len(self._terms)
+                        self._terms.append(term)
+                    rows.append((term_id, chunk_id, tf))
+            new_postings = np.array(rows, dtype=np.int64).reshape(-1, 3).T
+            new_docs = np.array([(chunk_id, sum(counts.values())) for chunk_id, counts in added],
+                                dtype=np.int64).reshape(-1, 2).T
+            postings = np.concatenate([postings, new_postings], axis=1)
+            docs = np.concatenate([docs, new_docs], axis=1)
+            postings = postings[:, np.lexsort((postings[1], postings[0]))]
+            docs = docs[:, np.argsort(docs[0], kind="stable")]
+        self._postings = np.ascontiguousarray(postings)
+        self._docs = np.ascontiguousarray(docs)
+        self._added = []
+        self._deleted = set()
+        self._refresh_stats()
+
+    def _lengths(self, chunks):
+        rows = np.minimum(np.searchsorted(self._docs[0], chunks), self._doc_count - 1)
+        lengths = self._docs[1][rows].astype(np.float64)
+        # A reader that opened the files mid-save may miss a chunk's length.
+        lengths[self._docs[0][rows] != chunks] = self._avg_length
+        return lengths
+
+    def search(self, query, k=5):
+        """Returns up to k (chunk id, BM25 score) pairs, best first."""
+        self._merge()
+        term_ids = sorted({self._vocab[term] for term in tokenize(query) if term in self._vocab})
+        if not term_ids or not self._doc_count:
+            return []
+        term_row, chunk_row, tf_row = self._postings
+        starts = np.searchsorted(term_row, term_ids, side="left")
+        ends = np.searchsorted(term_row, term_ids, side="right")
+        chunk_ids, scores = [], []
+        for start, end in zip(starts, ends):
+            if start == end:
+                continue
+            chunks = np.asarray(chunk_row[start:end])
+            tf = np.asarray(tf_row[start:end], dtype=np.float64)
+            lengths = self._lengths(chunks)
+            df = end - start
+            idf = math.log(1 + (self._doc_count - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / self._avg_length)
+            chunk_ids.append(chunks)
+            scores.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        if not chunk_ids:
+            return []
+        unique_ids, inverse = np.unique(np.concatenate(chunk_ids), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        top = np.argsort(-totals, kind="stable")[:k]
+        return [(int(unique_ids[i]), float(totals[i])) for i in top]
+
+    def save(self, index_path):
+        self._merge()
+        os.makedirs(index_path, exist_ok=True)
+        # Term ids are never reused, so writing the vocabulary first keeps every
+        # posting a concurrent reader loads resolvable.
+        for filename, write in (
+            (VOCAB_FILENAME, lambda f: f.write(json.dumps(self._terms).encode("utf-8"))),
+            (DOCS_FILENAME, lambda f: np.save(f, self._docs)),
+            (POSTINGS_FILENAME, lambda f: np.save(f, self._postings)),
+        ):
+            filepath = os.path.join(index_path, filename)
+            with open(filepath + ".tmp", "wb") as f:
+                write(f)
+            os.replace(filepath + ".tmp", filepath)
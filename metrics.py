@@ -0,0 +1,261 @@
+"""Process-wide metrics: stage timings, counters, histograms and a per-request log.
+
+Everything is aggregated in module state shared by all threads, so Streamlit
+sessions served by one process report together. With ANYBIO_METRICS=0, span()
+returns a shared no-op context manager and inc()/observe() return at once.
+
+    with metrics.trace("chat"):             # one record in the request log
+        with metrics.span("vector_search"): # duration histogram per stage
+            ...
+        metrics.inc("cache_requests_total", cache="answers", result="hit")
+        metrics.observe("prompt_tokens", 1234)
+
+serve(port) exposes /metrics (Prometheus text format) and /metrics.json.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_ENABLED, REQUEST_LOG_PATH
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "anybio_"
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 16000, 32000)
+SCORE_BUCKETS = {
+    # Squared L2 distance between unit-length embeddings.
+    "vector": (0.1, 0.2, 0.4, 0.6, 0.8, 1.0, 1.2, 1.4, 1.6, 2.0, 4.0),
+    "lexical": (1, 2, 5, 10, 15, 20, 30, 50, 100),
+    "hybrid": (0.005, 0.01, 0.015, 0.02, 0.025, 0.03, 0.035),
+}
+
+_enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_trace = contextvars.ContextVar("metrics_trace", default=None)
+_log_lock = threading.Lock()
+_server = None
+
+
+def enabled():
+    return _enabled
+
+
+def set_enabled(value):
+    global _enabled
+    _enabled = bool(value)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+def inc(name, value=1, **labels):
+    """Adds value to a counter."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=SECONDS_BUCKETS, **labels):
+    """Records value in a histogram; buckets only matter the first time a series is seen."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+def annotate(**fields):
+    """Adds fields to the request-log record of the current trace, if any."""
+    record = _trace.get()
+    if record is not None:
+        record.update(fields)
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        observe("stage_duration_seconds", seconds, stage=self.stage)
+        # GeneratorExit only means a streamed stage was abandoned.
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            inc("errors_total", stage=self.stage)
+        record = _trace.get()
+        if record is not None:
+            stages = record["stages"]
+            stages[self.stage] = round(stages.get(self.stage, 0.0) + seconds, 6)
+        return False
+
+
+_NOOP = contextlib.nullcontext()
+
+
+def span(stage):
+    """Times a pipeline stage into stage_duration_seconds{stage=...} and the current trace."""
+    if not _enabled and _trace.get() is None:
+        return _NOOP
+    return _Span(stage)
+
+
+@contextlib.contextmanager
+def trace(kind, **fields):
+    """Collects the spans and annotations of one request (a chat turn, startup)
+    into a record, yielded to the caller and appended as a JSON line to
+    ANYBIO_REQUEST_LOG when that is set. Yields None when metrics are off and
+    there is no log."""
+    if not _enabled and not REQUEST_LOG_PATH:
+        yield None
+        return
+    record = {"time": datetime.now(timezone.utc).isoformat(), "kind": kind, **fields, "stages": {}}
+    token = _trace.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        _trace.reset(token)
+        record["duration_s"] = round(time.perf_counter() - start, 6)
+        if REQUEST_LOG_PATH:
+            _write_request_log(record)
+
+
+def _write_request_log(record):
+    line = json.dumps(record, default=str) + "\n"
+    try:
+        with _log_lock, open(REQUEST_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        logger.warning("Could not write request log '%s': %s", REQUEST_LOG_PATH, e)
+
+
+def snapshot():
+    """Returns every series as plain data, for the JSON endpoint."""
+    with _lock:
+        counters = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+        histograms = [
+            {
+                "name": name,
+                "labels": dict(labels),
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "buckets": dict(zip([*map(str, histogram.buckets), "+Inf"], histogram.counts)),
+            }
+            for (name, labels), histogram in sorted(_histograms.items())
+        ]
+    return {"counters": counters, "histograms": histograms}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render_prometheus():
+    """Returns every series in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        typed = set()
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+            lines.append(f"{PREFIX}{name}{_labels_text(labels)} {value}")
+        for (name, labels), histogram in sorted(_histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+            cumulative = 0
+            for bound, count in zip([*map(str, histogram.buckets), "+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f"{PREFIX}{name}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_labels_text(labels)} {histogram.sum}")
+            lines.append(f"{PREFIX}{name}_count{_labels_text(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body, content_type = render_prometheus(), "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(snapshot()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics endpoint: " + format, *args)
+
+
+def serve(port, host="127.0.0.1"):
+    """Starts the metrics endpoint on a daemon thread, once per process."""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-endpoint", daemon=True).start()
+            logger.info("Serving metrics on http://%s:%d/metrics", host, _server.server_address[1])
+    return _server
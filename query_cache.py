@@ -0,0 +1,166 @@
+"""Process-wide caches for query embeddings and generated answers."""
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from config import (
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+)
+
+_MISSING = object()
+
+
+def normalize_query(query):
+    """Case-folds and collapses whitespace and trailing punctuation, so trivially
+    different phrasings of the same question share cache entries."""
+    return " ".join(query.casefold().split()).rstrip(" ?!.")
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ttl seconds after insertion."""
+
+    def __init__(self, maxsize, ttl, name="cache"):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None, record=True):
+        """Returns the live entry for key, or default; record=False leaves hit/miss counts alone."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            hit = entry is not _MISSING and entry[0] > time.monotonic()
+            if hit:
+                self._data.move_to_end(key)
+                self.hits += record
+            else:
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += record
+        if record:
+            metrics.inc("cache_requests_total", cache=self.name, result="hit" if hit else "miss")
+        return entry[1] if hit else default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller runs the function; callers arriving while it is in flight
+    wait for it and receive the same result or exception.
+    """
+
+    def __init__(self, name="calls"):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def join(self, key):
+        """Returns (True, None) if no call for key is in flight, making the caller
+        its leader, or (False, result) once the leader's call ends.
+
+        Suits results produced over time, like streamed answers, where do()
+        does not fit. A leader must end the call with finish(), fail() or
+        abandon(); followers receive its exception, and retry when it abandons.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    self._calls[key] = {"done": threading.Event(), "result": _MISSING, "error": None}
+                    return True, None
+                self.coalesced += 1
+            metrics.inc("coalesced_requests_total", flight=self.name)
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            if call["result"] is not _MISSING:
+                return False, call["result"]
+
+    def _end(self, key, result=_MISSING, error=None):
+        with self._lock:
+            call = self._calls.pop(key)
+        call["result"] = result
+        call["error"] = error
+        call["done"].set()
+
+    def finish(self, key, result):
+        self._end(key, result=result)
+
+    def fail(self, key, error):
+        self._end(key, error=error)
+
+    def abandon(self, key):
+        """Ends a call without a result; its followers retry, one of them leading."""
+        self._end(key)
+
+    def do(self, key, fn):
+        leader, result = self.join(key)
+        if not leader:
+            return result
+        try:
+            result = fn()
+        except BaseException as e:
+            self.fail(key, e)
+            raise
+        self.finish(key, result)
+        return result
+
+
+def cached_call(cache, flight, key, fn):
+    """Returns cache[key], computing it with fn at most once across concurrent callers."""
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    def compute():
+        # Another caller may have filled the entry while we waited to lead.
+        value = cache.get(key, _MISSING, record=False)
+        if value is _MISSING:
+            value = fn()
+            cache.put(key, value)
+        return value
+
+    return flight.do(key, compute)
+
+
+query_vectors = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL, name="query_vectors")
+answers = TTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, name="answers")
+query_flight = SingleFlight("query_vectors")
+answer_flight = SingleFlight("answers")
+
+
+def stats():
+    return {
+        "query_vectors": query_vectors.stats(),
+        "answers": answers.stats(),
+        "coalesced": query_flight.coalesced + answer_flight.coalesced,
+    }
@@ -0,0 +1,406 @@
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import google.generativeai as genai
+
+import metrics
+import query_cache
+from config import (
+    LANGUAGES,
+    GEMINI_EMBEDDING_MODEL,
+    GEMINI_GENERATIVE_MODEL,
+    RETRIEVAL_MODE,
+    HYBRID_CANDIDATES,
+    RRF_K,
+    LEXICAL_FAST_PATH_FRACTION,
+    GENERATION_CONCURRENCY,
+    EMBED_BATCH_SIZE,
+    EMBED_REQUESTS_PER_MINUTE,
+)
+from context_assembly import assemble_context, estimate_tokens
+from embedding_cache import embed_query_batch
+from embedding_pipeline import TokenBucket, embed_with_retry
+from lexical_index import is_identifier, tokenize
+from sharded_store import apply_filter
+from query_cache import cached_call, normalize_query
+
+logger = logging.getLogger(__name__)
+
+# The fixed instructions that open every prompt.
+PROMPT_PREAMBLE = """You are a helpful assistant knowledgeable in bioinformatician assisting a biomedical research in a practical analysis of genomic data, answering questions based on the provided text snippets
+
+        In your  response you will be giving a practical assistance. To enable the researcher to make full use of your knowledge you will give a quick introduction on how these particular analysis will be structured. 
+        The response will be a combination of responding with the theory and how to perform bioinformatic analysis on real data.
+
+        Sections will be labelled according to its intended purpose and are described below:
+
+        General text:
+
+            Text which does not have any special formatting and looks (plain) like this will guide you through the practicals, providing background and explaining what anlyses we are performing, and why.
+            Checkpoints
+            Text which appears in boxes of this colour aims to inform you of a significant checkpoint in your analysis. When you see this, it is good to take a moment to think about what you have acomplished so far and what you have yet to do.
+        
+        Code:
+
+            Text which appears in boxes of this colour will tell that you are looking at a terminal command.
+            You can copy and paste from here straight to the terminal but before you do take a moment to understand what the command is actually doing.
+            Several command lines may be present, with each new line representing a single command. 
+
+        Screen output:
+
+            Text appearing in these boxes represents output you might expect to see in the terminal in response to a command.
+            Check to see if you get a similar output!
+
+        Questions:
+            Text in these boxes will usually ask an open ended question.
+
+        Answer:
+            You can answer the above questions in the text boxes provided.
+"""
+
+# Bounds concurrent Gemini calls across every session and service request.
+_generation_slots = threading.BoundedSemaphore(GENERATION_CONCURRENCY)
+
+
+def embed_query(query, embeddings):
+    """Returns the query vector, cached process-wide by embedding model and normalised text.
+
+    The query itself is embedded as written, so case-sensitive identifiers
+    ("TP53") keep their meaning; only the cache key is normalised.
+    """
+    key = (getattr(embeddings, "model", GEMINI_EMBEDDING_MODEL), normalize_query(query))
+
+    def compute():
+        with metrics.span("query_embedding"):
+            return embeddings.embed_query(query)
+
+    return cached_call(query_cache.query_vectors, query_cache.query_flight, key, compute)
+
+
+def embed_queries(queries, embeddings, batch_size=EMBED_BATCH_SIZE, requests_per_minute=EMBED_REQUESTS_PER_MINUTE):
+    """Returns the vectors of several queries, embedding those not cached in
+    bulk requests of up to batch_size queries (see embed_query).
+
+    Requests are paced and retried like ingestion's (see
+    embedding_pipeline.embed_in_batches), so a transient API error does not
+    fail every query.
+    """
+    rate_limiter = TokenBucket(requests_per_minute / 60.0) if requests_per_minute > 0 else None
+    model = getattr(embeddings, "model", GEMINI_EMBEDDING_MODEL)
+    keys = [(model, normalize_query(query)) for query in queries]
+    vectors = {key: query_cache.query_vectors.get(key) for key in keys}
+    # The first query with each missing key is embedded as written.
+    missing = {}
+    for key, query in zip(keys, queries):
+        if vectors[key] is None:
+            missing.setdefault(key, query)
+    missing = list(missing.items())
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        with metrics.span("query_embedding"):
+            batch_vectors = embed_with_retry(functools.partial(embed_query_batch, embeddings),
+                                             [query for _, query in batch], rate_limiter)
+        for (key, _), vector in zip(batch, batch_vectors):
+            query_cache.query_vectors.put(key, vector)
+            vectors[key] = vector
+    return [vectors[key] for key in keys]
+
+
+def reciprocal_rank_fusion(result_lists, k=RRF_K):
+    """Merges ranked [(Document, score)] lists by summing 1 / (k + rank) per chunk id.
+
+    Scores on different scales (L2 distances, BM25) never need normalising, as
+    only ranks are used. Returns [(Document, fused score)], best first.
+    """
+    fused = {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results, start=1):
+            chunk_id = doc.metadata["id"]
+            entry = fused.setdefault(chunk_id, [doc, 0.0])
+            entry[1] += 1.0 / (k + rank)
+    return sorted((tuple(entry) for entry in fused.values()), key=lambda entry: -entry[1])
+
+
+def is_identifier_query(query, vector_store):
+    """Whether identifiers the index knows make up enough of the query's content
+    tokens to answer it from the lexical index alone."""
+    tokens = tokenize(query, parts=False)
+    identifiers = [token for token in tokens if is_identifier(token)]
+    return (
+        bool(tokens)
+        and len(identifiers) >= LEXICAL_FAST_PATH_FRACTION * len(tokens)
+        and any(vector_store.lexical.contains(token) for token in identifiers)
+    )
+
+
+def retrieve(query, vector_store, embeddings, n_results=5, mode=RETRIEVAL_MODE, search_filter=None):
+    """Returns [(Document, score)] for the n_results best chunks, and whether the
+    query-embedding call was skipped.
+
+    mode is "vector", "lexical" or "hybrid". Hybrid retrieval fuses both
+    rankings with reciprocal-rank fusion, except for identifier queries, which
+    go to the lexical index alone. search_filter restricts a sharded index to
+    some collections or sources (see sharded_store.apply_filter).
+    """
+    vector_store = apply_filter(vector_store, search_filter)
+    if mode == "lexical":
+        path, results = "lexical", _lexical_search(query, vector_store, n_results)
+    elif mode == "vector":
+        path, results = "vector", _vector_search(query, vector_store, embeddings, n_results)
+    elif mode == "hybrid":
+        candidates = max(n_results, HYBRID_CANDIDATES)
+        lexical_results = _lexical_search(query, vector_store, candidates)
+        if lexical_results and is_identifier_query(query, vector_store):
+            path, results = "lexical_fast_path", lexical_results[:n_results]
+        else:
+            vector_results = _vector_search(query, vector_store, embeddings, candidates)
+            path, results = "hybrid", reciprocal_rank_fusion([vector_results, lexical_results])[:n_results]
+    else:
+        raise ValueError(f"Unknown retrieval mode '{mode}'. Expected one of: hybrid, vector, lexical.")
+
+    _record_retrieval(path, results)
+    metrics.annotate(retrieval=path, chunks_retrieved=len(results))
+    return results, path.startswith("lexical")
+
+
+def retrieve_batch(queries, vector_store, embeddings, n_results=5, mode=RETRIEVAL_MODE, search_filter=None):
+    """Like retrieve for many queries at once, returning a (results, embedding
+    skipped) pair per query.
+
+    The query vectors needed are embedded in bulk (see embed_queries) and
+    searched with a single batched FAISS call, instead of one request and one
+    search per query.
+    """
+    if mode not in ("hybrid", "vector", "lexical"):
+        raise ValueError(f"Unknown retrieval mode '{mode}'. Expected one of: hybrid, vector, lexical.")
+    vector_store = apply_filter(vector_store, search_filter)
+    candidates = max(n_results, HYBRID_CANDIDATES) if mode == "hybrid" else n_results
+    lexical = [None] * len(queries)
+    needs_vector = []
+    for i, query in enumerate(queries):
+        if mode != "vector":
+            lexical[i] = _lexical_search(query, vector_store, candidates)
+        if mode == "vector" or (mode == "hybrid" and not (lexical[i] and is_identifier_query(query, vector_store))):
+            needs_vector.append(i)
+
+    vector = {}
+    if needs_vector:
+        query_vectors = embed_queries([queries[i] for i in needs_vector], embeddings)
+        with metrics.span("vector_search"):
+            searched = vector_store.similarity_search_by_vectors_with_score(query_vectors, k=candidates)
+        vector = dict(zip(needs_vector, searched))
+
+    batch = []
+    for i in range(len(queries)):
+        if mode == "lexical":
+            path, results = "lexical", lexical[i]
+        elif mode == "vector":
+            path, results = "vector", vector[i]
+        elif i in vector:
+            path, results = "hybrid", reciprocal_rank_fusion([vector[i], lexical[i]])[:n_results]
+        else:
+            path, results = "lexical_fast_path", lexical[i][:n_results]
+        _record_retrieval(path, results)
+        batch.append((results, path.startswith("lexical")))
+    return batch
+
+
+def _record_retrieval(path, results):
+    score_kind = "lexical" if path == "lexical_fast_path" else path
+    for _, score in results:
+        metrics.observe("retrieval_score", score, buckets=metrics.SCORE_BUCKETS[score_kind], kind=score_kind)
+    metrics.inc("retrievals_total", path=path)
+
+
+def _lexical_search(query, vector_store, k):
+    with metrics.span("lexical_search"):
+        return vector_store.lexical_search_with_score(query, k=k)
+
+
+def _vector_search(query, vector_store, embeddings, k):
+    query_vector = embed_query(query, embeddings)
+    with metrics.span("vector_search"):
+        return vector_store.similarity_search_by_vector_with_score(query_vector, k=k)
+
+
+def get_relevant_context(query, vector_store, embeddings, n_results=5, search_filter=None):
+    """Retrieves relevant context from the knowledge base (see retrieve)."""
+    results_with_scores, _ = retrieve(query, vector_store, embeddings, n_results, search_filter=search_filter)
+    context_docs = [doc.page_content for doc, score in results_with_scores]
+    context_metadatas = [doc.metadata for doc, score in results_with_scores]
+    return context_docs, context_metadatas
+
+
+def build_prompt(query, context_docs, context_metadatas, language="en"):
+    """Builds the Gemini prompt from the query, retrieved context and answer language.
+
+    Returns (prompt, context report); see context_assembly.assemble_context.
+    """
+    with metrics.span("context_assembly"):
+        context_string, report = assemble_context(context_docs, context_metadatas)
+    language_name = LANGUAGES.get(language, "English")
+    prompt = PROMPT_PREAMBLE + f"""
+
+**Please provide the answer in {language_name}.**
+
+
+Context from documents:
+{context_string}
+
+Question:
+{query}
+
+Answer ({language_name}):
+"""
+    prompt_tokens = estimate_tokens(prompt)
+    metrics.observe("prompt_tokens", prompt_tokens, buckets=metrics.TOKEN_BUCKETS)
+    metrics.observe("context_tokens_saved", report["tokens_saved"], buckets=metrics.TOKEN_BUCKETS)
+    metrics.annotate(prompt_tokens=prompt_tokens, context_tokens_saved=report["tokens_saved"])
+    return prompt, report
+
+
+def _answer_key(query, context_docs, context_metadatas, language, index_version):
+    # The context itself, not just its chunk ids, so callers supplying their
+    # own context (the service's /generate) never share answers with others.
+    # The version of the store searched lets answers from a replaced index age out.
+    context = hashlib.sha256()
+    for entry in sorted(json.dumps([doc, meta], sort_keys=True, default=str)
+                        for doc, meta in zip(context_docs, context_metadatas)):
+        context.update(entry.encode("utf-8") + b"\0")
+    return (
+        normalize_query(query),
+        language,
+        context.hexdigest(),
+        GEMINI_GENERATIVE_MODEL,
+        index_version,
+    )
+
+
+def _make_model(api_key):
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(GEMINI_GENERATIVE_MODEL)
+
+
+def generate_response(query, context_docs, context_metadatas, api_key, language="en", model=None,
+                      index_version=None):
+    """Generates response using Gemini based on query, context, and language.
+
+    Answers are cached by (normalised query, language, context text and
+    metadata, model, index_version) and identical concurrent requests share one
+    generation call. index_version is the version of the store the context was
+    retrieved from. model overrides the Gemini model, e.g. with
+    fakes.FakeGenerativeModel.
+    """
+    def generate():
+        prompt, _ = build_prompt(query, context_docs, context_metadatas, language)
+        with _generation_slots, metrics.span("generation"):
+            response = (model or _make_model(api_key)).generate_content(prompt)
+            return response.text
+
+    key = _answer_key(query, context_docs, context_metadatas, language, index_version)
+    return cached_call(query_cache.answers, query_cache.answer_flight, key, generate)
+
+
+class ResponseStream:
+    """Iterates over answer text as the model produces it, timing the generation.
+
+    After iteration, text holds the complete answer, and time_to_first_token
+    and total_time the seconds from the first request to the first chunk and
+    to the last one. on_complete(text) runs once the stream is exhausted.
+    context_report is the prompt's context assembly report, or None for a
+    replayed answer.
+    """
+
+    def __init__(self, chunks, on_complete=None, context_report=None):
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self.context_report = context_report
+        self._parts = []
+        self.time_to_first_token = None
+        self.total_time = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        try:
+            for chunk in self._chunks:
+                if self.time_to_first_token is None:
+                    self.time_to_first_token = time.perf_counter() - start
+                self._parts.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            # Abandoned by the reader: end the generation now, not when collected.
+            if hasattr(self._chunks, "close"):
+                self._chunks.close()
+            raise
+        self.total_time = time.perf_counter() - start
+        if self.time_to_first_token is None:
+            self.time_to_first_token = self.total_time
+        logger.info("Generated %d characters: first token after %.2fs, total %.2fs",
+                    len(self.text), self.time_to_first_token, self.total_time)
+        if self._on_complete is not None:
+            self._on_complete(self.text)
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def timings(self):
+        return {"time_to_first_token": self.time_to_first_token, "total_time": self.total_time}
+
+
+def stream_response(query, context_docs, context_metadatas, api_key, language="en", model=None,
+                    index_version=None):
+    """Streaming counterpart of generate_response; returns a ResponseStream.
+
+    A cached answer is replayed as a single chunk. Identical concurrent
+    requests, streamed or not, share one generation call: the first streams
+    it, and the others wait for its complete answer and replay it. A fresh
+    answer is cached once its stream completes.
+    """
+    key = _answer_key(query, context_docs, context_metadatas, language, index_version)
+    cached = query_cache.answers.get(key)
+    if cached is not None:
+        return ResponseStream(iter([cached]))
+
+    prompt, report = build_prompt(query, context_docs, context_metadatas, language)
+
+    def chunks():
+        # Joined on the first read, so a stream that is never read holds no one up.
+        leader, answer = query_cache.answer_flight.join(key)
+        if not leader:
+            yield answer
+            return
+        # The previous leader may have cached the answer since we looked.
+        answer = query_cache.answers.get(key, record=False)
+        if answer is not None:
+            query_cache.answer_flight.finish(key, answer)
+            yield answer
+            return
+        parts = []
+        try:
+            with _generation_slots, metrics.span("generation"):
+                for part in (model or _make_model(api_key)).generate_content(prompt, stream=True):
+                    if part.text:
+                        parts.append(part.text)
+                        yield part.text
+        except Exception as e:
+            query_cache.answer_flight.fail(key, e)
+            raise
+        except BaseException:
+            # The reader went away (GeneratorExit) mid-stream.
+            query_cache.answer_flight.abandon(key)
+            raise
+        answer = "".join(parts)
+        query_cache.answers.put(key, answer)
+        query_cache.answer_flight.finish(key, answer)
+
+    def on_complete(text):
+        metrics.observe("time_to_first_token_seconds", stream.time_to_first_token)
+        metrics.annotate(time_to_first_token_s=round(stream.time_to_first_token, 6))
+
+    stream = ResponseStream(chunks(), on_complete=on_complete, context_report=report)
+    return stream
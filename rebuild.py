@@ -0,0 +1,172 @@
+"""Background rebuilds of the knowledge base into a new index version.
+
+    job = rebuild.start(make_embeddings, PDF_DIR, FAISS_INDEX_PATH)
+    job.progress()   # {"state": "running", "files": 3, "files_total": 10, "chunks": ..., "vectors": ...}
+
+A rebuild indexes every PDF from scratch into a new version directory (see
+index_versions) on a background thread, while queries keep being served from
+the current version; vectors mostly come back from the embedding cache. The
+new index is then validated (it opens, holds a vector for every chunk indexed
+and answers a search), and made current by atomically replacing the version
+pointer. Versions that are no longer current are deleted once no store in
+any process has them open (see index_registry and index_versions). One
+rebuild runs per process at a time.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+
+import index_registry
+import metrics
+from config import SHARD_BY
+from index_versions import (
+    BUILDING_SUFFIX,
+    ReaderLease,
+    current_version,
+    lease_file,
+    new_version_name,
+    remove_unused_versions,
+    set_current_version,
+    version_path,
+    writer_lock,
+)
+from ingest import open_vector_store, scan_collections, sync_index
+from sharded_store import ROOT_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+# Embedded as a query to check that a rebuilt index answers searches.
+VALIDATION_QUERY = "knowledge base validation"
+
+
+class RebuildJob:
+    """Rebuilds the index in index_path on a background thread; see start()."""
+
+    def __init__(self, make_embeddings, pdf_directory, index_path, shard_by=SHARD_BY, on_complete=None):
+        self.make_embeddings = make_embeddings
+        self.pdf_directory = pdf_directory
+        self.index_path = index_path
+        self.shard_by = shard_by
+        self.on_complete = on_complete
+        self._lock = threading.Lock()
+        self._progress = {
+            "state": "running",
+            "version": new_version_name(),
+            "files_total": 0,
+            "files": 0,
+            "chunks": 0,
+            "vectors": 0,
+            "started": time.time(),
+            "finished": None,
+            "error": None,
+        }
+        self._thread = threading.Thread(target=self._run, name="index-rebuild", daemon=True)
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def progress(self):
+        """Returns a snapshot of the state ("running", "done" or "failed") and counts."""
+        with self._lock:
+            return dict(self._progress)
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _update(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._progress[name] += value
+
+    def _finish(self, **fields):
+        with self._lock:
+            self._progress.update(fields, finished=time.time())
+
+    def _count_pdfs(self):
+        collections = scan_collections(self.pdf_directory)
+        if self.shard_by == "none":
+            return len(collections.get(ROOT_COLLECTION, ()))
+        return sum(len(filenames) for filenames in collections.values())
+
+    def _validate(self, embeddings, path, expected):
+        """Opens the new version and checks it holds expected vectors; returns the opened store."""
+        store = open_vector_store(lambda: embeddings, self.pdf_directory, path, check_corpus=False,
+                                  shard_by=self.shard_by)
+        if store is None or store.ntotal != expected:
+            raise ValueError(f"The rebuilt index holds {store.ntotal if store else 0} vectors, expected {expected}.")
+        if not store.similarity_search_by_vector_with_score(embeddings.embed_query(VALIDATION_QUERY), 1):
+            raise ValueError("The rebuilt index returned no search results.")
+        return store
+
+    def _run(self):
+        version = self._progress["version"]
+        building = version_path(self.index_path, version + BUILDING_SUFFIX)
+        path = version_path(self.index_path, version)
+        os.makedirs(building)
+        # Keeps cleanup, in this process or another, away from the unfinished version.
+        lease = ReaderLease(lease_file(building))
+        try:
+            with metrics.trace("rebuild", version=version):
+                self._update(files_total=self._count_pdfs())
+                embeddings = self.make_embeddings()
+                summary = sync_index(embeddings, self.pdf_directory, building, self.shard_by,
+                                     on_progress=self._update, live=False)
+                expected = summary["chunks_added"] - summary["chunks_removed"]
+                if not expected:
+                    raise ValueError("The PDFs yielded no text to index.")
+                # Renamed before validation, so the validated store is the one readers open.
+                os.replace(building, path)
+                with metrics.span("rebuild_validate"):
+                    store = self._validate(embeddings, path, expected)
+                set_current_version(self.index_path, version)
+        except Exception as e:
+            logger.exception("Rebuild of %s failed", self.index_path)
+            for directory in (building, path):
+                if current_version(self.index_path) != version:
+                    shutil.rmtree(directory, ignore_errors=True)
+            self._finish(state="failed", error=str(e))
+            return
+        finally:
+            lease.release()
+        logger.info("Rebuilt %s as version %s: %s", self.index_path, version, summary)
+        if self.on_complete is not None:
+            self.on_complete(store)
+        self._finish(state="done")
+        cleanup(self.index_path)
+
+
+_job = None
+_job_lock = threading.Lock()
+
+
+def start(make_embeddings, pdf_directory, index_path, shard_by=SHARD_BY, on_complete=None):
+    """Starts rebuilding index_path unless a rebuild is already running; returns the running job.
+
+    on_complete(store), if given, is called on the rebuild thread with the new
+    store once it is current.
+    """
+    global _job
+    with _job_lock:
+        if _job is None or not _job.running:
+            os.makedirs(index_path, exist_ok=True)
+            _job = RebuildJob(make_embeddings, pdf_directory, index_path, shard_by, on_complete)
+            _job._thread.start()
+        return _job
+
+
+def current_job():
+    """Returns the last rebuild started in this process, or None."""
+    return _job
+
+
+def cleanup(index_path):
+    """Deletes the versions of index_path that are neither current, open nor being built.
+
+    Skipped while a sync holds the index's writer lock; that sync or the next
+    cleanup removes them.
+    """
+    with writer_lock(index_path, blocking=False) as locked:
+        return remove_unused_versions(index_path, index_registry.in_use(index_path)) if locked else []
@@ -0,0 +1,315 @@
+"""Headless HTTP service for the knowledge base.
+
+Usage (from the repository root):
+
+    python -m service                     # Gemini models, GOOGLE_API_KEY from the environment
+    python -m service --fake --embed-latency 0.2 --first-token-latency 0.5
+
+Endpoints (JSON in and out):
+
+    GET  /health       index version and size
+    GET  /shards       shard catalog of a sharded index, and what searches can be filtered by
+    POST /retrieve     {"query", "n_results"?, "filter"?} -> {"results": [{"text", "metadata", "score"}], "embedding_skipped"}
+    POST /generate     {"query", "docs", "metadatas", "language"?, "stream"?} -> {"answer"}
+    POST /query        {"query", "language"?, "n_results"?, "filter"?, "stream"?} -> retrieve, then generate
+    POST /ingest       {"shards"?, "rebuild"?} syncs the index with the PDF directory and swaps it in
+    POST /rebuild      starts rebuilding the index into a new version in the background -> 202 and its progress
+    GET  /rebuild      progress of the last rebuild: state, files, chunks and vectors indexed
+    GET  /metrics      Prometheus text; /metrics.json for JSON
+
+"filter" is {"collections": [...]} or {"sources": [...]} and needs a sharded
+index (ANYBIO_SHARD_BY); only the matching shards are searched.
+
+With "stream": true, /generate and /query answer with NDJSON lines of
+{"text": ...}, ending in {"done": true, "timings": ..., "sources": ...}.
+
+One index is loaded and shared by every request. Blocking work (search,
+embedding, generation) runs on a thread pool, so concurrent query embeddings
+are batched by QueryBatcher and generation calls are bounded by
+ANYBIO_GENERATION_CONCURRENCY. --fake swaps in the stand-in models from
+fakes.py for offline load testing.
+"""
+import argparse
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import metrics
+import rag
+import rebuild
+from config import (
+    PDF_DIR,
+    FAISS_INDEX_PATH,
+    GEMINI_EMBEDDING_MODEL,
+    CONTEXT_CANDIDATES,
+    SERVICE_HOST,
+    SERVICE_PORT,
+    SERVICE_WORKERS,
+)
+from embedding_cache import CachedEmbeddings
+from embedding_pipeline import QueryBatcher
+from ingest import open_vector_store, sync_index
+from sharded_store import ShardedStore, filter_options
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class KnowledgeBaseService:
+    """Holds the shared index and models and implements the endpoints."""
+
+    def __init__(self, embeddings, api_key=None, model=None, pdf_directory=PDF_DIR, index_path=FAISS_INDEX_PATH):
+        self.embeddings = QueryBatcher(embeddings)
+        self.api_key = api_key
+        self.model = model
+        self.pdf_directory = pdf_directory
+        self.index_path = index_path
+        self.vector_store = None
+        self._ingest_lock = asyncio.Lock()
+
+    async def _run(self, fn, *args):
+        # Executor threads do not inherit context variables; copying them
+        # keeps spans attributed to the request's trace.
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(None, context.run, fn, *args)
+
+    async def start(self, app):
+        self.vector_store = await self._run(
+            open_vector_store, lambda: self.embeddings, self.pdf_directory, self.index_path
+        )
+        if self.vector_store is None:
+            logger.warning("No index yet; POST /ingest once PDFs are in '%s'.", self.pdf_directory)
+
+    def _store(self):
+        if self.vector_store is None:
+            raise web.HTTPServiceUnavailable(text=json.dumps({"error": "index not loaded"}),
+                                             content_type="application/json")
+        return self.vector_store
+
+    @staticmethod
+    def _bad_request(message):
+        return web.HTTPBadRequest(text=json.dumps({"error": message}), content_type="application/json")
+
+    @staticmethod
+    async def _object(request):
+        """Returns the request's JSON object body, {} for an empty body."""
+        if not request.can_read_body:
+            return {}
+        try:
+            body = await request.json()
+        except ValueError:
+            raise KnowledgeBaseService._bad_request("invalid JSON")
+        if not isinstance(body, dict):
+            raise KnowledgeBaseService._bad_request("the body must be a JSON object")
+        return body
+
+    @staticmethod
+    async def _json(request):
+        body = await KnowledgeBaseService._object(request)
+        if not isinstance(body.get("query"), str) or not body["query"].strip():
+            raise KnowledgeBaseService._bad_request("'query' is required")
+        search_filter = body.get("filter")
+        if search_filter is not None and not (
+            isinstance(search_filter, dict)
+            and all(isinstance(search_filter.get(name, []), list) for name in ("collections", "sources"))
+        ):
+            raise KnowledgeBaseService._bad_request(
+                "'filter' must be an object with 'collections' and/or 'sources' lists"
+            )
+        return body
+
+    async def _search(self, body, vector_store):
+        try:
+            n_results = int(body.get("n_results", CONTEXT_CANDIDATES))
+        except (TypeError, ValueError):
+            raise self._bad_request("'n_results' must be an integer")
+        if n_results < 1:
+            raise self._bad_request("'n_results' must be at least 1")
+        try:
+            return await self._run(
+                functools.partial(rag.retrieve, search_filter=body.get("filter")),
+                body["query"], vector_store, self.embeddings, n_results,
+            )
+        except ValueError as e:
+            raise self._bad_request(str(e))
+
+    async def health(self, request):
+        vector_store = self.vector_store
+        return web.json_response({
+            "status": "ok" if vector_store is not None else "no_index",
+            "index_version": vector_store.version if vector_store is not None else None,
+            "vectors": vector_store.ntotal if vector_store is not None else 0,
+        })
+
+    async def shards(self, request):
+        vector_store = self.vector_store
+        if not isinstance(vector_store, ShardedStore):
+            return web.json_response({"shard_by": "none", "shards": {}, "filter_by": None, "options": []})
+        filter_by, options = filter_options(vector_store.catalog)
+        return web.json_response({
+            "shard_by": vector_store.shard_by,
+            "shards": vector_store.catalog["shards"],
+            "filter_by": filter_by,
+            "options": options,
+        })
+
+    async def retrieve(self, request):
+        body = await self._json(request)
+        with metrics.trace("retrieve"):
+            results, skipped = await self._search(body, self._store())
+        return web.json_response({
+            "results": [{"text": doc.page_content, "metadata": doc.metadata, "score": score} for doc, score in results],
+            "embedding_skipped": skipped,
+        })
+
+    async def generate(self, request):
+        body = await self._json(request)
+        docs, metadatas = body.get("docs", []), body.get("metadatas", [])
+        if not isinstance(docs, list) or not all(isinstance(doc, str) for doc in docs):
+            raise self._bad_request("'docs' must be a list of strings")
+        if not isinstance(metadatas, list) or len(metadatas) != len(docs) or not all(
+            isinstance(meta, dict) for meta in metadatas
+        ):
+            raise self._bad_request("'metadatas' must be a list with one object per doc")
+        with metrics.trace("generate", language=body.get("language", "en")):
+            # Context sent by a client was retrieved from this service's store.
+            vector_store = self.vector_store
+            return await self._answer(request, body, docs, metadatas,
+                                      vector_store.version if vector_store is not None else None)
+
+    async def query(self, request):
+        body = await self._json(request)
+        with metrics.trace("query", language=body.get("language", "en")):
+            vector_store = self._store()
+            results, _ = await self._search(body, vector_store)
+            docs = [doc.page_content for doc, _ in results]
+            metadatas = [doc.metadata for doc, _ in results]
+            return await self._answer(request, body, docs, metadatas, vector_store.version)
+
+    async def _answer(self, request, body, docs, metadatas, index_version):
+        query, language = body["query"], body.get("language", "en")
+        if not docs:
+            return web.json_response({"answer": None, "sources": []})
+        if not body.get("stream"):
+            answer = await self._run(rag.generate_response, query, docs, metadatas, self.api_key, language,
+                                     self.model, index_version)
+            return web.json_response({"answer": answer, "sources": metadatas})
+
+        stream = rag.stream_response(query, docs, metadatas, self.api_key, language, self.model, index_version)
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        chunks = iter(stream)
+        while True:
+            chunk = await self._run(next, chunks, _DONE)
+            if chunk is _DONE:
+                break
+            await response.write(json.dumps({"text": chunk}).encode("utf-8") + b"\n")
+        final = {"done": True, "timings": stream.timings(), "context": stream.context_report, "sources": metadatas}
+        await response.write(json.dumps(final).encode("utf-8") + b"\n")
+        await response.write_eof()
+        return response
+
+    async def ingest(self, request):
+        body = await self._object(request)
+        async with self._ingest_lock:
+            with metrics.trace("ingest"):
+                try:
+                    summary = await self._run(
+                        functools.partial(sync_index, shards=body.get("shards"), rebuild=bool(body.get("rebuild"))),
+                        self.embeddings, self.pdf_directory, self.index_path,
+                    )
+                except ValueError as e:
+                    raise self._bad_request(str(e))
+                # Requests already running keep the store they started with.
+                self.vector_store = await self._run(
+                    open_vector_store, lambda: self.embeddings, self.pdf_directory, self.index_path
+                )
+                # Versions the sync replaced, unless requests still read them.
+                await self._run(rebuild.cleanup, self.index_path)
+        return web.json_response(summary)
+
+    async def rebuild(self, request):
+        """Queries keep using the current index until the rebuilt one is swapped in."""
+        job = rebuild.start(lambda: self.embeddings, self.pdf_directory, self.index_path,
+                            on_complete=functools.partial(setattr, self, "vector_store"))
+        return web.json_response(job.progress(), status=202)
+
+    async def rebuild_progress(self, request):
+        job = rebuild.current_job()
+        return web.json_response(job.progress() if job is not None else {"state": "idle"})
+
+    async def metrics_text(self, request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+    async def metrics_json(self, request):
+        return web.json_response(metrics.snapshot())
+
+
+def create_app(service):
+    app = web.Application()
+    app.on_startup.append(service.start)
+    app.add_routes([
+        web.get("/health", service.health),
+        web.get("/shards", service.shards),
+        web.post("/retrieve", service.retrieve),
+        web.post("/generate", service.generate),
+        web.post("/query", service.query),
+        web.post("/ingest", service.ingest),
+        web.post("/rebuild", service.rebuild),
+        web.get("/rebuild", service.rebuild_progress),
+        web.get("/metrics", service.metrics_text),
+        web.get("/metrics.json", service.metrics_json),
+    ])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--pdf-dir", default=PDF_DIR)
+    parser.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    parser.add_argument("--fake", action="store_true", help="use the stand-in models from fakes.py")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds per stand-in embedding call")
+    parser.add_argument("--first-token-latency", type=float, default=0.0,
+                        help="seconds before the stand-in model's first answer chunk")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.fake:
+        from fakes import BagOfWordsEmbeddings, FakeGenerativeModel
+
+        embeddings = BagOfWordsEmbeddings(latency=args.embed_latency)
+        service = KnowledgeBaseService(embeddings, model=FakeGenerativeModel(first_token_delay=args.first_token_latency),
+                                       pdf_directory=args.pdf_dir, index_path=args.index_path)
+    else:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        api_key = os.getenv("GOOGLE_API_KEY")
+        embeddings = CachedEmbeddings(
+            GoogleGenerativeAIEmbeddings(model=GEMINI_EMBEDDING_MODEL, google_api_key=api_key),
+            GEMINI_EMBEDDING_MODEL,
+        )
+        service = KnowledgeBaseService(embeddings, api_key=api_key, pdf_directory=args.pdf_dir,
+                                       index_path=args.index_path)
+
+    async def serve():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=SERVICE_WORKERS))
+        runner = web.AppRunner(create_app(service))
+        await runner.setup()
+        await web.TCPSite(runner, args.host, args.port).start()
+        logger.info("Serving the knowledge base on http://%s:%d", args.host, args.port)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
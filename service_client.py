@@ -0,0 +1,74 @@
+"""Blocking client for service.py, used by the Streamlit app in thin-client mode."""
+import json
+import urllib.request
+
+from config import SERVICE_URL
+
+
+class ServiceError(Exception):
+    """Raised when the knowledge-base service cannot be reached or rejects a request."""
+
+
+def _post(path, payload, base_url=SERVICE_URL, timeout=300):
+    request = urllib.request.Request(
+        base_url.rstrip("/") + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        return urllib.request.urlopen(request, timeout=timeout)
+    except OSError as e:
+        raise ServiceError(f"Knowledge-base service request to {path} failed: {e}") from e
+
+
+def retrieve(query, n_results, search_filter=None, base_url=SERVICE_URL):
+    """Returns (docs, metadatas) for a query, like rag.get_relevant_context."""
+    payload = {"query": query, "n_results": n_results}
+    if search_filter:
+        payload["filter"] = search_filter
+    with _post("/retrieve", payload, base_url) as response:
+        results = json.load(response)["results"]
+    return [result["text"] for result in results], [result["metadata"] for result in results]
+
+
+def _get(path, base_url=SERVICE_URL, timeout=30):
+    try:
+        with urllib.request.urlopen(base_url.rstrip("/") + path, timeout=timeout) as response:
+            return json.load(response)
+    except OSError as e:
+        raise ServiceError(f"Knowledge-base service request to {path} failed: {e}") from e
+
+
+def shards(base_url=SERVICE_URL):
+    """Returns the service's shard catalog and filter options (see GET /shards)."""
+    return _get("/shards", base_url)
+
+
+def start_rebuild(base_url=SERVICE_URL):
+    """Starts a background rebuild of the service's index; returns its progress (see POST /rebuild)."""
+    with _post("/rebuild", {}, base_url, timeout=30) as response:
+        return json.load(response)
+
+
+def rebuild_progress(base_url=SERVICE_URL):
+    """Returns the progress of the service's last rebuild (see GET /rebuild)."""
+    return _get("/rebuild", base_url)
+
+
+def generate(query, docs, metadatas, language="en", base_url=SERVICE_URL):
+    """Returns the complete answer, like rag.generate_response."""
+    payload = {"query": query, "docs": docs, "metadatas": metadatas, "language": language}
+    with _post("/generate", payload, base_url) as response:
+        return json.load(response)["answer"]
+
+
+def stream(query, docs, metadatas, language="en", base_url=SERVICE_URL):
+    """Yields the answer text as the service streams it; wrap in rag.ResponseStream for timings."""
+    payload = {"query": query, "docs": docs, "metadatas": metadatas, "language": language, "stream": True}
+    with _post("/generate", payload, base_url) as response:
+        for line in response:
+            message = json.loads(line)
+            if message.get("done"):
+                return
+            yield message["text"]
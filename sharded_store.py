@@ -0,0 +1,209 @@
+"""An index partitioned into shards by collection or by source PDF.
+
+Layout under the index directory:
+
+    shards.json           catalog: shard_by, corpus fingerprint, version and,
+                          per shard key, its directory, collection, sources,
+                          live chunk count and store version
+    shards/<name>/        one complete FaissStore directory (with its own
+                          ingestion manifest) per shard
+
+A shard key is a collection name ("." for the PDFs directly in the PDF
+directory) or, when sharding by source, a PDF's path relative to the PDF
+directory. Searches fan out to the selected shards on a shared thread pool
+(FAISS releases the GIL while searching) and merge their sorted results with
+a k-way heap merge. Shards are opened on first use, so startup does not grow
+with their number.
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from config import SHARD_CATALOG_FILENAME, SHARD_SEARCH_WORKERS
+from vector_store import FaissStore
+
+SHARDS_DIRNAME = "shards"
+SHARD_MODES = ("collection", "source")
+ROOT_COLLECTION = "."
+
+_search_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search")
+
+
+def shard_dirname(key):
+    """A directory name for a shard key: readable, and unique through a hash suffix."""
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", key).strip("._")[:48] or "root"
+    return f"{slug}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+
+
+def shard_path(index_path, key):
+    return os.path.join(index_path, SHARDS_DIRNAME, shard_dirname(key))
+
+
+def qualified_source(collection, filename):
+    """The source name shown in citations and used in filters: the PDF's path relative to the PDF directory."""
+    return filename if collection == ROOT_COLLECTION else f"{collection}/{filename}"
+
+
+def load_catalog(index_path):
+    """Returns the shard catalog saved with a sharded index, or None."""
+    try:
+        with open(os.path.join(index_path, SHARD_CATALOG_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_catalog(index_path, catalog):
+    """Atomically writes the shard catalog; its version is derived from the shard versions."""
+    digest = hashlib.sha256()
+    for key, entry in sorted(catalog["shards"].items()):
+        digest.update(f"{key}\0{entry['version']}\n".encode("utf-8"))
+    catalog["version"] = digest.hexdigest()[:32]
+    os.makedirs(index_path, exist_ok=True)
+    catalog_file = os.path.join(index_path, SHARD_CATALOG_FILENAME)
+    tmp_file = catalog_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, catalog_file)
+
+
+def filter_options(catalog):
+    """Returns ("collections" or "sources", sorted names) a search can be restricted to."""
+    if catalog["shard_by"] == "source":
+        return "sources", sorted(source for entry in catalog["shards"].values() for source in entry["sources"])
+    return "collections", sorted(entry["collection"] for entry in catalog["shards"].values())
+
+
+def apply_filter(vector_store, search_filter):
+    """Narrows a store to the shards matching {"collections": [...], "sources": [...]}.
+
+    Raises ValueError for a filter the store cannot honour without searching
+    chunks it should skip.
+    """
+    if not search_filter:
+        return vector_store
+    if not isinstance(vector_store, ShardedStore):
+        raise ValueError("Search filters need a sharded index (ANYBIO_SHARD_BY=collection or source).")
+    return vector_store.select(search_filter.get("collections"), search_filter.get("sources"))
+
+
+class _ShardedLexical:
+    """The part of the LexicalIndex interface retrieval needs, across shards."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def contains(self, term):
+        return any(shard.lexical.contains(term) for _, shard in self._store._open_all())
+
+
+class ShardedStore:
+    """Searches a set of FaissStore shards as if they were one store.
+
+    Results carry "collection" in their metadata, a source qualified by its
+    collection, and an id of the form "<shard key>#<chunk id>" that is unique
+    across shards.
+    """
+
+    def __init__(self, index_path, catalog, keys=None, _stores=None, _lock=None):
+        self.index_path = index_path
+        self.catalog = catalog
+        self.shard_by = catalog["shard_by"]
+        self.version = catalog["version"]
+        self.keys = sorted(catalog["shards"]) if keys is None else keys
+        # Shared with the views select() returns, so a shard is opened once.
+        self._stores = {} if _stores is None else _stores
+        self._lock = threading.Lock() if _lock is None else _lock
+        self.lexical = _ShardedLexical(self)
+
+    @property
+    def index_type(self):
+        return "sharded"
+
+    @property
+    def ntotal(self):
+        return sum(self.catalog["shards"][key]["chunks"] for key in self.keys)
+
+    def select(self, collections=None, sources=None):
+        """Returns a view searching only the shards of the given collections and sources."""
+        if sources and self.shard_by != "source":
+            raise ValueError("Filtering by source needs an index sharded by source (ANYBIO_SHARD_BY=source).")
+        keys = [
+            key for key in self.keys
+            if (not collections or self.catalog["shards"][key]["collection"] in collections)
+            and (not sources or key in sources)
+        ]
+        return ShardedStore(self.index_path, self.catalog, keys, self._stores, self._lock)
+
+    def _shard(self, key):
+        store = self._stores.get(key)
+        if store is None:
+            with self._lock:
+                store = self._stores.get(key)
+                if store is None:
+                    store = self._stores[key] = FaissStore.load(
+                        os.path.join(self.index_path, SHARDS_DIRNAME, self.catalog["shards"][key]["dir"])
+                    )
+        return store
+
+    def _open_all(self):
+        return [(key, self._shard(key)) for key in self.keys]
+
+    def _fan_out(self, search):
+        """Runs search(store) on every selected shard, in parallel when there are several.
+
+        Returns [(shard key, result)].
+        """
+        metrics.annotate(shards_searched=len(self.keys))
+        shards = self._open_all()
+        if len(shards) <= 1:
+            results = [search(store) for _, store in shards]
+        else:
+            results = list(_search_pool.map(lambda shard: search(shard[1]), shards))
+        return [(key, result) for (key, _), result in zip(shards, results)]
+
+    def _qualified(self, key, results):
+        return [(self._qualify(key, document), score) for document, score in results]
+
+    def _qualify(self, key, document):
+        collection = self.catalog["shards"][key]["collection"]
+        metadata = document.metadata
+        metadata["id"] = f"{key}#{metadata['id']}"
+        metadata["collection"] = collection
+        metadata["source"] = qualified_source(collection, metadata.get("source", "Unknown source"))
+        return document
+
+    def similarity_search_by_vector_with_score(self, vector, k=4):
+        """Returns [(Document, L2 distance)] for the k nearest chunks across the selected shards."""
+        return self.similarity_search_by_vectors_with_score([vector], k)[0]
+
+    def similarity_search_by_vectors_with_score(self, vectors, k=4):
+        """Searches for several query vectors with one FAISS call per shard; returns one result list per vector."""
+        per_shard = self._fan_out(lambda store: store.similarity_search_by_vectors_with_score(vectors, k))
+        return [
+            list(itertools.islice(
+                heapq.merge(*(self._qualified(key, results[i]) for key, results in per_shard),
+                            key=lambda result: result[1]),
+                k,
+            ))
+            for i in range(len(vectors))
+        ]
+
+    def lexical_search_with_score(self, query, k=4):
+        """Returns [(Document, BM25 score)] for the k best keyword matches across the selected shards.
+
+        Scores use each shard's own term statistics, as search engines do
+        between shards, so they are comparable but not identical to those of
+        one combined index.
+        """
+        per_shard = self._fan_out(lambda store: store.lexical_search_with_score(query, k))
+        return list(itertools.islice(
+            heapq.merge(*(self._qualified(key, results) for key, results in per_shard), key=lambda result: -result[1]),
+            k,
+        ))
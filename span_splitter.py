@@ -0,0 +1,215 @@
+"""Page-aware splitting of documents into chunk spans over one text buffer.
+
+A document's pages are joined with newlines into a single string, stored
+once; chunks are (start, end) character spans of it rather than copies, so
+the overlap between neighbouring chunks costs nothing in memory or on disk,
+and each span knows which pages it covers.
+
+    document = split_pages(page_texts)      # page_texts[0] is page 1
+    for start, end in document.spans:
+        document.text[start:end], document.page_range(start, end)
+"""
+import bisect
+import re
+from collections.abc import Sequence
+
+from config import CHUNK_SIZE, CHUNK_OVERLAP
+from vector_store import ChunkText
+
+# Coarsest first, as in RecursiveCharacterTextSplitter; a chunk with none of
+# them is cut at chunk_size characters.
+SEPARATORS = ("\n\n", "\n", " ")
+PAGE_SEPARATOR = "\n"
+
+_LEADING_SPACE = re.compile(r"\s*")
+
+
+class SplitDocument:
+    """A document's text with its chunk spans and page offsets."""
+
+    def __init__(self, text, spans, page_starts, page_numbers):
+        self.text = text
+        self.spans = spans
+        self._page_starts = page_starts
+        self._page_numbers = page_numbers
+        self._encoded = None
+        self._byte_spans = None
+
+    @property
+    def encoded(self):
+        """The UTF-8 text, which is what a ChunkStore writes (once) for the document."""
+        if self._encoded is None:
+            self._encoded = self.text.encode("utf-8")
+        return self._encoded
+
+    @property
+    def byte_spans(self):
+        """The spans as offsets into encoded."""
+        if self._byte_spans is None:
+            if self.text.isascii():
+                self._byte_spans = self.spans
+            else:
+                # Starts and ends each only move forward, so two running
+                # cursors encode every character once per cursor.
+                cursors = {"start": [0, 0], "end": [0, 0]}
+
+                def to_bytes(cursor, position):
+                    char_pos, byte_pos = cursor
+                    byte_pos += len(self.text[char_pos:position].encode("utf-8"))
+                    cursor[:] = position, byte_pos
+                    return byte_pos
+
+                self._byte_spans = [
+                    (to_bytes(cursors["start"], start), to_bytes(cursors["end"], end)) for start, end in self.spans
+                ]
+        return self._byte_spans
+
+    def page_range(self, start, end):
+        """Returns the first and last page numbers a span covers."""
+        first = bisect.bisect_right(self._page_starts, start) - 1
+        last = bisect.bisect_right(self._page_starts, max(start, end - 1)) - 1
+        return self._page_numbers[first], self._page_numbers[last]
+
+    def chunk(self, index):
+        start, end = self.spans[index]
+        byte_start, byte_end = self.byte_spans[index]
+        return ChunkText(self.text[start:end], self, byte_start, byte_end)
+
+
+class PageSplitter:
+    """Splits a document fed one page at a time into chunk spans.
+
+    Chunks are at most chunk_size characters, stripped of surrounding
+    whitespace, and end at the coarsest separator that occurs in the window
+    (blank line, line break, space; anywhere if none does). Each chunk after
+    the first starts at the earliest occurrence of that separator within the
+    last chunk_overlap characters of the previous one. These are the size and
+    overlap semantics of RecursiveCharacterTextSplitter, but decided on one
+    chunk-sized window, so only that window is ever scanned and no chunk
+    string is built.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size.")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._parts = []
+        self._length = 0
+        self._page_starts = []
+        self._page_numbers = []
+        self._spans = []
+        # Text not yet consumed: the window starts at document offset _base,
+        # and the next chunk at _start within it.
+        self._window = ""
+        self._base = 0
+        self._start = 0
+        self._last_cut = -1
+
+    def feed(self, page_number, text):
+        """Adds the next page's text; pages without text are skipped."""
+        if not text:
+            return
+        if self._parts:
+            text = PAGE_SEPARATOR + text
+            self._page_starts.append(self._length + len(PAGE_SEPARATOR))
+        else:
+            self._page_starts.append(0)
+        self._page_numbers.append(page_number)
+        self._parts.append(text)
+        self._length += len(text)
+        self._window += text
+        self._split(final=False)
+
+    def close(self):
+        """Splits what is left and returns the SplitDocument."""
+        self._split(final=True)
+        return SplitDocument("".join(self._parts), self._spans, self._page_starts, self._page_numbers)
+
+    def _split(self, final):
+        window = self._window
+        size = len(window)
+        start = self._start
+        while True:
+            start = _LEADING_SPACE.match(window, start).end()
+            if start >= size:
+                break
+            if not final and size < start + self.chunk_size + len(SEPARATORS[0]):
+                # A cut needs the whole window, and the first characters
+                # after it to see a separator straddling its edge.
+                break
+            if size - start <= self.chunk_size:
+                self._emit(start, size)
+                start = size
+                break
+            cut, separator = self._cut(window, start)
+            self._emit(start, cut)
+            self._last_cut = self._base + cut
+            start = self._overlap_start(window, start, cut, separator)
+
+        if start > len(window) // 2:
+            # Drop consumed text, but rarely enough to stay linear in long pages.
+            self._window = window[start:]
+            self._base += start
+            start = 0
+        self._start = start
+
+    def _cut(self, window, start):
+        # Every cut must pass the previous one, or an overlapping start could
+        # find the same cut again and emit a chunk with nothing new in it.
+        low = max(start + 1, self._last_cut - self._base + 1)
+        for separator in SEPARATORS:
+            cut = window.rfind(separator, low, start + self.chunk_size + len(separator))
+            if cut != -1:
+                return cut, separator
+        return start + self.chunk_size, ""
+
+    def _overlap_start(self, window, start, cut, separator):
+        low = max(start + 1, cut - self.chunk_overlap)
+        if not separator:
+            return low
+        overlap = window.find(separator, low, cut)
+        return cut if overlap < 0 else overlap
+
+    def _emit(self, start, end):
+        while end > start and self._window[end - 1].isspace():
+            end -= 1
+        self._spans.append((self._base + start, self._base + end))
+
+
+def split_pages(page_texts, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Splits a document's page texts (page 1 first) into a SplitDocument."""
+    splitter = PageSplitter(chunk_size, chunk_overlap)
+    for page_number, text in enumerate(page_texts, start=1):
+        splitter.feed(page_number, text)
+    return splitter.close()
+
+
+class ChunkList(Sequence):
+    """The chunks of several SplitDocuments as one sequence of strings.
+
+    Items are built as ChunkText when accessed, so only the chunks of the
+    batch being embedded exist as separate strings at any time.
+    """
+
+    def __init__(self):
+        self._documents = []
+        self._ends = []
+
+    def append(self, document):
+        self._documents.append(document)
+        self._ends.append(len(self) + len(document.spans))
+
+    def __len__(self):
+        return self._ends[-1] if self._ends else 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        position = bisect.bisect_right(self._ends, index)
+        document_start = self._ends[position - 1] if position else 0
+        return self._documents[position].chunk(index - document_start)
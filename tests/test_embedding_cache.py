@@ -0,0 +1,82 @@
+import pytest
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache, text_hash
+from fakes import HashEmbeddings, write_synthetic_pdf
+from ingest import sync_vector_store
+
+DIMENSION = 16
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_repeated_texts_are_served_from_the_cache(cache):
+    model = HashEmbeddings(dimension=DIMENSION)
+    embeddings = CachedEmbeddings(model, "fake-model", cache)
+
+    first = embeddings.embed_documents(["alpha", "beta", "alpha"])
+    second = embeddings.embed_documents(["beta", "alpha"])
+
+    assert model.texts_embedded == 2
+    assert second == [first[1], first[0]]
+    assert cache.stats()["hits"] == 2
+
+
+def test_another_model_name_misses(cache):
+    model = HashEmbeddings(dimension=DIMENSION)
+    CachedEmbeddings(model, "fake-model", cache).embed_documents(["alpha"])
+    CachedEmbeddings(model, "other-model", cache).embed_documents(["alpha"])
+
+    assert model.texts_embedded == 2
+    assert cache.get_many("fake-model", [text_hash("alpha")])
+    assert not cache.get_many("fake-model#query", [text_hash("alpha")])
+
+
+def test_least_recently_used_entries_are_evicted_past_the_budget(tmp_path):
+    vector_bytes = DIMENSION * 4
+    # Room for three and a half vectors; eviction trims to 90% of it.
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"), max_bytes=int(3.5 * vector_bytes))
+    embeddings = CachedEmbeddings(HashEmbeddings(dimension=DIMENSION), "fake-model", cache)
+    for text in "abc":
+        embeddings.embed_documents([text])
+    # Touching "a" makes "b" the least recently used entry.
+    cache.get_many("fake-model", [text_hash("a")])
+
+    embeddings.embed_documents(["d"])
+
+    stored = cache.get_many("fake-model", [text_hash(text) for text in "abcd"])
+    assert set(stored) == {text_hash("a"), text_hash("c"), text_hash("d")}
+    assert cache.stats()["bytes"] == 3 * vector_bytes
+    cache.close()
+
+
+def test_replacing_an_entry_keeps_the_byte_count(cache):
+    vector = [0.5] * DIMENSION
+    cache.put_many("fake-model", [("a", vector), ("b", vector)])
+    cache.put_many("fake-model", [("a", vector), ("a", vector)])
+
+    assert cache.stats()["bytes"] == 2 * DIMENSION * 4
+
+
+def test_rebuild_reuses_stored_vectors(cache, tmp_path):
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    for i in range(3):
+        write_synthetic_pdf(str(pdf_dir / f"paper_{i}.pdf"),
+                            [f"Paper {i} page {page} describes gene variant {i * 10 + page}. " * 20
+                             for page in range(2)])
+    model = HashEmbeddings(dimension=DIMENSION)
+    embeddings = CachedEmbeddings(model, "fake-model", cache)
+
+    first = sync_vector_store(embeddings, str(pdf_dir), str(tmp_path / "index"))
+    embedded = model.texts_embedded
+    # A fresh index over the same PDFs needs no new embeddings.
+    second = sync_vector_store(embeddings, str(pdf_dir), str(tmp_path / "rebuilt"))
+
+    assert first["chunks_added"] == second["chunks_added"] == embedded > 0
+    assert model.texts_embedded == embedded
+    assert cache.stats()["hits"] == embedded
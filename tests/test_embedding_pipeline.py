@@ -0,0 +1,124 @@
+import functools
+import time
+
+import pytest
+
+import embedding_pipeline
+import ingest
+from embedding_pipeline import EmbeddingPipelineError, TokenBucket, embed_in_batches
+from fakes import BagOfWordsEmbeddings, SimulatedAPIError, write_synthetic_pdf
+
+DIMENSION = 16
+
+
+class FlakyEmbeddings(BagOfWordsEmbeddings):
+    """Fails its first failures calls, and every call with a text containing poison."""
+
+    def __init__(self, failures=0, poison=None, **kwargs):
+        super().__init__(dimension=DIMENSION, **kwargs)
+        self.pending_failures = failures
+        self.poison = poison
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            fail = self.pending_failures > 0 or (self.poison is not None and any(self.poison in t for t in texts))
+            self.pending_failures = max(0, self.pending_failures - 1)
+        try:
+            if fail:
+                with self._lock:
+                    self.calls += 1
+                    self.failures += 1
+                raise SimulatedAPIError("simulated transient embedding failure")
+            return super().embed_documents(texts)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def _embed_all(model, texts, **kwargs):
+    vectors = {}
+
+    def on_batch(start, batch):
+        for offset, vector in enumerate(batch):
+            vectors[start + offset] = vector
+
+    embed_in_batches(model, texts, on_batch, **kwargs)
+    return [vectors[i] for i in range(len(vectors))]
+
+
+def test_transient_failures_are_retried():
+    model = FlakyEmbeddings(failures=3)
+    texts = [f"gene {word} expression" for word in "abcdefgh"]
+
+    vectors = _embed_all(model, texts, batch_size=2, max_in_flight=1, base_delay=0.0)
+
+    assert vectors == BagOfWordsEmbeddings(dimension=DIMENSION).embed_documents(texts)
+    assert model.failures == 3
+    assert model.calls == 4 + 3
+
+
+def test_backoff_doubles_up_to_max_delay(monkeypatch):
+    delays = []
+    # The upper bound of each jittered delay, without sleeping.
+    monkeypatch.setattr(embedding_pipeline.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(embedding_pipeline.time, "sleep", delays.append)
+
+    _embed_all(FlakyEmbeddings(failures=4), ["alpha"], max_retries=5, base_delay=1.0, max_delay=5.0)
+
+    assert delays == [1.0, 2.0, 4.0, 5.0]
+
+
+def test_exhausted_retries_raise_after_finished_batches_are_handed_over():
+    model = FlakyEmbeddings(poison="poison")
+    texts = ["alpha", "beta", "poison", "gamma"]
+    done = []
+
+    with pytest.raises(EmbeddingPipelineError):
+        embed_in_batches(model, texts, lambda start, batch: done.append(start),
+                         batch_size=1, max_in_flight=1, max_retries=2, base_delay=0.0)
+
+    # Batches before the failing one stay done; none start after it.
+    assert done == [0, 1]
+    assert model.failures == 3
+
+
+def test_in_flight_batches_are_bounded():
+    model = FlakyEmbeddings(latency=0.02)
+
+    _embed_all(model, [f"text {i}" for i in range(24)], batch_size=2, max_in_flight=3)
+
+    assert 2 <= model.max_in_flight <= 3
+
+
+def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=50.0, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    # The first token is available at once, the next five at 50 per second.
+    assert time.monotonic() - start >= 0.09
+
+
+def test_sync_resumes_with_the_files_that_did_not_finish(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_pipeline.random, "uniform", lambda low, high: 0.0)
+    monkeypatch.setattr(ingest, "embed_in_batches", functools.partial(embed_in_batches, batch_size=1, max_in_flight=1))
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    for name in ("alpha", "beta"):
+        write_synthetic_pdf(str(pdf_dir / f"{name}.pdf"), [f"The {name} paper describes variant calling. " * 10])
+    index_path = str(tmp_path / "index")
+
+    with pytest.raises(EmbeddingPipelineError):
+        ingest.sync_vector_store(FlakyEmbeddings(poison="beta"), str(pdf_dir), index_path)
+    model = FlakyEmbeddings()
+    summary = ingest.sync_vector_store(model, str(pdf_dir), index_path)
+
+    # Only the file whose chunks failed is embedded again.
+    assert summary["added"] == 1
+    assert model.texts_embedded == summary["chunks_added"] > 0
+    assert ingest.index_is_current(str(pdf_dir), index_path)
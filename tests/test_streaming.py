@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+import query_cache
+import rag
+from fakes import FakeGenerativeModel
+
+DOCS = ["BWA aligns short reads to a reference genome."]
+METADATAS = [{"source": "alignment.pdf", "id": 1}]
+ANSWER = "Use BWA-MEM to align the reads, then sort and index the BAM file with samtools."
+
+
+@pytest.fixture(autouse=True)
+def empty_answer_cache():
+    query_cache.answers.clear()
+    yield
+    query_cache.answers.clear()
+
+
+def _stream(query, model):
+    return rag.stream_response(query, DOCS, METADATAS, api_key=None, model=model)
+
+
+def _wait_for_followers(count, coalesced_before, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while query_cache.answer_flight.coalesced < coalesced_before + count:
+        assert time.monotonic() < deadline, "followers never joined the leader's call"
+        time.sleep(0.005)
+
+
+def _in_thread(fn):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", fn()))
+    thread.start()
+    return thread, result
+
+
+def test_answer_is_streamed_in_chunks_with_timings():
+    model = FakeGenerativeModel(ANSWER, first_token_delay=0.05, chunk_delay=0.01, chunk_size=10)
+    stream = _stream("How do I align reads?", model)
+
+    chunks = list(stream)
+
+    assert len(chunks) == len(ANSWER) // 10 + 1
+    assert "".join(chunks) == stream.text == ANSWER
+    assert stream.time_to_first_token >= 0.05
+    assert stream.total_time >= stream.time_to_first_token + 0.01 * (len(chunks) - 1)
+    assert stream.context_report is not None
+
+
+def test_completed_stream_is_cached_for_streamed_and_plain_answers():
+    model = FakeGenerativeModel(ANSWER, chunk_size=10)
+    list(_stream("How do I align reads?", model))
+
+    replayed = list(_stream("how do I align reads", model))
+    answer = rag.generate_response("How do I align reads?", DOCS, METADATAS, api_key=None, model=model)
+
+    assert replayed == [ANSWER]
+    assert answer == ANSWER
+    assert model.calls == 1
+
+
+def test_followers_receive_the_leaders_streamed_answer():
+    model = FakeGenerativeModel(ANSWER, chunk_size=10)
+    coalesced = query_cache.answer_flight.coalesced
+    leader = iter(_stream("How do I align reads?", model))
+    first = next(leader)
+
+    streamed, streamed_result = _in_thread(lambda: list(_stream("How do I align reads?", model)))
+    plain, plain_result = _in_thread(
+        lambda: rag.generate_response("How do I align reads?", DOCS, METADATAS, api_key=None, model=model)
+    )
+    _wait_for_followers(2, coalesced)
+    rest = list(leader)
+    streamed.join(5)
+    plain.join(5)
+
+    assert first + "".join(rest) == ANSWER
+    # A follower gets the complete answer as one chunk once the leader is done.
+    assert streamed_result["value"] == [ANSWER]
+    assert plain_result["value"] == ANSWER
+    assert model.calls == 1
+
+
+def test_follower_generates_the_answer_when_the_leader_abandons_its_stream():
+    model = FakeGenerativeModel(ANSWER, chunk_size=10)
+    coalesced = query_cache.answer_flight.coalesced
+    leader = iter(_stream("How do I align reads?", model))
+    next(leader)
+
+    follower, result = _in_thread(lambda: list(_stream("How do I align reads?", model)))
+    _wait_for_followers(1, coalesced)
+    leader.close()
+    follower.join(5)
+
+    assert "".join(result["value"]) == ANSWER
+    assert len(result["value"]) > 1
+    assert model.calls == 2
+    assert query_cache.answers.get(rag._answer_key("How do I align reads?", DOCS, METADATAS, "en", None)) == ANSWER
+
+
+def test_single_flight_join_hands_over_results_errors_and_abandoned_calls():
+    flight = query_cache.SingleFlight("test")
+    assert flight.join("key") == (True, None)
+    waiting, result = _in_thread(lambda: flight.join("key"))
+    while flight.coalesced < 1:
+        time.sleep(0.005)
+
+    flight.abandon("key")
+    waiting.join(5)
+    # The waiting caller leads the retried call.
+    assert result["value"] == (True, None)
+
+    failing, failure = _in_thread(lambda: pytest.raises(ValueError, flight.join, "key"))
+    while flight.coalesced < 2:
+        time.sleep(0.005)
+    flight.fail("key", ValueError("generation failed"))
+    failing.join(5)
+    assert str(failure["value"].value) == "generation failed"
@@ -0,0 +1,538 @@
+"""FAISS index plus an offset-indexed chunk store, persisted without pickle.
+
+Layout of an index directory:
+
+    index.faiss       FAISS index (flat, HNSW, IVF-Flat or IVF-PQ); vector ids are
+                      row numbers in chunks.npy
+    store.json        index type, vector counts and a version that changes on every save
+    chunks.npy        int64 rows of (text offset, text length, meta offset, meta length, deleted)
+    chunks_text.bin   UTF-8 texts: the part of a document a save covers is written
+                      once, with its chunks' rows pointing at overlapping extents
+                      of it (see ChunkText)
+    chunks_meta.bin   UTF-8 JSON metadata, back to back
+    lexical_*         BM25 inverted index over the same chunk ids (see lexical_index)
+
+Readers memory-map every file, so opening an index costs the same regardless of
+corpus size, chunk text is only read when a search returns it, and processes
+serving the same index share pages through the OS page cache. The text and
+metadata files are append-only; deleting a chunk only marks its row.
+"""
+import json
+import math
+import mmap
+import os
+import uuid
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from config import (
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    IVF_NLIST,
+    IVF_NPROBE,
+)
+from lexical_index import LexicalIndex
+
+INDEX_FILENAME = "index.faiss"
+ROWS_FILENAME = "chunks.npy"
+TEXT_FILENAME = "chunks_text.bin"
+META_FILENAME = "chunks_meta.bin"
+STORE_INFO_FILENAME = "store.json"
+STORE_FILES = (INDEX_FILENAME, ROWS_FILENAME, TEXT_FILENAME, META_FILENAME, STORE_INFO_FILENAME)
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+# Corpus sizes (in vectors) for which "auto" picks each index type.
+AUTO_INDEX_RANGES = {
+    "flat": (0, 20_000),
+    "hnsw": (20_000, 1_000_000),
+    "ivf_pq": (1_000_000, float("inf")),
+}
+AUTO_INDEX_MARGIN = 0.2
+IVF_MIN_VECTORS = 1_000
+
+_DELETED = 1
+
+
+def _map_file(filepath):
+    """Read-only mmap of a file, or b"" for an empty or missing one."""
+    try:
+        with open(filepath, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return b""
+
+
+def _replace_file(filepath, write):
+    tmp_file = filepath + ".tmp"
+    write(tmp_file)
+    os.replace(tmp_file, filepath)
+
+
+def store_exists(index_path):
+    return all(os.path.exists(os.path.join(index_path, name)) for name in STORE_FILES)
+
+
+class ChunkText(str):
+    """A chunk's text that also knows its extent [byte_start, byte_end) in its
+    document's UTF-8 text (document.encoded), so a ChunkStore writes the
+    document once and stores the chunk as a span of it."""
+
+    def __new__(cls, text, document, byte_start, byte_end):
+        chunk = super().__new__(cls, text)
+        chunk.document = document
+        chunk.byte_start = byte_start
+        chunk.byte_end = byte_end
+        return chunk
+
+
+class _StoredRegion:
+    """Bytes read back from a text file, standing in for the document they came from."""
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+
+
+class ChunkStore:
+    """Chunk texts and metadata addressed by integer id.
+
+    Rows on disk are memory-mapped; rows added since the last save are held in
+    memory until save() appends them. A pending text is either its own UTF-8
+    bytes or (document, byte offset, byte length) for a ChunkText.
+    """
+
+    def __init__(self, index_path=None, writable=False):
+        self._text = b""
+        self._meta = b""
+        self._rows = np.zeros((0, 5), dtype=np.int64)
+        self._pending = []
+        if index_path is not None and os.path.exists(os.path.join(index_path, ROWS_FILENAME)):
+            self._text = _map_file(os.path.join(index_path, TEXT_FILENAME))
+            self._meta = _map_file(os.path.join(index_path, META_FILENAME))
+            rows = np.load(os.path.join(index_path, ROWS_FILENAME), mmap_mode="r")
+            self._rows = np.array(rows) if writable else rows
+
+    def __len__(self):
+        return len(self._rows) + len(self._pending)
+
+    def add(self, texts, metadatas):
+        """Adds chunks and returns their ids."""
+        start = len(self)
+        for text, metadata in zip(texts, metadatas):
+            if isinstance(text, ChunkText):
+                text = (text.document, text.byte_start, text.byte_end - text.byte_start)
+            else:
+                text = text.encode("utf-8")
+            self._pending.append((text, json.dumps(metadata).encode("utf-8")))
+        return list(range(start, len(self)))
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            if chunk_id < len(self._rows):
+                self._rows[chunk_id, 4] = _DELETED
+            else:
+                self._pending[chunk_id - len(self._rows)] = None
+
+    def alive(self, chunk_id):
+        """Returns whether a chunk exists and has not been deleted."""
+        if chunk_id < 0 or chunk_id >= len(self):
+            return False
+        if chunk_id >= len(self._rows):
+            return self._pending[chunk_id - len(self._rows)] is not None
+        return not self._rows[chunk_id, 4] & _DELETED
+
+    def get(self, chunk_id):
+        """Returns (text, metadata) for a chunk, or None if it does not exist."""
+        if chunk_id < 0 or chunk_id >= len(self):
+            return None
+        if chunk_id >= len(self._rows):
+            entry = self._pending[chunk_id - len(self._rows)]
+            if entry is None:
+                return None
+            text, meta = entry
+            if isinstance(text, tuple):
+                document, offset, length = text
+                text = document.encoded[offset:offset + length]
+        else:
+            text_off, text_len, meta_off, meta_len, flags = (int(v) for v in self._rows[chunk_id])
+            if flags & _DELETED:
+                return None
+            text = self._text[text_off:text_off + text_len]
+            meta = self._meta[meta_off:meta_off + meta_len]
+        return bytes(text).decode("utf-8"), json.loads(bytes(meta))
+
+    def get_texts(self, ids):
+        """Returns the texts of existing chunks as ChunkText, sharing documents
+        the way they are stored, so adding them to another store (a rebuild)
+        keeps every document's text once."""
+        texts = {}
+        saved = []
+        for chunk_id in ids:
+            if chunk_id >= len(self._rows):
+                text, _ = self._pending[chunk_id - len(self._rows)]
+                if isinstance(text, tuple):
+                    document, offset, length = text
+                    texts[chunk_id] = ChunkText(
+                        document.encoded[offset:offset + length].decode("utf-8"), document, offset, offset + length
+                    )
+                else:
+                    texts[chunk_id] = text.decode("utf-8")
+            else:
+                offset, length = (int(v) for v in self._rows[chunk_id, :2])
+                saved.append((offset, offset + length, chunk_id))
+        # Overlapping or touching extents are read as one region, so text
+        # shared by several chunks is copied once.
+        saved.sort()
+        region_start = region_end = None
+        members = []
+
+        def flush():
+            region = _StoredRegion(bytes(self._text[region_start:region_end]))
+            for start, end, chunk_id in members:
+                text = region.encoded[start - region_start:end - region_start].decode("utf-8")
+                texts[chunk_id] = ChunkText(text, region, start - region_start, end - region_start)
+
+        for start, end, chunk_id in saved:
+            if members and start > region_end:
+                flush()
+                members = []
+            if not members:
+                region_start, region_end = start, end
+            region_end = max(region_end, end)
+            members.append((start, end, chunk_id))
+        if members:
+            flush()
+        return [texts[chunk_id] for chunk_id in ids]
+
+    def save(self, index_path):
+        """Appends pending chunks to the data files, then atomically replaces the row table."""
+        text_file = os.path.join(index_path, TEXT_FILENAME)
+        meta_file = os.path.join(index_path, META_FILENAME)
+        # Start from the sizes the current rows refer to, dropping any tail left
+        # behind by an interrupted save. Deleted rows keep their extents, so no
+        # byte an older reader may still map is ever truncated away.
+        text_end = int(max(self._rows[:, 0] + self._rows[:, 1], default=0))
+        meta_end = int(max(self._rows[:, 2] + self._rows[:, 3], default=0))
+        if not len(self._rows):
+            # Unlink rather than truncate a previous store's files, which
+            # readers may still have mapped.
+            for filepath in (text_file, meta_file):
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+        new_rows = []
+        # The part of each document this save's chunks cover, written once.
+        extents = {}
+        for entry in self._pending:
+            if entry is not None and isinstance(entry[0], tuple):
+                document, offset, length = entry[0]
+                low, high = extents.get(document, (offset, offset + length))
+                extents[document] = (min(low, offset), max(high, offset + length))
+        # File offset of byte 0 of every document written by this save.
+        documents = {}
+        with open(text_file, "ab") as text_out, open(meta_file, "ab") as meta_out:
+            text_out.truncate(text_end)
+            meta_out.truncate(meta_end)
+            for entry in self._pending:
+                if entry is None:
+                    new_rows.append((text_end, 0, meta_end, 0, _DELETED))
+                    continue
+                text, meta = entry
+                if isinstance(text, tuple):
+                    document, offset, length = text
+                    if document not in documents:
+                        low, high = extents[document]
+                        documents[document] = text_end - low
+                        text_out.write(document.encoded[low:high])
+                        text_end += high - low
+                    text_off, text_len = documents[document] + offset, length
+                else:
+                    text_out.write(text)
+                    text_off, text_len = text_end, len(text)
+                    text_end += len(text)
+                meta_out.write(meta)
+                new_rows.append((text_off, text_len, meta_end, len(meta), 0))
+                meta_end += len(meta)
+            text_out.flush()
+            os.fsync(text_out.fileno())
+            meta_out.flush()
+            os.fsync(meta_out.fileno())
+
+        rows = np.concatenate([self._rows, np.array(new_rows, dtype=np.int64).reshape(-1, 5)])
+
+        def write_rows(tmp_file):
+            with open(tmp_file, "wb") as f:
+                np.save(f, rows)
+
+        _replace_file(os.path.join(index_path, ROWS_FILENAME), write_rows)
+        self._rows = rows
+        self._pending = []
+        self._text = _map_file(text_file)
+        self._meta = _map_file(meta_file)
+
+
+def resolve_index_type(index_type, size, current=None):
+    """Maps an index type setting to a concrete type for a corpus of size vectors.
+
+    "auto" picks exact search for small corpora, HNSW up to a million vectors
+    and IVF-PQ beyond. An existing auto-chosen type is kept until the size
+    leaves its range by a margin, so a corpus hovering around a threshold is
+    not rebuilt on every sync.
+    """
+    if index_type == "auto":
+        low, high = AUTO_INDEX_RANGES.get(current, (None, None))
+        if low is not None and low * (1 - AUTO_INDEX_MARGIN) <= size < high * (1 + AUTO_INDEX_MARGIN):
+            index_type = current
+        else:
+            index_type = next(name for name, (low, high) in AUTO_INDEX_RANGES.items() if low <= size < high)
+    elif index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Expected one of: auto, {', '.join(INDEX_TYPES)}.")
+    if index_type.startswith("ivf") and size < IVF_MIN_VECTORS:
+        # Too few vectors to train the coarse quantizer (and PQ codebooks).
+        index_type = "flat"
+    return index_type
+
+
+def _ivf_nlist(size):
+    if IVF_NLIST:
+        return IVF_NLIST
+    # ~4 * sqrt(n) lists, keeping ~39 training points per centroid as FAISS asks.
+    return max(1, min(int(4 * math.sqrt(size)), size // 39))
+
+
+def _pq_subquantizers(dimension):
+    # The largest divisor of the dimension giving sub-vectors of at least 8 floats.
+    return max(m for m in range(1, dimension // 8 + 1) if dimension % m == 0) if dimension >= 8 else 1
+
+
+def make_index(index_type, dimension, size):
+    """Creates an empty FAISS index of the given type that accepts explicit ids.
+
+    Flat and HNSW indexes are wrapped in IDMap2. IVF indexes store ids in their
+    inverted lists, and must not be wrapped: IDMap2 assumes removal renumbers
+    the inner index the way a flat index does.
+    """
+    if index_type == "flat":
+        description = "Flat"
+    elif index_type == "hnsw":
+        description = f"HNSW{HNSW_M}"
+    elif index_type == "ivf_flat":
+        description = f"IVF{_ivf_nlist(size)},Flat"
+    elif index_type == "ivf_pq":
+        description = f"IVF{_ivf_nlist(size)},PQ{_pq_subquantizers(dimension)}x8"
+    else:
+        raise ValueError(f"Unknown index type '{index_type}'.")
+    if not index_type.startswith("ivf"):
+        description = f"IDMap2,{description}"
+    index = faiss.index_factory(dimension, description)
+    if index_type == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    configure_search(index)
+    return index
+
+
+def configure_search(index, ef_search=HNSW_EF_SEARCH, nprobe=IVF_NPROBE):
+    """Applies the search-time tuning parameters (efSearch, nprobe) to an index."""
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+
+
+def read_store_info(index_path):
+    """Returns the index type, vector counts and version recorded by FaissStore.save."""
+    try:
+        with open(os.path.join(index_path, STORE_INFO_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"index_type": "flat", "vectors": 0, "stale_vectors": 0, "version": None}
+
+
+class FaissStore:
+    """Vector search over a FAISS index whose ids point into a ChunkStore.
+
+    The FAISS index is created on the first add, sized for expected_size
+    vectors. IVF indexes buffer vectors until there are enough to train on.
+    Index types that cannot remove vectors (HNSW) keep deleted ones as stale
+    entries that searches skip.
+    """
+
+    def __init__(self, index=None, chunks=None, index_type="flat", expected_size=0, stale_vectors=0,
+                 version=None, lexical=None):
+        self.index = index
+        if chunks is None:
+            chunks = ChunkStore(writable=True)
+            lexical = LexicalIndex()
+        self.chunks = chunks
+        # None until first use for stores saved without a lexical index.
+        self._lexical = lexical
+        self.index_type = index_type
+        self.expected_size = expected_size
+        self.stale_vectors = stale_vectors
+        # Changes on every save, so caches can tell when the index they were filled from is gone.
+        self.version = version
+        self._untrained = []
+
+    @classmethod
+    def load(cls, index_path, writable=False):
+        """Opens a persisted store.
+
+        Read-only stores memory-map the FAISS index; writable ones load it into
+        memory, since a mapped index cannot be modified.
+        """
+        info = read_store_info(index_path)
+        index_file = os.path.join(index_path, INDEX_FILENAME)
+        if writable:
+            index = faiss.read_index(index_file)
+        else:
+            try:
+                index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                # Not every index type can be mapped.
+                index = faiss.read_index(index_file, faiss.IO_FLAG_READ_ONLY)
+        configure_search(index)
+        return cls(index, ChunkStore(index_path, writable=writable),
+                   index_type=info["index_type"], stale_vectors=info["stale_vectors"],
+                   version=info.get("version"), lexical=LexicalIndex.load(index_path, writable=writable))
+
+    @property
+    def lexical(self):
+        """The BM25 index over the chunks, built from the chunk store for stores saved without one."""
+        if self._lexical is None:
+            self._lexical = LexicalIndex.from_chunks(self.chunks)
+        return self._lexical
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    def ids(self):
+        """Returns the ids of every vector in the index."""
+        if self.index is None:
+            return []
+        if hasattr(self.index, "id_map"):
+            return faiss.vector_to_array(self.index.id_map).tolist()
+        invlists = faiss.extract_index_ivf(self.index).invlists
+        ids = []
+        for list_no in range(invlists.nlist):
+            size = invlists.list_size(list_no)
+            if size:
+                ids.extend(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).tolist())
+        return ids
+
+    def add_embeddings(self, text_embeddings, metadatas):
+        """Adds (text, vector) pairs and returns their ids."""
+        texts, vectors = zip(*text_embeddings)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.index is None:
+            size = max(self.expected_size, len(vectors))
+            self.index = make_index(self.index_type, vectors.shape[1], size)
+        # Resolved before the chunks are added, or a lexical index built from
+        # the chunk store would index them twice.
+        lexical = self.lexical
+        ids = self.chunks.add(texts, metadatas)
+        lexical.add(ids, texts)
+        if self.index.is_trained:
+            self.index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+        else:
+            self._untrained.append((vectors, ids))
+            buffered = sum(len(batch) for batch, _ in self._untrained)
+            nlist = faiss.extract_index_ivf(self.index).nlist
+            if buffered >= min(max(self.expected_size, 1), max(IVF_MIN_VECTORS, 64 * nlist)):
+                self._train()
+        return ids
+
+    def _train(self):
+        vectors = np.concatenate([batch for batch, _ in self._untrained])
+        ids = np.asarray([chunk_id for _, batch_ids in self._untrained for chunk_id in batch_ids], dtype=np.int64)
+        self.index.train(vectors)
+        self.index.add_with_ids(vectors, ids)
+        self._untrained = []
+
+    def delete(self, ids):
+        ids = [chunk_id for chunk_id in ids if self.chunks.alive(chunk_id)]
+        if not ids:
+            return
+        if self.index is not None:
+            try:
+                self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+            except RuntimeError:
+                self.stale_vectors += len(ids)
+        self.lexical.delete(ids)
+        self.chunks.delete(ids)
+
+    def save(self, index_path):
+        """Persists the store. The chunk rows are written before the index, so
+        every id the saved index returns resolves to a chunk."""
+        if self._untrained:
+            self._train()
+        os.makedirs(index_path, exist_ok=True)
+        self.chunks.save(index_path)
+        self.lexical.save(index_path)
+        index_file = os.path.join(index_path, INDEX_FILENAME)
+        if self.index is not None:
+            _replace_file(index_file, lambda tmp_file: faiss.write_index(self.index, tmp_file))
+        elif os.path.exists(index_file):
+            os.remove(index_file)
+
+        self.version = uuid.uuid4().hex
+        info = {
+            "index_type": self.index_type,
+            "vectors": self.ntotal,
+            "stale_vectors": self.stale_vectors,
+            "version": self.version,
+        }
+
+        def write_info(tmp_file):
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(info, f)
+
+        _replace_file(os.path.join(index_path, STORE_INFO_FILENAME), write_info)
+
+    def similarity_search_by_vector_with_score(self, vector, k=4):
+        """Returns [(Document, L2 distance)] for the k nearest chunks; each metadata carries its chunk "id"."""
+        return self.similarity_search_by_vectors_with_score([vector], k)[0]
+
+    def similarity_search_by_vectors_with_score(self, vectors, k=4):
+        """Searches for several query vectors in one FAISS call; returns one result list per vector."""
+        if not self.ntotal:
+            return [[] for _ in vectors]
+        queries = np.asarray(vectors, dtype=np.float32)
+        # Over-fetch by the number of stale vectors so deleted chunks never crowd out k results.
+        distances, ids = self.index.search(queries, min(self.ntotal, k + self.stale_vectors))
+        batch_results = []
+        for row_distances, row_ids in zip(distances, ids):
+            results = []
+            for distance, chunk_id in zip(row_distances, row_ids):
+                if chunk_id < 0:
+                    continue
+                document = self._document(int(chunk_id))
+                if document is None:
+                    continue
+                results.append((document, float(distance)))
+                if len(results) == k:
+                    break
+            batch_results.append(results)
+        return batch_results
+
+    def lexical_search_with_score(self, query, k=4):
+        """Returns [(Document, BM25 score)] for the k best keyword matches, best first."""
+        results = []
+        for chunk_id, score in self.lexical.search(query, k):
+            document = self._document(chunk_id)
+            if document is not None:
+                results.append((document, score))
+        return results
+
+    def _document(self, chunk_id):
+        chunk = self.chunks.get(chunk_id)
+        if chunk is None:
+            return None
+        text, metadata = chunk
+        metadata["id"] = chunk_id
+        return Document(page_content=text, metadata=metadata)